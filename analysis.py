@@ -1,28 +1,41 @@
 # -*- coding: utf-8 -*-
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime
 import statsmodels.api as sm
 import matplotlib.cm as cm
 import matplotlib.colors as colors
+from matplotlib.collections import LineCollection
 
 
 def plot_space_time(agent_pos, 
                     dt = 0.2,
-                    space_time_filename = 'space_time'
+                    space_time_filename = 'space_time',
+                    color_by_speed = False,  # True to colour the trajectories by the speed of the cyclists
+                    cmap = 'plasma'
                     ):
     
-    pd.set_option('display.max_columns', None)
-    unique_cyclists = agent_pos.AgentID.unique()
-    print(unique_cyclists)
+    # trajectories grouped once: records sorted by cyclist and step, split where the cyclist changes
+    agent = pd.factorize(agent_pos['AgentID'].to_numpy())[0]
+    step = agent_pos['Step'].to_numpy()
+    order = np.lexsort((step, agent))
+    agent = agent[order]
+    points = np.column_stack([step[order]*dt, agent_pos['Position_x'].to_numpy()[order]])
     
-    agent_pos['Time'] = agent_pos['Step'] * dt
-    print(agent_pos)
     fig, ax = plt.subplots(figsize=(6,4), layout='constrained')
-    for i in unique_cyclists:
-        cyclist_traj = agent_pos[agent_pos.AgentID == i]
-        ax.plot(cyclist_traj['Time'], cyclist_traj['Position_x'], color='black', linewidth=0.5)
+    if color_by_speed:
+        # one segment per pair of consecutive records of a cyclist, coloured by its speed
+        same = np.flatnonzero(agent[1:] == agent[:-1])
+        lines = LineCollection(np.stack([points[same], points[same+1]], axis=1), cmap=cmap, linewidths=0.5)
+        lines.set_array(agent_pos['Speed'].to_numpy()[order][same])
+        ax.add_collection(lines)
+        fig.colorbar(lines, ax=ax, label='Speed (m/s)')
+    else:
+        starts = np.flatnonzero(np.diff(agent)) + 1
+        ax.add_collection(LineCollection(np.split(points, starts), colors='black', linewidths=0.5))
+    ax.autoscale()
     ax.set_title(space_time_filename)
     ax.set_xlabel('Time (s)')
     ax.set_ylabel('Distance (m)')
@@ -34,58 +47,90 @@ def plot_space_time(agent_pos,
         fig.savefig("figures/" + space_time_filename + datetime.now().strftime("_%Y-%m-%d_%H%M") + ".png", format='png', dpi=400)
 
 
-def plot_fd(agent_pos,  # model data frame
+# flow, density and speed per aggregation interval (Edie's definitions) as used in the fundamental diagram
+def compute_fd(agent_pos,  # model data frame
+               dt = 0.2,  # time step length (s)
+               duration = 3600,  # simulation duration (s)
+               agg_time = 15,  # aggregation interval for fundamental diagram (s)
+               agg_dist = [100, 250],  # aggregation distance / space for fundamental diagram (min and max value in m)
+               path_width = 2):
+    
+    agg_steps = int(agg_time/dt)
+    n_intervals = int((duration/dt)//agg_steps)  # complete aggregation intervals ((i-1)*agg_steps, i*agg_steps] within the duration
+    T = agg_time
+    L = agg_dist[1]-agg_dist[0]  # length to derive the FD from
+    
+    # interval of every record in the aggregation space (one pass over the data instead of one filter per interval and cyclist)
+    step = agent_pos['Step'].to_numpy()
+    x = agent_pos['Position_x'].to_numpy()
+    inside = (step > 0) & (step <= n_intervals*agg_steps) & (x <= agg_dist[1]) & (x > agg_dist[0])
+    records = pd.DataFrame({'Interval': (step[inside]-1)//agg_steps + 1,
+                            'Agent': pd.factorize(agent_pos['AgentID'].to_numpy()[inside])[0],
+                            'Position_x': x[inside]})
+    
+    # distance travelled (max-min x) and time spent (records*dt) by every cyclist in every interval, summed per interval
+    per_cyclist = records.groupby(['Interval', 'Agent'], sort=False)['Position_x'].agg(['min', 'max', 'size'])
+    per_cyclist['vkt'] = per_cyclist['max'] - per_cyclist['min']
+    per_cyclist['vht'] = per_cyclist['size']*dt
+    totals = per_cyclist.groupby(level='Interval')[['vkt', 'vht']].sum().reindex(range(1, n_intervals+1), fill_value=0)
+    vkt_sum = totals['vkt'].to_numpy(dtype=float)
+    vht_sum = totals['vht'].to_numpy(dtype=float)
+    
+    q_k_v = pd.DataFrame({'Time_(s)': np.arange(1, n_intervals+1)*agg_time,
+                          'Flow': vkt_sum / (T*L),
+                          'Density': vht_sum / (T*L),
+                          'Speed': np.divide(vkt_sum, vht_sum, out=np.zeros(n_intervals), where=vht_sum != 0)})
+    q_k_v['Flow_(/h/m)'] = (q_k_v['Flow']*3600)/path_width
+    q_k_v['Density_(/m2)'] = q_k_v['Density']/path_width
+    return q_k_v
+
+
+# smoothed curve of y over x: mean of y in equal-width bins of x, interpolated linearly between the bin centres (fast for many points)
+def binned_smoother(y, x, bins = 40):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(x.min(), x.max(), bins+1)
+    which = np.clip(np.searchsorted(edges, x, side='right')-1, 0, bins-1)
+    counts = np.bincount(which, minlength=bins)
+    means = np.bincount(which, weights=y, minlength=bins)[counts > 0] / counts[counts > 0]
+    centres = ((edges[:-1]+edges[1:])/2)[counts > 0]
+    return np.interp(x, centres, means)
+
+
+# flow-density and speed-density curves fitted to an FD table of compute_fd (sorted by density, with the columns Flow_Fit and Speed_Fit)
+def fit_fd(q_k_v,  # FD table of compute_fd
+           smoother = 'auto',  # 'lowess', 'binned' or 'auto' (lowess up to max_lowess_points points)
+           frac = 1./2,  # share of the points used for each lowess fit
+           bins = 40,  # number of density bins of the binned smoother
+           max_lowess_points = 2000):
+    
+    # https://www.statsmodels.org/dev/generated/statsmodels.nonparametric.smoothers_lowess.lowess.html
+    q_k_v = q_k_v.sort_values(by='Density_(/m2)').reset_index(drop=True)
+    if smoother == 'auto':
+        smoother = 'lowess' if len(q_k_v) <= max_lowess_points else 'binned'
+    density = q_k_v['Density_(/m2)'].astype(float)
+    for column, fit in [('Flow_(/h/m)', 'Flow_Fit'), ('Speed', 'Speed_Fit')]:
+        if smoother == 'lowess':
+            q_k_v[fit] = sm.nonparametric.lowess(q_k_v[column].astype(float), density, frac=frac, it=3)[:,1]
+        elif smoother == 'binned':
+            q_k_v[fit] = binned_smoother(q_k_v[column], density, bins)
+        else:
+            raise ValueError("smoother must be 'lowess', 'binned' or 'auto'.")
+    return q_k_v
+
+
+def plot_fd(agent_pos,  # model data frame; None if an FD table is given
             dt = 0.2,  # time step length (s)
             duration = 3600,  # simulation duration (s)
             agg_time = 15,  # aggregation interval for fundamental diagram (s)
             agg_dist = [100, 250],  # aggregation distance / space for fundamental diagram (min and max value in m)
             path_width = 2,
-            fd_filename = "fundamental_diagram"):
+            fd_filename = "fundamental_diagram",
+            q_k_v = None,  # FD table of compute_fd (or fitted by fit_fd) to plot instead of computing it from agent_pos
+            smoother = 'auto'):  # fit of the curves (see fit_fd)
     
-    agg_steps = int(agg_time/dt)
-    agent_pos['Time'] = agent_pos['Step'] * dt
-    print(agent_pos)
-    agg_temp = 0
-    agg_intervals = []
-    while agg_temp <= (duration/dt):
-        agg_intervals.append(agg_temp)
-        agg_temp += agg_steps
-        
-    # for i in agg_intervals
-    print(agg_intervals)
-    q_k_v = pd.DataFrame(columns=['Time_(s)', 'Flow', 'Density', 'Speed'])
-    print(q_k_v)
-    
-    for i in range(1,len(agg_intervals)):
-        # print('\n\n', i)
-        agent_pos_temp = agent_pos[(agent_pos['Step'] <= agg_intervals[i]) & (agent_pos['Step'] > agg_intervals[i-1])]
-        agent_pos_temp = agent_pos_temp[(agent_pos_temp['Position_x'] <= agg_dist[1]) & (agent_pos_temp['Position_x'] > agg_dist[0])]
-        # print(agent_pos_temp)
-        unique_cyclists_temp = agent_pos_temp['AgentID'].unique()
-        # print(unique_cyclists_temp)
-        vkt_sum = 0
-        vht_sum = 0
-        T = agg_time
-        L = agg_dist[1]-agg_dist[0]  # length to derive the FD from
-        for j in unique_cyclists_temp:
-            agent = agent_pos_temp[agent_pos_temp['AgentID']==j]
-            # print(agent)
-            d_time = len(agent)*dt
-            d_distance = agent['Position_x'].max() - agent['Position_x'].min()
-            # print('dt: ', d_time, '; dx: ', d_distance)
-            vkt_sum += d_distance
-            vht_sum += d_time
-        # print(vkt_sum, vht_sum)
-        Q = vkt_sum / (T*L)
-        K = vht_sum / (T*L)
-        if vht_sum != 0:
-            V = vkt_sum/vht_sum
-        else: V = 0
-        new_row = pd.DataFrame({'Time_(s)': [i*agg_time], 'Flow': [Q], 'Density': [K], 'Speed': [V]})
-        q_k_v = pd.concat([q_k_v, new_row], ignore_index=True)
-    print(q_k_v)
-    q_k_v['Flow_(/h/m)'] = (q_k_v['Flow']*3600)/path_width
-    q_k_v['Density_(/m2)'] = q_k_v['Density']/path_width
+    if q_k_v is None:
+        q_k_v = compute_fd(agent_pos, dt, duration, agg_time, agg_dist, path_width)
     
     
     '''
@@ -93,19 +138,8 @@ def plot_fd(agent_pos,  # model data frame
     *** FIT FD CURVE ***
     ********************
     '''
-    # https://www.statsmodels.org/dev/generated/statsmodels.nonparametric.smoothers_lowess.lowess.html
-    q_k_v = q_k_v.sort_values(by='Density_(/m2)').reset_index(drop=True)
-    # print(q_k_v)
-    
-    # lowess smoothing flow
-    lowess = sm.nonparametric.lowess
-    lowess_temp = lowess(q_k_v['Flow_(/h/m)'], q_k_v['Density_(/m2)'], frac=1./2, it=3)
-    q_k_v['Flow_Lowess'] = lowess_temp[:,1]
-    
-    # lowess smoothing speed
-    lowess = sm.nonparametric.lowess
-    lowess_temp = lowess(q_k_v['Speed'], q_k_v['Density_(/m2)'], frac=1./2, it=3)
-    q_k_v['Speed_Lowess'] = lowess_temp[:,1]
+    if 'Flow_Fit' not in q_k_v:
+        q_k_v = fit_fd(q_k_v, smoother)
     
     
     '''
@@ -117,7 +151,7 @@ def plot_fd(agent_pos,  # model data frame
     fig, (ax1, ax2) = plt.subplots(nrows=2, ncols=1, figsize=(5,6))
     
     ax1.scatter(q_k_v['Density_(/m2)'], q_k_v['Flow_(/h/m)'], c=q_k_v['Time_(s)'], cmap='plasma', s=5)
-    ax1.plot(q_k_v['Density_(/m2)'], q_k_v['Flow_Lowess'], color='black')
+    ax1.plot(q_k_v['Density_(/m2)'], q_k_v['Flow_Fit'], color='black')
     ax1.set_title(fd_filename)
     ax1.set_ylabel('Bicycle flow (bic/h/m)')
     ax1.set_ylim(-200, 2900)
@@ -128,7 +162,7 @@ def plot_fd(agent_pos,  # model data frame
     plt.colorbar(scalar_map, ax=ax1, label='Time (s)')
     
     ax2.scatter(q_k_v['Density_(/m2)'], q_k_v['Speed'], c=q_k_v['Time_(s)'], cmap='plasma', s=5)
-    ax2.plot(q_k_v['Density_(/m2)'], q_k_v['Speed_Lowess'], color='black')
+    ax2.plot(q_k_v['Density_(/m2)'], q_k_v['Speed_Fit'], color='black')
     ax2.set_ylabel('Bicycle speed (m/s)')
     ax2.set_xlabel('Bicycle density (bic/m²)')
     ax2.set_ylim(-0.5, 6)
@@ -142,6 +176,8 @@ def plot_fd(agent_pos,  # model data frame
     if type(fd_filename) is str:
         fig.savefig("figures/" + fd_filename + datetime.now().strftime("_%Y-%m-%d_%H%M") + ".png", format='png', dpi=400)
 
+    return q_k_v  # fitted FD table (can be plotted again with plot_fd(None, q_k_v=...))
+
     
             
             
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+*****************************************************
+*** LOCKSTEP BATCH OF RUNS IN ONE SET OF ARRAYS ***
+*****************************************************
+
+Simulates many independent runs (replications or parameter sets of a
+sensitivity study) side by side in the vectorized engine. Every run gets its
+own corridor: the agents of all corridors are held in the same state arrays
+with a corridor column, neighbours are only searched within the own corridor
+and the parameters of each agent are those of its corridor. All corridors
+advance in the same vectorized step, so the Python overhead per step is paid
+once for the whole batch instead of once per run.
+
+Each corridor draws from its own random stream, seeded as in micromodel, so a
+run of the batch gives the same trajectories as micromodel(engine='numpy').
+'''
+
+import inspect
+import random
+import numpy as np
+from types import SimpleNamespace
+
+from model import micromodel, virtualPositions
+from vectorized import VectorBikeLane
+from demand import generateArrivals
+from recorder import TrajectoryRecorder, columnsToDataFrame
+
+
+# parameters that must be the same in all corridors of a batch (length of the time step, geometry and simulated time)
+shared_parameters = ['dt', 'path_width', 'path_length', 'side_obstacle', 'duration']
+
+# parameters of the behaviour of the cyclists, may differ between the corridors
+corridor_parameters = ['v0_mean', 'v0_sd', 'p_mean', 'p_sd', 'b_length', 'b_width', 'a_des', 'b_max', 'omega_max', 'omega_des',
+                       'd_omega_max', 'phi', 'alpha', 'beta', 'gamma', 'lookback']
+
+# parameters of micromodel that a batch does not support
+unsupported_parameters = {'stream_output': False, 'trace': None, 'check_cyclist_id': -1, 'checkpoint_interval': 0,
+                          'resume_from': None, 'snapshot_time': None, 'warm_start': None, 'measure': None, 'store_trajectories': True,
+                          'telemetry': None, 'segments': 1}
+
+
+# parameters of the agents in some rows of a batch: the values of their corridors (looked up on first use)
+class CorridorParams:
+
+    def __init__(self, shared, table, corridor):
+        self.__dict__.update(vars(shared))
+        self._table = table
+        self._corridor = corridor
+
+    def __getattr__(self, name):
+        if name not in self._table:
+            raise AttributeError(name)
+        value = self._table[name][self._corridor]
+        setattr(self, name, value)
+        return value
+
+
+class BatchBikeLane(VectorBikeLane):
+
+    state_names = VectorBikeLane.state_names + ['corridor']
+
+    def __init__(self, params, inflow_steps, virt_positions, rngs, recorder):
+        self.params = SimpleNamespace(**{name: getattr(params[0], name) for name in ['dt', 'path_width', 'path_length', 'side_obstacle']})
+        self.corridor_params = params  # list with the parameters of each corridor
+        self.table = {name: np.array([getattr(p, name) for p in params]) for name in corridor_parameters}
+        self.inflow_steps = inflow_steps  # list with the arrival time steps of each corridor
+        self.inflow_counts = np.zeros(len(params), dtype=np.int64)
+        self.next_arrival = np.array([s[0] if len(s) else np.inf for s in inflow_steps], dtype=float)  # next arrival time step of each corridor
+        self.rngs = rngs  # random generator of each corridor
+        self.recorder = recorder
+        self.recorded_corridors = []  # corridor of every recorded row (one array per recording)
+        self.trace = None
+        self.compiled = False  # the compiled kernels take the parameters as scalars
+        self.space_length = self.params.path_length + 0.1
+
+        # Initialize model variables
+        self.time_step = 0
+        self.initState()
+
+        # each corridor draws the seed of the Mesa model RNG and builds its bottleneck, as in micromodel
+        for c in range(len(params)):
+            self.rngs[c].random()
+            for i in range(len(virt_positions[c])):
+                self.addBicycle(-1-i, virt_positions[c][i], virtual=True, corridor=c)
+
+    def initState(self):
+        super().initState()
+        self.corridor = np.zeros(0, dtype=np.int64)
+
+    def addBicycle(self, unique_id, pos=None, virtual=False, corridor=0):
+        super().addBicycle(unique_id, pos, virtual, self.corridor_params[corridor], self.rngs[corridor])
+        self.corridor = np.append(self.corridor, corridor)
+
+    def rowParams(self, rows):
+        return CorridorParams(self.params, self.table, self.corridor[rows])
+
+    # the corridor is the real part of the key and the position the imaginary part: complex numbers are sorted by corridor first, the positions stay exact
+    def searchKey(self, x, rows):
+        return self.corridor[rows] + 1j*x
+
+    # the path of all corridors is empty: jump to the next arrival in any corridor
+    def fastForward(self, stop):
+        if (~self.virtual).any():
+            return False
+        stop = int(min(stop, self.next_arrival.min()))
+        if stop <= self.time_step:
+            return False
+        self.recorder.recordSteps(np.arange(self.time_step+1, stop+1), self.ids, self.x, self.y, self.speed, self.v_lat, self.v0, self.sr_length, self.sr_width, self.cr_length)
+        self.recorded_corridors.append(np.tile(self.corridor, stop-self.time_step))
+        self.time_step = stop
+        return True
+
+    def step(self):
+        self.decide()
+        self.advance()
+
+        # Add bicycle agents in the corridors with an arrival (one per time step and corridor, later arrivals wait at the entry)
+        for c in np.flatnonzero(self.next_arrival <= self.time_step):
+            self.addBicycle(int(self.inflow_counts[c]), corridor=c)
+            self.inflow_counts[c] += 1
+            self.next_arrival[c] = self.inflow_steps[c][self.inflow_counts[c]] if self.inflow_counts[c] < len(self.inflow_steps[c]) else np.inf
+        # Update the time
+        self.time_step += 1
+        self.collect()
+
+    def collect(self):
+        super().collect()
+        self.recorded_corridors.append(self.corridor)
+
+    # recorded columns of each corridor (rows in the order of recording)
+    def corridorColumns(self):
+        columns = self.recorder.getColumns()
+        corridor = np.concatenate(self.recorded_corridors) if self.recorded_corridors else np.zeros(0, dtype=np.int64)
+        order = np.argsort(corridor, kind='stable')
+        bounds = np.searchsorted(corridor[order], np.arange(len(self.corridor_params)+1))
+        return [{name: values[order[bounds[c]:bounds[c+1]]] for name, values in columns.items()} for c in range(len(self.corridor_params))]
+
+
+def batchmodel(runs,  # list of dictionaries with the parameters of micromodel that differ between the runs (e.g. seed, gamma, demand, bottleneck_width)
+               fast_forward = True,  # jump over time steps in which all corridors are empty (same results)
+               use_cache = True,  # load stored runs from the result store (cache.py) and store the simulated runs; or a ResultCache
+               **scenario):  # parameters of micromodel shared by all runs
+    # parameters of each run (defaults of micromodel, updated by the scenario and the run)
+    defaults = {name: parameter.default for name, parameter in inspect.signature(micromodel).parameters.items()}
+    settings = [{**defaults, **scenario, **run, 'engine': 'numpy', 'use_cache': use_cache, 'fast_forward': fast_forward} for run in runs]
+    for name, default in unsupported_parameters.items():
+        if any(s[name] != default for s in settings):
+            raise ValueError("A batch does not support the parameter {}.".format(name))
+    for name in shared_parameters:
+        if any(s[name] != settings[0][name] for s in settings):
+            raise ValueError("All runs of a batch need the same {}.".format(name))
+
+    # runs in the result store are loaded, the others simulated (they are stored under the key of the numpy engine)
+    results = [None]*len(settings)
+    cache = None
+    if use_cache:
+        from cache import ResultCache
+        cache = use_cache if isinstance(use_cache, ResultCache) else ResultCache()
+        keys = [cache.key(s) for s in settings]
+        for r in range(len(settings)):
+            if not settings[r]['refresh_cache']:
+                results[r] = cache.load(keys[r])
+    todo = [r for r in range(len(settings)) if results[r] is None]
+    if len(todo) == 0:
+        return results
+
+    # arrivals and random stream of each corridor, seeded as in micromodel
+    dt = settings[0]['dt']
+    path_width = settings[0]['path_width'] + 1
+    path_length = settings[0]['path_length']
+    time_steps = int(settings[0]['duration']/dt)
+    params, inflow_steps, virt_positions, rngs = [], [], [], []
+    for r in todo:
+        s = settings[r]
+        random.seed(s['seed'])
+        inflow_steps.append(generateArrivals(s['demand'], time_steps, dt, s['demand_input'], s['seed']).tolist())
+        rng = random.Random()
+        rng.setstate(random.getstate())
+        rngs.append(rng)
+        virt_positions.append(virtualPositions(s['bottleneck_width'], path_width, s['bottleneck_positions']))
+        params.append(SimpleNamespace(dt=dt, path_width=path_width, path_length=path_length, side_obstacle=s['side_obstacle'], **{name: s[name] for name in corridor_parameters}))
+
+    # run all corridors in lockstep
+    capacity = sum(int(len(inflow_steps[c])*path_length/(params[c].v0_mean*dt)) + max(len(virt_positions[c]), 4)*time_steps for c in range(len(todo)))
+    model = BatchBikeLane(params, inflow_steps, virt_positions, rngs, TrajectoryRecorder(capacity))
+    while model.time_step < time_steps:
+        if not (fast_forward and model.fastForward(time_steps)):
+            model.step()
+
+    for r, columns in zip(todo, model.corridorColumns()):
+        if cache is not None:
+            cache.put(keys[r], columns)
+        results[r] = columnsToDataFrame(columns)
+    return results  # list with the trajectories of each run (data frames as returned by micromodel; not saved to csv)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+*************************
+*** BENCHMARK SUITE ***
+*************************
+
+Runs fixed scenarios headless (Agg backend, console output suppressed) and
+measures the simulation and analysis paths: agent-steps per second, wall time
+per simulated hour, peak memory, and the time of the fundamental diagram,
+the space-time diagram and the animation frames. Every scenario runs in its
+own process, so that the peak memory belongs to that scenario only. The
+results are written to a JSON file (benchmarks/benchmark_<date>.json) to
+compare runs over time.
+
+python benchmark.py --engine numpy --duration 600
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import time
+import warnings
+from datetime import datetime
+
+from telemetry import peakMemory
+
+
+# fixed scenarios: free flow, base scenario with bottleneck (BS-B) at the three widths, and increasing demand levels (cyclists per hour)
+bs_b_demand = [50,100,150,150,175,200,225,200,225,200,175,150]  # per 5 minutes, as in run.py
+scenarios = {'free_flow': dict(bottleneck_width=0, demand=[300]),
+             'bs_b_1.0': dict(bottleneck_width=1.0, demand=bs_b_demand),
+             'bs_b_1.5': dict(bottleneck_width=1.5, demand=bs_b_demand),
+             'bs_b_2.0': dict(bottleneck_width=2.0, demand=bs_b_demand),
+             'demand_500': dict(bottleneck_width=0, demand=[500]),
+             'demand_1000': dict(bottleneck_width=0, demand=[1000]),
+             'demand_2000': dict(bottleneck_width=0, demand=[2000]),
+             'demand_3000': dict(bottleneck_width=0, demand=[3000])}
+
+
+# demand of a scenario for the benchmark duration: the profiles are given for one hour, the cyclists per slot are scaled to the same flow
+def scaledDemand(demand, duration):
+    return [d*duration/3600 for d in demand]
+
+
+# run and measure one scenario (module level so that it can be sent to the worker process)
+def _benchmarkScenario(args):
+    name, scenario, engine, duration, dt, seed, n_frames = args
+    import matplotlib
+    matplotlib.use('Agg')
+    warnings.simplefilter('ignore')
+    import pandas as pd
+    from model import micromodel
+    from analysis import compute_fd, plot_fd, plot_space_time
+    from figures import FrameIndex, FrameArtists, BlitManager, drawPath
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    result = {'scenario': name, 'engine': engine, 'duration': duration, 'dt': dt, 'seed': seed}
+    with contextlib.redirect_stdout(io.StringIO()):
+        # simulation (after a short run that takes the imports and compilation of the engine out of the measurement)
+        micromodel(duration=10, demand=[10], engine=engine, data_filename=0, use_cache=False)
+        start = time.perf_counter()
+        agent_pos = micromodel(seed=seed, duration=duration, dt=dt, demand=scaledDemand(scenario['demand'], duration),
+                               bottleneck_width=scenario['bottleneck_width'], engine=engine, data_filename=0, use_cache=False)
+        wall = time.perf_counter() - start
+        ids = pd.to_numeric(agent_pos['AgentID'], errors='coerce')  # the virtual bicycles (labelled virtual_bn_<i>) are not counted
+        real = ids >= 0
+        result['wall_time_s'] = wall
+        result['agent_steps'] = int(real.sum())
+        result['agent_steps_per_s'] = result['agent_steps']/wall
+        result['wall_time_per_simulated_hour_s'] = wall*3600/duration
+        result['n_cyclists'] = int(ids[real].nunique())
+
+        # analysis
+        start = time.perf_counter()
+        compute_fd(agent_pos, dt=dt, duration=duration)
+        result['fd_time_s'] = time.perf_counter() - start
+        start = time.perf_counter()
+        plot_fd(agent_pos, dt=dt, duration=duration, fd_filename=0)
+        result['plot_fd_time_s'] = time.perf_counter() - start
+        start = time.perf_counter()
+        plot_space_time(agent_pos, dt=dt, space_time_filename=0)
+        result['plot_space_time_s'] = time.perf_counter() - start
+
+        # frames of the animation (frame function of plot_simulation with its blitted update, rendered with Agg)
+        fig = Figure(figsize=(20,3), layout='constrained')
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        drawPath(ax, 2, scenario['bottleneck_width'], [0,300])
+        start = time.perf_counter()
+        frames = FrameIndex(agent_pos)
+        result['frame_index_time_s'] = time.perf_counter() - start
+        agents = FrameArtists(ax, dt)
+        blit = BlitManager(canvas)
+        for artist in agents.artists():
+            blit.add(artist)
+        canvas.draw()  # static geometry, cached as the background
+        steps = frames.steps[len(frames.steps)//2:][:n_frames]
+        start = time.perf_counter()
+        for step in steps:
+            agents.update(step, frames.frame(step, 0, 300))
+            blit.update()
+        result['frame_time_s'] = (time.perf_counter() - start)/max(len(steps), 1)
+    result['peak_memory_mb'] = peakMemory()
+    return result
+
+
+# version of the code and the environment of a benchmark run
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    import numpy, pandas, mesa
+    return {'date': datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'pandas': pandas.__version__,
+            'mesa': mesa.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count()}
+
+
+def run_benchmark(names = None,  # scenarios to run (keys of scenarios); None for all
+                  engines = ['mesa', 'numpy'],
+                  duration = 600,  # simulated time per scenario (s)
+                  dt = 0.2,  # time step length (s)
+                  seed = 1,
+                  n_frames = 50,  # number of animation frames to render
+                  output = None):  # JSON file of the results; None for benchmarks/benchmark_<date>.json
+    names = list(scenarios) if names is None else names
+    results = []
+    for name in names:
+        for engine in engines:
+            with multiprocessing.Pool(1, maxtasksperchild=1) as pool:  # fresh process: peak memory of this scenario only
+                results.append(pool.apply(_benchmarkScenario, ((name, scenarios[name], engine, duration, dt, seed, n_frames),)))
+    report = {'environment': environment(), 'results': results}
+    if output is None:
+        os.makedirs("benchmarks", exist_ok=True)
+        output = "benchmarks/benchmark" + datetime.now().strftime("_%Y-%m-%d_%H%M") + ".json"
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the simulation and analysis paths on fixed scenarios.")
+    parser.add_argument('--scenarios', nargs='+', choices=list(scenarios), default=None)
+    parser.add_argument('--engine', nargs='+', choices=['mesa', 'numpy', 'numba'], default=['mesa', 'numpy'])
+    parser.add_argument('--duration', type=float, default=600, help="simulated time per scenario (s)")
+    parser.add_argument('--dt', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--frames', type=int, default=50, help="number of animation frames to render")
+    parser.add_argument('--output', default=None, help="JSON file of the results")
+    arguments = parser.parse_args()
+    report = run_benchmark(arguments.scenarios, arguments.engine, arguments.duration, arguments.dt, arguments.seed, arguments.frames, arguments.output)
+    for r in report['results']:
+        print("{scenario:12} {engine:6} {agent_steps_per_s:10.0f} agent-steps/s  {wall_time_per_simulated_hour_s:8.1f} s/h  "
+              "{peak_memory_mb:7.0f} MB  fd {fd_time_s:.2f} s".format(**r))
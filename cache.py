@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+************************************
+*** RESULT CACHE OF MICROMODEL ***
+************************************
+
+Content-addressed store of simulated trajectories. The key of a result is the
+hash of all parameters that influence the simulation plus a version tag of the
+model code, so a changed model never returns old results. Each result is a
+directory with one .npy file per recorded column, which is memory-mapped when
+it is loaded again. The least recently used results are removed when the store
+grows beyond its maximum size.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+from recorder import TrajectoryRecorder, columnsToDataFrame
+from demand import arrivalRates
+
+
+# files of the model code that determine the simulated trajectories
+model_files = ['model.py', 'vectorized.py', 'kernels.py', 'recorder.py', 'demand.py']
+
+# parameters of micromodel that only affect the output and not the trajectories
+output_parameters = ['check_cyclist_id', 'data_filename', 'stream_output', 'chunk_rows', 'trace', 'trace_filename', 'use_cache', 'refresh_cache',
+                     'checkpoint_interval', 'checkpoint_filename', 'resume_from',
+                     'snapshot_time', 'snapshot_filename', 'warm_start', 'fast_forward', 'measure', 'store_trajectories', 'telemetry', 'segments']
+
+
+# version tag of the model: hash of the source code of the model files
+def modelVersion():
+    version = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in model_files:
+        with open(os.path.join(directory, name), 'rb') as file:
+            version.update(file.read())
+    return version.hexdigest()[:16]
+
+
+# numbers are compared by value (1 and 1.0 give the same simulation)
+def _normalize(value):
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_normalize(v) for v in value]
+    return repr(value)
+
+
+class ResultCache:
+
+    def __init__(self,
+                 directory = "cache",  # folder of the stored results
+                 max_bytes = 2**31,  # maximum size of the store; least recently used results are removed beyond it
+                 version = None):  # version tag of the model; None for the hash of the model code
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = version if version is not None else modelVersion()
+
+    # key of a parameter set (dictionary with the arguments of micromodel)
+    def key(self, parameters):
+        relevant = {name: _normalize(value) for name, value in parameters.items() if name not in output_parameters}
+        if isinstance(parameters.get('demand'), str):  # observed counts: the content of the file counts, not its name
+            with open(parameters['demand'], 'rb') as file:
+                relevant['demand'] = hashlib.sha256(file.read()).hexdigest()
+        elif callable(parameters.get('demand')):  # demand function: the arrival rates it gives over the run count (its repr is only an address)
+            time_steps = int(parameters['duration']/parameters['dt'])
+            rates, _ = arrivalRates(parameters['demand'], time_steps, parameters['dt'])
+            relevant['demand'] = hashlib.sha256(np.ascontiguousarray(rates, dtype=float).tobytes()).hexdigest()
+        relevant['model_version'] = self.version
+        return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    # memory-mapped columns of a stored result; None if the result is not stored
+    def get(self, key):
+        path = self.path(key)
+        if not os.path.isfile(os.path.join(path, 'complete')):
+            return None
+        os.utime(path)  # mark as recently used
+        return {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in TrajectoryRecorder.columns}
+
+    # stored trajectories in the data frame format of micromodel (numeric columns are read-only memory maps)
+    def load(self, key):
+        columns = self.get(key)
+        return None if columns is None else columnsToDataFrame(columns)
+
+    # store the recorded columns of a result
+    def put(self, key, columns):
+        path = self.path(key)
+        temporary = path + '.tmp{}'.format(os.getpid())
+        os.makedirs(temporary, exist_ok=True)
+        for name in TrajectoryRecorder.columns:
+            np.save(os.path.join(temporary, name + '.npy'), np.ascontiguousarray(columns[name]))
+        open(os.path.join(temporary, 'complete'), 'w').close()  # only complete results are loaded
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temporary, path)
+        self.evict()
+
+    # remove one stored result or (key None) the whole store
+    def invalidate(self, key = None):
+        if key is None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        else:
+            shutil.rmtree(self.path(key), ignore_errors=True)
+
+    # total size of the store (bytes)
+    def size(self):
+        return sum(size for _, _, size in self.entries())
+
+    # stored results as (last use, key, size) tuples
+    def entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self.path(key)
+            if not os.path.isfile(os.path.join(path, 'complete')):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            entries.append((os.path.getmtime(path), key, size))
+        return entries
+
+    # remove the least recently used results until the store is smaller than max_bytes
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, _, size in entries)
+        for _, key, size in entries:
+            if total <= self.max_bytes:
+                break
+            self.invalidate(key)
+            total -= size
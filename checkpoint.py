@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+*******************************************
+*** CHECKPOINTS OF A RUNNING SIMULATION ***
+*******************************************
+
+A checkpoint holds the full state of a run: the model (cyclists, inflow
+cursor, time step and recorded trajectories), the state of the random number
+generator, the number of simulated steps and the parameters of micromodel.
+micromodel(resume_from=...) continues the run from it with the same results
+as an uninterrupted run.
+'''
+
+import os
+import pickle
+import random
+
+
+# write the state of a run to a file (replaced atomically, so a crash while saving keeps the previous checkpoint)
+def saveCheckpoint(filename, model, step, arguments):
+    state = {'model': model,
+             'random_state': random.getstate(),
+             'step': step,  # number of simulated time steps
+             'arguments': arguments}  # parameters of micromodel
+    temporary = filename + '.tmp'
+    try:
+        with open(temporary, 'wb') as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:  # no partial file is left behind
+        os.remove(temporary)
+        raise
+    os.replace(temporary, filename)
+
+
+# read the state of a run (the random number generator is restored by micromodel when the run continues)
+def loadCheckpoint(filename):
+    random_state = random.getstate()  # Mesa draws from the global generator when a model is unpickled, loading leaves it untouched
+    with open(filename, 'rb') as file:
+        state = pickle.load(file)
+    random.setstate(random_state)
+    return state
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+**************************
+*** DEMAND GENERATION ***
+**************************
+
+Arrival time steps of the cyclists for a demand profile. A profile is given
+as a list with the number of cyclists per time slot (the slots divide the
+simulation duration equally, as in micromodel), as a function of the time
+(s) returning the flow (bic/h), or as a file with observed counts. The
+profile is turned into the expected number of arrivals in every time step,
+from which the arrivals are drawn (vectorized) or spaced evenly.
+
+Several cyclists can arrive in the same time step; they are queued at the
+entry of the path and enter one per time step in order of arrival.
+'''
+
+import random
+import numpy as np
+import pandas as pd
+
+
+# observed counts from a csv file with the columns Time (start of the counting interval in s) and Count (cyclists in the interval)
+def readCounts(filename, sep = None):
+    counts = pd.read_csv(filename, sep=sep, engine='python')
+    counts = counts.sort_values('Time')
+    return counts['Time'].to_numpy(dtype=float), counts['Count'].to_numpy(dtype=float)
+
+
+# expected number of arrivals in every time step and the number of time steps that the profile covers
+def arrivalRates(demand, time_steps, dt):
+    # list with the number of cyclists per time slot (remaining time steps after the last full slot get no arrivals)
+    if isinstance(demand, (list, tuple, np.ndarray)):
+        slot_steps = int(time_steps/len(demand))
+        rates = np.repeat(np.asarray(demand, dtype=float)/(time_steps/len(demand)), slot_steps)
+        return rates, slot_steps*len(demand)
+    # observed counts: the counts are spread over their interval (the last interval ends at the end of the simulation)
+    if isinstance(demand, str):
+        times, counts = readCounts(demand)
+        edges = np.append(np.round(times/dt).astype(int), time_steps).clip(0, time_steps)
+        rates = np.zeros(time_steps)
+        for i in range(len(counts)):
+            if edges[i+1] > edges[i]:
+                rates[edges[i]:edges[i+1]] = counts[i]/(edges[i+1]-edges[i])
+        return rates, time_steps
+    # continuous profile: flow (bic/h) as a function of the time (s)
+    if callable(demand):
+        t = np.arange(time_steps)*dt
+        flow = np.array([demand(i) for i in t], dtype=float)
+        return flow*dt/3600, time_steps
+    raise ValueError("demand must be a list with cyclists per time slot, a function of time returning the flow (bic/h) or a csv file with counts.")
+
+
+# sorted array with the arrival time step of every cyclist (a time step appears once per arriving cyclist)
+def generateArrivals(demand,  # demand profile (see arrivalRates)
+                     time_steps,  # number of simulated time steps
+                     dt,  # time step length (s)
+                     demand_input = 'stochastic',  # 'stochastic', 'fixed', 'bernoulli' or 'poisson' (see below)
+                     seed = None):  # seed of the NumPy generator for 'bernoulli' and 'poisson'
+    rates, n_steps = arrivalRates(demand, time_steps, dt)
+    rates = rates[:n_steps]
+    steps = np.arange(n_steps)
+
+    # at most one arrival per time step with the probability of the expected arrivals, drawn from the global random generator
+    # (one draw per time step in order, so a seed gives the same arrivals as in earlier versions of micromodel)
+    if demand_input == 'stochastic':
+        if rates.max(initial=0) > 1:
+            print("Input warning: demand exceeds one cyclist per time step and is capped; use demand_input='poisson' to queue several arrivals per time step.")
+        draws = np.array([random.random() for i in range(n_steps)])
+        return steps[draws < rates]
+
+    # evenly spaced arrivals (an arrival whenever the cumulative expected arrivals reach the next whole cyclist)
+    if demand_input == 'fixed':
+        cumulative = np.ceil(np.round(np.concatenate([[0], np.cumsum(rates)]), 9))
+        return np.repeat(steps, np.diff(cumulative).astype(int))
+
+    # vectorized draws from a NumPy generator
+    rng = np.random.default_rng(seed)
+    if demand_input == 'bernoulli':  # at most one arrival per time step
+        return steps[rng.random(n_steps) < rates]
+    if demand_input == 'poisson':  # Poisson process, several arrivals per time step possible
+        return np.repeat(steps, rng.poisson(rates))
+    raise ValueError("demand_input must be 'stochastic', 'fixed', 'bernoulli' or 'poisson'.")
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+*****************************************************
+*** SPATIAL DOMAIN DECOMPOSITION OF ONE CORRIDOR ***
+*****************************************************
+
+Runs one long path of the vectorized engine on several processes. The path is
+split into longitudinal segments, each owned by a worker process that decides
+the next state of the cyclists in its segment. The decisions (step) only read
+the current state of the neighbours, so the workers run them at the same
+time; the commits (advance), the insertion of new cyclists (the only random
+draws) and the recording are done by the main process between two steps.
+
+The current state of all cyclists is written to shared memory once per step.
+Every worker reads its segment plus the ghost zones around it: the 20 m
+backward view behind and the longest consideration range of all cyclists
+ahead (and the lateral neighbours across the ends of the toroidal space for
+the first and the last segment). A cyclist is handed over to the next worker
+in the step in which it crosses the segment boundary. The workers keep the
+rows in the order of the single-process engine, so a run gives the same
+trajectories as micromodel(engine='numpy').
+
+Used by micromodel(segments=...); run it from a script with an
+if __name__ == '__main__': guard.
+'''
+
+import multiprocessing
+import threading
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+
+from vectorized import VectorBikeLane
+import kernels
+
+
+# decisions of the cyclists that the workers return (in addition to the state arrays of VectorBikeLane)
+result_names = ['next_x', 'next_y', 'next_speed', 'v_lat', 'leader', 'cr_length', 'sr_length', 'sr_width']
+
+# types of the state arrays (all other arrays are float); shared memory holds all of them as float
+state_types = {'ids': np.int64, 'leader': np.int64, 'look_back': bool, 'virtual': bool}
+
+
+# header (number of rows, longest consideration range, stop flag), state and decisions of all cyclists in a shared memory block
+def sharedArrays(buffer, capacity):
+    header = np.ndarray(3, dtype=float, buffer=buffer)
+    state = np.ndarray((len(VectorBikeLane.state_names), capacity), dtype=float, buffer=buffer, offset=header.nbytes)
+    result = np.ndarray((len(result_names), capacity), dtype=float, buffer=buffer, offset=header.nbytes+state.nbytes)
+    return header, state, result
+
+
+# the cyclists of one segment and its ghost zones in a worker process
+class SegmentBikeLane(VectorBikeLane):
+
+    def __init__(self, params, compiled = False):
+        self.params = params
+        self.trace = None
+        self.compiled = compiled and kernels.available
+        self.space_length = params.path_length + 0.1
+        self.time_step = 0
+        self.initState()
+        self.own = np.zeros(0, dtype=bool)  # rows of the cyclists in the segment (the others are ghosts)
+
+    # state of the given rows (in the order of the single-process engine)
+    def load(self, state, rows, own):
+        for k, name in enumerate(self.state_names):
+            setattr(self, name, state[k, rows].astype(state_types.get(name, float)))
+        self.own = own
+
+    def decidingRows(self):
+        return np.flatnonzero(~self.virtual & self.own)
+
+
+# decide the next state of the cyclists in [lo, hi) in every step until the main process stops the run
+def _segmentWorker(name, capacity, params, compiled, lo, hi, barrier):
+    memory = SharedMemory(name=name)
+    header, state, result = sharedArrays(memory.buf, capacity)
+    model = SegmentBikeLane(params, compiled)
+    b_length = params.b_length
+    try:
+        while True:
+            barrier.wait()  # the state of this step is written
+            if header[2]:
+                break
+            x = state[1, :int(header[0])]
+            # segment and ghost zones (1 m more than the search windows of the cyclists in the segment)
+            halo = (x >= lo-21) & (x <= hi+header[1]+1)
+            if lo == -np.inf:
+                halo |= x >= model.space_length-b_length-1
+            if hi == np.inf:
+                halo |= x <= b_length+1
+            rows = np.flatnonzero(halo)
+            own = (x[rows] >= lo) & (x[rows] < hi)
+            model.load(state, rows, own)
+            model.decide()
+            model.leader = np.where(model.leader >= 0, rows[model.leader], -1)  # row in the single-process engine
+            for k, result_name in enumerate(result_names):
+                result[k, rows[own]] = getattr(model, result_name)[own]
+            barrier.wait()  # the decisions of this step are written
+    finally:
+        del header, state, result, x
+        memory.close()
+
+
+class DomainBikeLane(VectorBikeLane):
+
+    timeout = 600  # longest time (s) to wait for the workers in one step
+
+    def __init__(self, params, inflow_step, virt_positions, recorder, segments = 2, compiled = False):
+        super().__init__(params, inflow_step, virt_positions, recorder, compiled=compiled)
+        self.capacity = len(virt_positions) + len(inflow_step) + 1  # most rows at the same time
+        n_bytes = (3 + (len(self.state_names)+len(result_names))*self.capacity)*8
+        self.memory = SharedMemory(create=True, size=n_bytes)
+        self.header, self.state, self.result = sharedArrays(self.memory.buf, self.capacity)
+        self.header[:] = 0
+        # segments of equal length, the first and the last one are open towards the ends of the path
+        edges = np.linspace(0, params.path_length, segments+1)
+        edges[0], edges[-1] = -np.inf, np.inf
+        self.barrier = multiprocessing.Barrier(segments+1)
+        self.workers = [multiprocessing.Process(target=_segmentWorker, args=(self.memory.name, self.capacity, params, self.compiled, edges[k], edges[k+1], self.barrier),
+                                                daemon=True) for k in range(segments)]
+        for worker in self.workers:
+            worker.start()
+
+    # all workers decide for their segments at the same time
+    def decide(self):
+        n = len(self.x)
+        self.header[0] = n
+        self.header[1] = self.cr_length.max(initial=0)
+        for k, name in enumerate(self.state_names):
+            self.state[k, :n] = getattr(self, name)
+        try:
+            self.barrier.wait(self.timeout)  # start of the step
+            self.barrier.wait(self.timeout)  # all decisions are written
+        except threading.BrokenBarrierError:
+            self.close()
+            raise RuntimeError("A segment worker did not finish the time step.")
+        for k, name in enumerate(result_names):
+            setattr(self, name, self.result[k, :n].astype(state_types.get(name, float)))
+
+    # stop the workers and release the shared memory
+    def close(self):
+        if self.memory is None:
+            return
+        self.header[2] = 1
+        try:
+            self.barrier.wait(self.timeout)
+        except threading.BrokenBarrierError:
+            pass
+        for worker in self.workers:
+            worker.join(self.timeout)
+            if worker.is_alive():
+                worker.terminate()
+        del self.header, self.state, self.result
+        self.memory.close()
+        self.memory.unlink()
+        self.memory = None
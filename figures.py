@@ -1,13 +1,25 @@
 # -*- coding: utf-8 -*-
 
 from datetime import datetime
+import io
+import os
+import shutil
+import subprocess
+import multiprocessing
+import PIL.Image
+import PIL.GifImagePlugin
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
-from matplotlib.animation import PillowWriter
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import mpl_toolkits.axes_grid1
 import matplotlib.widgets
 from matplotlib.patches import Rectangle
 from matplotlib.patches import Polygon
+from matplotlib.collections import LineCollection
+import numpy as np
+
+from model import bottleneckWidths
 
 
 class Player(FuncAnimation):  # Player class from https://stackoverflow.com/questions/44985966/managing-dynamic-plotting-in-matplotlib-animation-module/44989063#44989063
@@ -23,7 +35,7 @@ class Player(FuncAnimation):  # Player class from https://stackoverflow.com/ques
         self.setup(pos)
         FuncAnimation.__init__(self,self.fig, self.update, frames=self.play(), 
                                            init_func=init_func, fargs=fargs,
-                                           save_count=save_count, **kwargs )    
+                                           save_count=save_count, blit=True, **kwargs )  # blit: the frames are drawn by func, no full redraw per frame
 
     def play(self):
         while self.runs:
@@ -62,9 +74,7 @@ class Player(FuncAnimation):  # Player class from https://stackoverflow.com/ques
             self.i+=1
         elif self.i == self.max and not self.forwards:
             self.i-=1
-        self.func(self.i)
-        self.slider.set_val(self.i)
-        self.fig.canvas.draw_idle()
+        self.slider.set_val(self.i)  # draws the frame (set_pos)
 
     def setup(self, pos):
         playerax = self.fig.add_axes([pos[0],pos[1], 0.35, 0.06])
@@ -85,15 +95,193 @@ class Player(FuncAnimation):  # Player class from https://stackoverflow.com/ques
         self.button_forward.on_clicked(self.forward)
         self.button_oneforward.on_clicked(self.oneforward)
         self.slider = matplotlib.widgets.Slider(sliderax, '', 
-                                                self.min, self.max, valinit=self.i)
+                                                self.min, self.max, valinit=self.i, valfmt='%d')  # plain step number (no mathtext layout per frame)
+        self.slider.drawon = False  # the slider is redrawn with the frame (sliderArtists)
         self.slider.on_changed(self.set_pos)
 
+    # moving parts of the slider, to be drawn together with the frame (the handle is a private attribute of the matplotlib Slider:
+    # without it, the slider is not blitted and redraws the whole figure when it moves)
+    def sliderArtists(self):
+        handle = getattr(self.slider, '_handle', None)
+        if handle is None:
+            self.slider.drawon = True
+            return []
+        return [self.slider.poly, handle, self.slider.valtext]
+
     def set_pos(self,i):
         self.i = int(self.slider.val)
         self.func(self.i)
 
     def update(self,i):
         self.slider.set_val(i)
+        return []
+
+
+# rows of the model data frame per simulation step (sorted once, a frame is a slice of the sorted columns)
+class FrameIndex:
+
+    columns = ['Step', 'ID', 'Position_x', 'Position_y', 'Speed', 'latSpeed', 'desSpeed', 'srLength', 'srWidth', 'crLength']
+
+    def __init__(self, agent_pos):
+        order = np.argsort(agent_pos['Step'].to_numpy(), kind='stable')
+        self.data = {name: agent_pos[name].to_numpy()[order] for name in self.columns}
+        self.steps, self.starts = np.unique(self.data['Step'], return_index=True)
+        self.ends = np.append(self.starts[1:], len(order))
+
+    # columns of the agents in a simulation step, optionally only those with lo <= x <= hi
+    def frame(self, step, lo = -np.inf, hi = np.inf):
+        i = np.searchsorted(self.steps, step)
+        if i == len(self.steps) or self.steps[i] != step:
+            return {name: values[:0] for name, values in self.data.items()}
+        rows = slice(self.starts[i], self.ends[i])
+        x = self.data['Position_x'][rows]
+        visible = (x >= lo) & (x <= hi)
+        return {name: values[rows][visible] for name, values in self.data.items()}
+
+
+# redraws only the animated artists on top of a cached background (pattern of the matplotlib blitting tutorial)
+class BlitManager:
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.background = None
+        self.artists = []
+        canvas.mpl_connect('draw_event', self.onDraw)
+
+    def add(self, artist):
+        artist.set_animated(True)
+        self.artists.append(artist)
+        return artist
+
+    # a full draw (e.g. after resizing) renders the static parts: cache them and draw the animated artists on top
+    def onDraw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self.drawAnimated()
+
+    def drawAnimated(self):
+        for artist in self.artists:
+            self.canvas.figure.draw_artist(artist)
+
+    def update(self):
+        if self.background is None:
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self.drawAnimated()
+            self.canvas.blit(self.canvas.figure.bbox)
+        self.canvas.flush_events()
+
+
+# static geometry of the path: limits, path surface, keep-right position p and bottlenecks
+def drawPath(ax, path_width, bottleneck_width, plot_length, path_length = 300, bottleneck_positions = [250]):
+    # set the boundaries of the plot
+    ax.set_xlim([plot_length[0],plot_length[1]])
+    ax.set_ylim([0,path_width+1])
+    ax.set_xlabel('Cycle path length (m)')
+    ax.set_ylabel('Cycle path width (m)')
+    # draw the edges of the cycle path
+    ax.add_patch(Rectangle((0, 0.5), path_length, path_width, color='silver', zorder=1))
+    # draw the keep-right position p
+    ax.add_patch(Rectangle((0, 0.8), path_length, 0.4, color='silver', zorder=2))
+    
+    # bottlenecks (drawn as at 250 m of the original path; the path stays narrow up to the next bottleneck or the end of the path)
+    bottlenecks = sorted(zip(bottleneck_positions, bottleneckWidths(bottleneck_width, bottleneck_positions)))
+    for k in range(len(bottlenecks)):
+        position, width = bottlenecks[k]
+        shift = position - 250
+        end = bottlenecks[k+1][0]-1 if k+1 < len(bottlenecks) else path_length
+        if width == 1.0:
+            # 4 cyclists
+            # virt_positions = [[254,2.4], [253,2.8], [252,3.2], [251,3.6]]
+            coords = [(249+shift,4.0-(3-path_width)),(255.25+shift,1.5-(3-path_width)),(end,1.5-(3-path_width)),(end,4.0-(3-path_width))]
+        elif width == 1.5:
+            # 3 cyclists
+            # virt_positions = [[253,2.9], [252,3.3], [251,3.7]]
+            coords = [(249+shift,4.1-(3-path_width)),(254.25+shift,2.0-(3-path_width)),(end,2.0-(3-path_width)),(end,4.1-(3-path_width))]
+        elif width == 2.0:
+            # 2 cyclists
+            # virt_positions = [[252,3.4], [251,3.8]]
+            coords = [(249+shift,4.3-1),(253.25+shift,2.6-1),(end,2.6-1),(end,4.3-1)]
+        else:
+            continue
+        ax.add_patch(Polygon(coords, color='white', zorder=1.2))
+
+
+# title with the simulation time of a step
+def frameTitle(frame, dt):
+    # get minutes and seconds from the simulation step
+    minutes = int(frame/(60/dt))
+    seconds = round((frame % (60/dt)) * dt, 2)
+    hundredth = int(round((seconds % 1) * 100, 0))
+    seconds = int(seconds)
+    return f'Time {minutes:02}:{seconds:02}.{hundredth:02}  |  Step {frame:04}  |  dt = {dt}  |  {datetime.now().strftime("%Y-%m-%d %H:%M")} '
+
+
+# artists of the agents, created once and updated in place for every frame
+class FrameArtists:
+
+    def __init__(self, ax, dt, check_cyclist_id = -1, max_labels = 40):
+        self.ax = ax
+        self.dt = dt
+        self.check_cyclist_id = check_cyclist_id
+        self.max_labels = max_labels  # labels are only drawn if at most this many agents are visible
+        self.title = ax.set_title(frameTitle(0, dt))  # text of the same size as in the frames, so that the layout leaves room for it
+        self.centres = ax.scatter([], [], color='black', zorder=3)  # centers of cyclists
+        self.diamonds = ax.add_collection(LineCollection([], color='grey', zorder=3))  # diamond shaped size of cyclists
+        self.arrows = ax.add_collection(LineCollection([], color='black', zorder=4))  # arrow to next position
+        self.speed_labels = [ax.text(0, 0, '', ha='center', va='bottom', clip_on=True) for i in range(max_labels)]
+        self.id_labels = [ax.text(0, 0, '', ha='center', va='top', fontsize='large', clip_on=True) for i in range(max_labels)]
+        
+        # the one cyclist to check is drawn in red with its safety region and consideration range
+        self.check = [ax.scatter([], [], color='darkred', zorder=5),
+                      ax.plot([], [], color='red', linestyle='dashed', zorder=5)[0],
+                      ax.plot([], [], color='red', zorder=5)[0],
+                      ax.plot([], [], color='darkred', zorder=5)[0],
+                      ax.text(0, 0, '', ha='center', va='bottom', color='red', zorder=5, clip_on=True),
+                      ax.text(0, 0, '', ha='center', va='top', fontsize='large', color='red', zorder=5, clip_on=True),
+                      ax.plot([], [], color='red', linestyle='dotted')[0]]
+
+    def artists(self):
+        return [self.title, self.centres, self.diamonds, self.arrows] + self.speed_labels + self.id_labels + self.check
+
+    def update(self, frame, agents):
+        x_pos, y_pos = agents['Position_x'], agents['Position_y']
+        self.title.set_text(frameTitle(frame, self.dt))
+        self.centres.set_offsets(np.column_stack([x_pos, y_pos]))
+        self.diamonds.set_segments(np.stack([np.column_stack([x_pos-1,x_pos,x_pos+1,x_pos,x_pos-1]),
+                                             np.column_stack([y_pos,y_pos+0.4,y_pos,y_pos-0.4,y_pos])], axis=2))
+        self.arrows.set_segments(np.stack([np.column_stack([x_pos,x_pos+agents['Speed']*self.dt]),
+                                           np.column_stack([y_pos,y_pos+agents['latSpeed']*self.dt])], axis=2))
+        
+        # labels with speed/desired speed and id (skipped when too many agents are visible)
+        n_labels = len(x_pos) if len(x_pos) <= self.max_labels else 0
+        for k in range(self.max_labels):
+            visible = k < n_labels
+            self.speed_labels[k].set_visible(visible)
+            self.id_labels[k].set_visible(visible)
+            if visible:
+                self.speed_labels[k].set_position((x_pos[k], y_pos[k]+0.5))
+                self.speed_labels[k].set_text("{}/{}".format(round(agents['Speed'][k],1),round(agents['desSpeed'][k],1)))
+                self.id_labels[k].set_position((x_pos[k], y_pos[k]-0.5))
+                self.id_labels[k].set_text(agents['ID'][k])
+        
+        checked = np.flatnonzero(agents['ID'] == self.check_cyclist_id)
+        for artist in self.check:
+            artist.set_visible(len(checked) > 0)
+        if len(checked):
+            k = checked[0]
+            x, y = x_pos[k], y_pos[k]
+            sr_length, sr_width, cr_length = agents['srLength'][k], agents['srWidth'][k], agents['crLength'][k]
+            dot, sr, diamond, arrow, speed, label, cr = self.check
+            dot.set_offsets([[x, y]])
+            sr.set_data([x,x+sr_length,x+sr_length,x], [y+sr_width,y+sr_width,y-sr_width,y-sr_width])
+            diamond.set_data([x-1,x,x+1,x,x-1], [y,y+0.4,y,y-0.4,y])
+            arrow.set_data([x,x+agents['Speed'][k]*self.dt], [y,y+agents['latSpeed'][k]*self.dt])
+            speed.set_position((x, y+0.5))
+            speed.set_text("{}/{}".format(round(agents['Speed'][k],1),round(agents['desSpeed'][k],1)))
+            label.set_position((x, y-0.5))
+            label.set_text(agents['ID'][k])
+            cr.set_data([x+cr_length,x+cr_length], [0,20])
 
 
 def plot_simulation(agent_pos, 
@@ -101,113 +289,137 @@ def plot_simulation(agent_pos,
                     path_width = 2,
                     bottleneck_width = 0,
                     anim_interval = 500, # time to update (ms); 200 ms = 5 FPS
-                    plot_length = [0,300],  # start and end of space to show the simulation (m)
+                    plot_length = None,  # start and end of space to show the simulation (m); None for the whole path
                     check_cyclist_id = -1,
-                    animation_filename = "animation"
+                    max_labels = 40,  # labels of the agents are skipped when more agents are visible
+                    path_length = 300,  # length of the simulated path (m), as in micromodel
+                    bottleneck_positions = [250]  # positions of the bottlenecks (m), as in micromodel
                     ): 
             
-    # create figure
+    # create figure with the static geometry (drawn once) and the artists of the agents (updated in place and blitted)
+    plot_length = [0,path_length] if plot_length is None else plot_length
     fig, ax = plt.subplots(figsize=(20,3), layout='constrained')
+    drawPath(ax, path_width, bottleneck_width, plot_length, path_length, bottleneck_positions)
+    frames = FrameIndex(agent_pos)
+    agents = FrameArtists(ax, dt, check_cyclist_id, max_labels)
+    blit = BlitManager(fig.canvas)
+    for artist in agents.artists():
+        blit.add(artist)
     
     # animation function
     def animate(frame):
-        
-        # clear canvas
-        ax.clear()
-        
-        # set the boundaries of the plot
-        ax.set_xlim([plot_length[0],plot_length[1]])
-        ax.set_ylim([0,path_width+1])
-        # rename the y-tick labels
-        # ax.set_yticks([0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4], [-0.5, 0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5])
-        # draw the edges of the cycle path
-        # ax.plot([0,300], [0.5,0.5], color='grey', zorder=1)
-        # ax.plot([0,300], [3.5,3.5], color='grey', zorder=1)
-        ax.add_patch(Rectangle((0, 0.5), 300, path_width, color='silver', zorder=1))
-        # draw the keep-right position p
-        # ax.plot([0,300], [0.8,0.8], color='khaki', zorder=1)
-        # ax.plot([0,300], [1.2,1.2], color='khaki', zorder=1)
-        ax.add_patch(Rectangle((0, 0.8), 300, 0.4, color='silver', zorder=2))
-        
-        
-        # obtain agents visible in the current simulation step
-        agent_pos_frame = agent_pos[agent_pos['Step'] == frame]
-        # obtain their position
-        x_pos = agent_pos_frame['Position_x']
-        y_pos = agent_pos_frame['Position_y']
-        cur_speed = agent_pos_frame['Speed']
-        cur_lat_speed = agent_pos_frame['latSpeed']
-        
-        # plot centers of cyclists in the simulation step
-        ax.scatter(x_pos, y_pos, color='black', zorder=3)
-        for index, row in agent_pos_frame.iterrows():
-            if row['ID']==check_cyclist_id:
-                ax.scatter(row['Position_x'], row['Position_y'], color='darkred', zorder=5)  # the one cyclist to check has a red dot
-                
-                ax.plot([row['Position_x'],row['Position_x']+row['srLength'],row['Position_x']+row['srLength'],row['Position_x']],[row['Position_y']+row['srWidth'],row['Position_y']+row['srWidth'],row['Position_y']-row['srWidth'],row['Position_y']-row['srWidth']], color='red', linestyle='dashed', zorder=5)
-                
-                ax.plot([row['Position_x']-1,row['Position_x'],row['Position_x']+1,row['Position_x'],row['Position_x']-1], [row['Position_y'],row['Position_y']+0.4,row['Position_y'],row['Position_y']-0.4,row['Position_y']], color='red', zorder=5)
-                
-                ax.plot([row['Position_x'],row['Position_x']+row['Speed']*dt], [row['Position_y'],row['Position_y']+row['latSpeed']*dt], color='darkred', zorder=5)
-                
-                ax.text(row['Position_x'], row['Position_y']+0.5, "{}/{}".format(round(row['Speed'],1),round(row['desSpeed'],1)), ha='center', va='bottom', color='red', zorder=5)
-                ax.text(row['Position_x'], row['Position_y']-0.5, row['ID'], ha='center', va='top', fontsize='large', color='red', zorder=5)
-                
-                ax.plot([row['Position_x']+row['crLength'],row['Position_x']+row['crLength']], [0,20], color='red', linestyle='dotted')
-        
-                # ax.scatter(row['leaderDetails'][1][0], row['leaderDetails'][1][1], color='blue', zorder=6)
-        # plot diamond shaped size of cyclists
-        ax.plot([x_pos-1,x_pos,x_pos+1,x_pos,x_pos-1], [y_pos,y_pos+0.4,y_pos,y_pos-0.4,y_pos], color='grey', zorder=3)
-        # plot arrow to next position
-        # print(f'\n{x_pos}, {y_pos} -> {x_nextpos}, {y_nextpos}')
-        # ax.plot([x_pos,x_nextpos], [y_pos,y_nextpos], color='crimson', zorder=4)
-        ax.plot([x_pos,x_pos+cur_speed*dt], [y_pos,y_pos+cur_lat_speed*dt], color='black', zorder=4)
-        # ax.arrow(x_pos, y_pos, cur_speed*run.dt, cur_lat_speed*run.dt, color='crimson', zorder=4)
-        
-        for index, row in agent_pos_frame.iterrows():
-            ax.text(row['Position_x'], row['Position_y']+0.5, "{}/{}".format(round(row['Speed'],1),round(row['desSpeed'],1)), ha='center', va='bottom')
-            ax.text(row['Position_x'], row['Position_y']-0.5, row['ID'], ha='center', va='top', fontsize='large')
-        
-        # get minutes and seconds from the simulation step
-        minutes = int(frame/(60/dt))
-        seconds = round((frame % (60/dt)) * dt, 2)
-        hundredth = int(round((seconds % 1) * 100, 0))
-        seconds = int(seconds)
-        
-        # naming the plot
-        ax.set_title(f'Time {minutes:02}:{seconds:02}.{hundredth:02}  |  Step {frame:04}  |  dt = {dt}  |  {datetime.now().strftime("%Y-%m-%d %H:%M")} ')
-        ax.set_xlabel('Cycle path length (m)')
-        ax.set_ylabel('Cycle path width (m)')
-        
-        for t in ax.texts:
-            t.set_clip_on(True)
-        
-        # bottleneck
-        if bottleneck_width in [1.0,1.5,2.0]:
-            coords = []
-            if bottleneck_width == 1.0:
-                # 4 cyclists
-                # virt_positions = [[254,2.4], [253,2.8], [252,3.2], [251,3.6]]
-                coords = [(249,4.0-(3-path_width)),(255.25,1.5-(3-path_width)),(300,1.5-(3-path_width)),(300,4.0-(3-path_width))]
-            elif bottleneck_width == 1.5:
-                # 3 cyclists
-                # virt_positions = [[253,2.9], [252,3.3], [251,3.7]]
-                coords = [(249,4.1-(3-path_width)),(254.25,2.0-(3-path_width)),(300,2.0-(3-path_width)),(300,4.1-(3-path_width))]
-            else:
-                # 2 cyclists
-                # virt_positions = [[252,3.4], [251,3.8]]
-                coords = [(249,4.3-1),(253.25,2.6-1),(300,2.6-1),(300,4.3-1)]
-            ax.add_patch(Polygon(coords, color='white', zorder=1.2))
+        agents.update(frame, frames.frame(frame, plot_length[0], plot_length[1]))
+        blit.update()
         
     # matplotlib animation function
-    anim = Player(fig, animate, agent_pos['Step'].unique(), interval=anim_interval, cache_frame_data=True)
+    anim = Player(fig, animate, frames.steps, interval=anim_interval, cache_frame_data=True)
+    for artist in anim.sliderArtists():
+        blit.add(artist)
     fig.show()
     
+    # the interactive player does not write a file, use export_animation for a gif or mp4
+    
+    
+# render a chunk of frames with the Agg backend to image files in memory (module level so that it can be sent to the worker processes)
+def _renderFrames(args):
+    data, steps, settings = args
+    frames = FrameIndex(data)
+    fig = Figure(figsize=(20,3), dpi=settings['dpi'], layout='constrained')
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    drawPath(ax, settings['path_width'], settings['bottleneck_width'], settings['plot_length'], settings['path_length'], settings['bottleneck_positions'])
+    agents = FrameArtists(ax, settings['dt'], settings['check_cyclist_id'], settings['max_labels'])
+    for artist in agents.artists():
+        artist.set_animated(True)
+    canvas.draw()  # static geometry, drawn once per worker
+    background = canvas.copy_from_bbox(fig.bbox)
+    
+    images = []
+    for step in steps:
+        canvas.restore_region(background)
+        agents.update(step, frames.frame(step, settings['plot_length'][0], settings['plot_length'][1]))
+        for artist in agents.artists():
+            fig.draw_artist(artist)
+        image = PIL.Image.fromarray(np.asarray(canvas.buffer_rgba())[:, :, :3])
+        if settings['format'] == 'gif':
+            image = image.quantize(colors=64, method=PIL.Image.Quantize.FASTOCTREE)  # palette of the gif, computed in the worker
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', compress_level=1)
+        images.append(buffer.getvalue())
+    return images
+
+
+# append the frames (png images with their own palette) to a gif file one by one, so that the memory does not grow with the number of frames
+# (frame writer of Pillow's GifImagePlugin, tested with Pillow 12 in tests/test_figures.py; without it, Image.save collects all frames before writing)
+def writeGif(filename, images, fps):
+    frames = (PIL.Image.open(io.BytesIO(data)) for data in images)
+    if not (hasattr(PIL.GifImagePlugin, 'getheader') and hasattr(PIL.GifImagePlugin, 'getdata')):
+        first = next(frames)
+        first.save(filename, save_all=True, append_images=frames, duration=1000/fps, loop=0)
+        return
+    with open(filename, 'wb') as file:
+        for n, image in enumerate(frames):
+            image.load()
+            if n == 0:
+                header, _ = PIL.GifImagePlugin.getheader(image.copy(), info={'loop': 0})  # getheader remaps the palette of the image it is given
+                file.write(b''.join(header))
+            for block in PIL.GifImagePlugin.getdata(image, duration=1000/fps, include_color_table=True):
+                file.write(block)
+        file.write(b';')  # trailer
+
+
+# write the frames of a window of the simulation to a gif or mp4 file, rendered in parallel without a display
+def export_animation(agent_pos, 
+                     dt = 0.2, 
+                     path_width = 2,
+                     bottleneck_width = 0,
+                     plot_length = None,  # start and end of space to show the simulation (m); None for the whole path
+                     check_cyclist_id = -1,
+                     animation_filename = "animation",
+                     time_window = None,  # start and end of the exported window [s, s]; None for the whole run
+                     fps = 5,  # frames (simulation steps) per second of the video
+                     file_format = 'gif',  # 'gif' (Pillow) or 'mp4' (requires ffmpeg on the PATH)
+                     processes = None,  # number of worker processes; None for all cores
+                     dpi = 100,
+                     max_labels = 40,  # labels of the agents are skipped when more agents are visible
+                     path_length = 300,  # length of the simulated path (m), as in micromodel
+                     bottleneck_positions = [250]  # positions of the bottlenecks (m), as in micromodel
+                     ):
+    
+    plot_length = [0,path_length] if plot_length is None else plot_length
+    steps = np.unique(agent_pos['Step'].to_numpy())
+    if time_window is not None:
+        steps = steps[(steps*dt >= time_window[0]) & (steps*dt <= time_window[1])]
+    if file_format not in ['gif', 'mp4']:
+        raise ValueError("file_format must be 'gif' or 'mp4'.")
+    if file_format == 'mp4' and shutil.which('ffmpeg') is None:
+        raise RuntimeError("Writing an mp4 file requires ffmpeg on the PATH; use file_format='gif' instead.")
+    filename = "figures/" + animation_filename + datetime.now().strftime("_%Y-%m-%d_%H%M") + "." + file_format
+    os.makedirs("figures", exist_ok=True)
+    
+    # contiguous chunks of steps with the records they need (several chunks per process to balance the load)
+    settings = {'dt': dt, 'path_width': path_width, 'bottleneck_width': bottleneck_width, 'plot_length': plot_length,
+                'path_length': path_length, 'bottleneck_positions': bottleneck_positions,
+                'check_cyclist_id': check_cyclist_id, 'max_labels': max_labels, 'dpi': dpi, 'format': file_format}
+    n_chunks = min(len(steps), 4*(processes or multiprocessing.cpu_count()))
+    columns = agent_pos[FrameIndex.columns]
+    jobs = []
+    for chunk in np.array_split(steps, max(n_chunks, 1)):
+        if len(chunk):
+            jobs.append((columns[(columns['Step'] >= chunk[0]) & (columns['Step'] <= chunk[-1])], chunk, settings))
     
-    # WRITING OF THE GIF FILE IS SOMEHOW CORRUPTED
-    '''
-    # save animation as gif into current directory
-    if type(animation_filename) is str:
-        writer = PillowWriter(fps=(1000/anim_interval), metadata=dict(artist='Me'), bitrate=1000)
-        anim.save("figures/" + animation_filename + datetime.now().strftime("_%Y-%m-%d_%H%M") + ".gif", writer=writer)
-    '''
+    # frames are received in order and written while the other chunks are still rendered
+    with multiprocessing.Pool(processes) as pool:
+        chunks = pool.imap(_renderFrames, jobs, chunksize=1)
+        if file_format == 'gif':
+            writeGif(filename, (image for chunk in chunks for image in chunk), fps)
+        else:
+            ffmpeg = subprocess.Popen(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'image2pipe', '-framerate', str(fps), '-i', '-',
+                                       '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-c:v', 'libx264', '-pix_fmt', 'yuv420p', filename],
+                                      stdin=subprocess.PIPE)
+            for chunk in chunks:
+                for image in chunk:
+                    ffmpeg.stdin.write(image)
+            ffmpeg.stdin.close()
+            ffmpeg.wait()
+    return filename
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+**************************************
+*** COMPILED KERNELS OF THE ENGINE ***
+**************************************
+
+Nopython (Numba) versions of the arithmetic of the vectorized engine: the NDM
+acceleration of level 3, the projected passing angle of level 2 and the limits
+of the lateral speed. Each kernel runs in one loop over the arrays of agent
+state (or of interacting pairs) instead of a chain of temporary NumPy arrays.
+They are used by micromodel(engine='numba'); without Numba the engine falls
+back to the NumPy code in vectorized.py. checkKernels compares both versions.
+'''
+
+import math
+import numpy as np
+
+try:
+    from numba import njit
+    available = True
+except ImportError:  # optional dependency: the kernels run as plain Python functions (only used by checkKernels)
+    available = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+''' LEVEL 2: Moving angle '''
+# lateral speed towards the steepest passing angle of the obstructing cyclists of each row
+# (pairs: row, position and desired speed / safety width of the row; position and speed of the obstructing cyclist)
+@njit(cache=True)
+def passingLatSpeed(v_lat, req_lat_move, vi, oq, xi, yi, v0, sr_width, xj, yj, vj, b_width):
+    steepest_angle = np.zeros(len(v_lat))
+    has_obstr = np.zeros(len(v_lat), dtype=np.bool_)
+    for k in range(len(oq)):
+        # project the obstructing cyclist to when you would pass
+        time_to_pass = (xj[k]-xi[k])/(v0[k]-vj[k])
+        dist_to_pass = v0[k]*time_to_pass
+        if req_lat_move[oq[k]] < 0:
+            lat_passing_point = yj[k]-(b_width+sr_width[k])
+        else:
+            lat_passing_point = yj[k]+(b_width+sr_width[k])
+        angle = abs(math.atan2(lat_passing_point-yi[k], dist_to_pass))
+        if not has_obstr[oq[k]] or angle > steepest_angle[oq[k]]:
+            steepest_angle[oq[k]] = angle
+        has_obstr[oq[k]] = True
+
+    # go for the steepest angle
+    result = v_lat.copy()
+    for r in range(len(v_lat)):
+        if has_obstr[r]:
+            if req_lat_move[r] < 0:
+                result[r] = -(vi[r]*math.tan(steepest_angle[r]))
+            else:
+                result[r] = vi[r]*math.tan(steepest_angle[r])
+    return result
+
+
+# feasible lateral speed (restricted by max lateral speed and acceleration); returns the limited speed, the cut-off flags and the max lateral speed
+@njit(cache=True)
+def limitLatSpeed(v_lat, cut_off_flag, v_lat_prev, vi, d_omega_max, omega_max, dt):
+    n = len(v_lat)
+    limited = np.empty(n)
+    cut = cut_off_flag.copy()
+    omega = np.empty(n)
+    for r in range(n):
+        v = v_lat[r]
+        max_speed_left = v_lat_prev[r] + d_omega_max*dt
+        max_speed_right = v_lat_prev[r] - d_omega_max*dt
+        if v > max_speed_left:
+            v = max_speed_left
+            cut[r] = True
+        if v < max_speed_right:
+            v = max_speed_right
+            cut[r] = True
+
+        # check for max lateral speed
+        omega[r] = min(omega_max, (0.1+0.1*vi[r]))
+        if v > omega[r]:
+            v = omega[r]
+            cut[r] = True
+        if v < -omega[r]:
+            v = -omega[r]
+            cut[r] = True
+        limited[r] = v
+    return limited, cut, omega
+
+
+''' LEVEL 3: Acceleration according to NDM '''
+# potential acceleration and the two deceleration parts of each row (headway and speed difference to the leader, if any)
+@njit(cache=True)
+def ndmAcceleration(vi, v0, has_leader, headway_s, delta_v, safety_dist_d, a_des, b_max, b_length):
+    n = len(vi)
+    acc = np.empty(n)
+    dec1 = np.zeros(n)
+    dec2 = np.zeros(n)
+    for r in range(n):
+        # calculate potential (positive) acceleration
+        if has_leader[r] and headway_s[r] <= safety_dist_d[r]:
+            acc[r] = 0
+        else:
+            acc[r] = (v0[r]-vi[r])/a_des
+        if not has_leader[r]:
+            continue
+
+        # calculate first deceleration part: matching the speed of the slower leader
+        if delta_v[r] > 0:
+            if headway_s[r] > b_length:
+                dec1[r] = min((delta_v[r]**2)/(2*(headway_s[r]-b_length)), b_max)
+            else:
+                dec1[r] = b_max
+
+        # calculate second deceleration part: fall back to maintain the desired safety distance
+        if delta_v[r] <= 1 and headway_s[r] <= safety_dist_d[r]:
+            dec2[r] = b_max / ((b_length-safety_dist_d[r])**2) * ((headway_s[r]-safety_dist_d[r])**2)
+    return acc, dec1, dec2
+
+
+'''
+***************************
+*** AGREEMENT WITH NUMPY ***
+***************************
+'''
+
+# largest absolute difference between the kernels and the NumPy code of the vectorized engine on random agent states
+def checkKernels(n = 10000,  # number of rows (and pairs)
+                 seed = 0):
+    rng = np.random.default_rng(seed)
+    b_width, b_length, a_des, b_max, d_omega_max, omega_max, dt = 0.65, 1.73, 2, 2, 1.2, 2, 0.2
+    errors = {}
+
+    # level 2: passing angle (several obstructing cyclists per row)
+    vi, v0 = rng.uniform(0, 7, n), rng.uniform(3, 7, n)
+    xi, yi = rng.uniform(0, 300, n), rng.uniform(0, 3, n)
+    req_lat_move = rng.uniform(-2, 2, n)
+    v_lat = rng.uniform(-1, 1, n)
+    sr_width = b_width/2 + 0.1 + 0.4*vi
+    oq = np.sort(rng.integers(0, n, n))
+    xj, yj = xi[oq] + rng.uniform(0.1, 20, n), rng.uniform(0, 3, n)
+    vj = v0[oq] - rng.uniform(0.1, 3, n)
+    time_to_pass = (xj-xi[oq])/(v0[oq]-vj)
+    dist_to_pass = v0[oq]*time_to_pass
+    lat_passing_point = np.where(req_lat_move[oq] < 0, yj-(b_width+sr_width[oq]), yj+(b_width+sr_width[oq]))
+    angle = np.abs(np.arctan2(lat_passing_point-yi[oq], dist_to_pass))
+    steepest_angle = np.zeros(n)
+    np.maximum.at(steepest_angle, oq, angle)
+    has_obstr = np.bincount(oq, minlength=n) > 0
+    reference = np.where(has_obstr, np.where(req_lat_move < 0, -(vi*np.tan(steepest_angle)), vi*np.tan(steepest_angle)), v_lat)
+    compiled = passingLatSpeed(v_lat, req_lat_move, vi, oq, xi[oq], yi[oq], v0[oq], sr_width[oq], xj, yj, vj, b_width)
+    errors['passingLatSpeed'] = np.abs(compiled-reference).max()
+
+    # limits of the lateral speed
+    v_lat_prev = rng.uniform(-1, 1, n)
+    cut_off_flag = rng.random(n) < 0.1
+    max_speed_left = v_lat_prev + d_omega_max*dt
+    max_speed_right = v_lat_prev - d_omega_max*dt
+    reference_cut = cut_off_flag | (reference > max_speed_left) | (reference < max_speed_right)
+    reference_v = np.minimum(np.maximum(reference, max_speed_right), max_speed_left)
+    reference_omega = np.minimum(omega_max, (0.1+0.1*vi))
+    reference_cut |= (reference_v > reference_omega) | (reference_v < -reference_omega)
+    reference_v = np.minimum(np.maximum(reference_v, -reference_omega), reference_omega)
+    compiled_v, compiled_cut, compiled_omega = limitLatSpeed(reference, cut_off_flag, v_lat_prev, vi, d_omega_max, omega_max, dt)
+    errors['limitLatSpeed'] = max(np.abs(compiled_v-reference_v).max(), np.abs(compiled_omega-reference_omega).max(),
+                                  float((compiled_cut != reference_cut).sum()))
+
+    # level 3: NDM acceleration
+    has_leader = rng.random(n) < 0.7
+    headway_s = np.where(has_leader, rng.uniform(0.5, 15, n), 0)
+    delta_v = np.where(has_leader, rng.uniform(-3, 3, n), 0)
+    safety_dist_d = b_length/2 + 0.1 + 0.3*vi + b_length/2
+    acc = np.where(has_leader & (headway_s <= safety_dist_d), 0, (v0-vi)/a_des)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dec1 = np.where(headway_s > b_length, np.minimum((delta_v**2)/(2*(headway_s-b_length)), b_max), b_max)
+    dec1 = np.where(has_leader & (delta_v > 0), dec1, 0)
+    dec2 = b_max / ((b_length-safety_dist_d)**2) * ((headway_s-safety_dist_d)**2)
+    dec2 = np.where(has_leader & (delta_v <= 1) & (headway_s <= safety_dist_d), dec2, 0)
+    compiled = ndmAcceleration(vi, v0, has_leader, headway_s, delta_v, safety_dist_d, a_des, b_max, b_length)
+    errors['ndmAcceleration'] = max(np.abs(c-r).max() for c, r in zip(compiled, (acc, dec1, dec2)))
+    return errors
+
+
+if __name__ == '__main__':
+    print("Numba available:", available)
+    for kernel, error in checkKernels().items():
+        print("{}: max. abs. difference {:.3g}".format(kernel, error))
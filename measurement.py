@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+*****************************************
+*** MEASUREMENTS DURING THE SIMULATION ***
+*****************************************
+
+Measurements that are fed with the state of all agents in every recorded
+step (by the TrajectoryRecorder) and aggregate it while the model runs, so
+that their results are available at the end of the run without storing and
+post-processing the trajectories. Pass them to micromodel(measure=...), which
+sets their time step, duration and path width to those of the run (setRun).
+'''
+
+import numpy as np
+import pandas as pd
+
+
+# flow, density and speed per aggregation interval (Edie's definitions), same table as compute_fd in analysis.py
+class EdieAggregator:
+
+    def __init__(self,
+                 dt = 0.2,  # time step length (s); set to the one of the run by micromodel
+                 duration = 3600,  # simulation duration (s); set to the one of the run by micromodel
+                 agg_time = 15,  # aggregation interval for fundamental diagram (s)
+                 agg_dist = [100, 250],  # aggregation distance / space for fundamental diagram (min and max value in m)
+                 path_width = 2):  # set to the one of the run by micromodel
+        self.agg_time = agg_time
+        self.agg_dist = agg_dist
+        self.setRun(dt, duration, path_width)
+
+    # time step, duration and path width of the run (empties the aggregates)
+    def setRun(self, dt, duration, path_width):
+        self.dt = dt
+        self.path_width = path_width
+        self.agg_steps = int(self.agg_time/dt)
+        self.n_intervals = int((duration/dt)//self.agg_steps)  # complete aggregation intervals ((i-1)*agg_steps, i*agg_steps]
+        self.vkt = np.zeros(self.n_intervals)  # distance travelled in the aggregation space per interval (m)
+        self.vht = np.zeros(self.n_intervals)  # time spent in the aggregation space per interval (s)
+        self.interval = 0  # interval of the records below
+        self.ids = []  # agents and positions inside the aggregation space in the current interval (one array per step)
+        self.x = []
+
+    # state of all agents after a step
+    def record(self, step, ids, x, y, speed):
+        if step <= 0 or step > self.n_intervals*self.agg_steps:
+            return
+        interval = (step-1)//self.agg_steps + 1
+        if interval != self.interval:
+            self.closeInterval()
+            self.interval = interval
+        x = np.asarray(x, dtype=float)
+        inside = (x <= self.agg_dist[1]) & (x > self.agg_dist[0])
+        self.ids.append(np.asarray(ids)[inside])
+        self.x.append(x[inside])
+
+    # same state of the agents for several steps
+    def recordSteps(self, steps, ids, x, y, speed):
+        for step in steps:
+            self.record(step, ids, x, y, speed)
+
+    # distance travelled (max-min x) and time spent of the agents in the current interval
+    def intervalTotals(self):
+        if len(self.ids) == 0:
+            return 0, 0
+        ids = np.concatenate(self.ids)
+        x = np.concatenate(self.x)
+        if len(ids) == 0:
+            return 0, 0
+        order = np.argsort(ids, kind='stable')
+        ids, x = ids[order], x[order]
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        return (np.maximum.reduceat(x, starts) - np.minimum.reduceat(x, starts)).sum(), len(ids)*self.dt
+
+    def closeInterval(self):
+        vkt, vht = self.intervalTotals()
+        if self.interval > 0:
+            self.vkt[self.interval-1] += vkt
+            self.vht[self.interval-1] += vht
+        self.ids, self.x = [], []
+
+    # flow/density/speed table of the intervals so far (columns as in compute_fd)
+    def table(self):
+        vkt_sum, vht_sum = self.vkt.copy(), self.vht.copy()
+        if self.interval > 0:
+            vkt, vht = self.intervalTotals()
+            vkt_sum[self.interval-1] += vkt
+            vht_sum[self.interval-1] += vht
+        T = self.agg_time
+        L = self.agg_dist[1]-self.agg_dist[0]  # length to derive the FD from
+        q_k_v = pd.DataFrame({'Time_(s)': np.arange(1, self.n_intervals+1)*self.agg_time,
+                              'Flow': vkt_sum / (T*L),
+                              'Density': vht_sum / (T*L),
+                              'Speed': np.divide(vkt_sum, vht_sum, out=np.zeros(self.n_intervals), where=vht_sum != 0)})
+        q_k_v['Flow_(/h/m)'] = (q_k_v['Flow']*3600)/self.path_width
+        q_k_v['Density_(/m2)'] = q_k_v['Density']/self.path_width
+        return q_k_v
+
+
+# virtual cross-section detectors: crossings of the agents between two steps, counted per detector, lateral zone and interval
+class Detectors:
+
+    def __init__(self,
+                 positions = [100, 250],  # longitudinal positions of the cross sections (m)
+                 zones = None,  # lateral zones [[y_min, y_max], ...] of each cross section (m); None for one zone over the whole width
+                 dt = 0.2,  # time step length (s); set to the one of the run by micromodel
+                 duration = 3600,  # simulation duration (s); set to the one of the run by micromodel
+                 agg_time = 60,  # aggregation interval of the counts (s)
+                 keep_crossings = True):  # False to only keep the aggregated counts
+        self.positions = np.asarray(positions, dtype=float)
+        self.zones = np.asarray(zones if zones is not None else [[-np.inf, np.inf]], dtype=float)
+        self.agg_time = agg_time
+        self.keep_crossings = keep_crossings
+        self.setRun(dt, duration)
+
+    # time step and duration of the run (empties the counts; the path width is not used)
+    def setRun(self, dt, duration, path_width = None):
+        self.dt = dt
+        self.n_intervals = int(np.ceil(duration/self.agg_time))
+        shape = (len(self.positions), len(self.zones), self.n_intervals)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.speed_sum = np.zeros(shape)  # for the time-mean speed
+        self.inverse_speed_sum = np.zeros(shape)  # for the space-mean (harmonic mean) speed
+        self.headway_sum = np.zeros(shape)
+        self.headway_count = np.zeros(shape, dtype=np.int64)
+        self.last_crossing = np.full(shape[:2], np.nan)  # time of the last crossing per detector and zone
+        self.crossings = []  # one array per step with the columns detector, zone, time, speed, agent
+        self.prev_ids = np.zeros(0, dtype=np.int64)  # state of the agents in the previous step, sorted by id
+        self.prev_x = np.zeros(0)
+        self.prev_y = np.zeros(0)
+        self.prev_speed = np.zeros(0)
+
+    # state of all agents after a step: crossings between the previous and this position
+    def record(self, step, ids, x, y, speed):
+        ids = np.asarray(ids, dtype=np.int64)
+        x, y, speed = np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(speed, dtype=float)
+        k = np.searchsorted(self.prev_ids, ids).clip(0, max(len(self.prev_ids)-1, 0))
+        known = np.flatnonzero(self.prev_ids[k] == ids) if len(self.prev_ids) else np.zeros(0, dtype=np.int64)
+        a, p = known, k[known]  # agents with a position in the previous step
+        crossed = (self.prev_x[p][:, None] < self.positions[None, :]) & (x[a][:, None] >= self.positions[None, :])
+        agent, detector = np.nonzero(crossed)
+        if len(agent):
+            # interpolate the moment, lateral position and speed of the crossing within the step
+            i, j = a[agent], p[agent]
+            share = (self.positions[detector]-self.prev_x[j]) / (x[i]-self.prev_x[j])
+            time = (step-1+share)*self.dt
+            lateral = self.prev_y[j] + share*(y[i]-self.prev_y[j])
+            spot_speed = self.prev_speed[j] + share*(speed[i]-self.prev_speed[j])
+            zone_hit = (lateral[:, None] >= self.zones[None, :, 0]) & (lateral[:, None] < self.zones[None, :, 1])
+            c, zone = np.nonzero(zone_hit)
+            order = np.argsort(time[c], kind='stable')
+            c, zone = c[order], zone[order]
+            self.addCrossings(detector[c], zone, time[c], spot_speed[c], ids[i[c]])
+        order = np.argsort(ids, kind='stable')
+        self.prev_ids, self.prev_x, self.prev_y, self.prev_speed = ids[order], x[order], y[order], speed[order]
+
+    # the agents do not move in the skipped steps (only the virtual bicycles are on the path)
+    def recordSteps(self, steps, ids, x, y, speed):
+        if len(steps):
+            self.record(steps[-1], ids, x, y, speed)
+
+    # add crossings (in order of time) to the counts of their interval
+    def addCrossings(self, detector, zone, time, speed, agent):
+        interval = np.minimum((time//self.agg_time).astype(np.int64), self.n_intervals-1)
+        np.add.at(self.count, (detector, zone, interval), 1)
+        np.add.at(self.speed_sum, (detector, zone, interval), speed)
+        np.add.at(self.inverse_speed_sum, (detector, zone, interval), 1/np.maximum(speed, 1e-6))
+        for n in range(len(time)):  # headway to the previous crossing at the same detector and zone
+            previous = self.last_crossing[detector[n], zone[n]]
+            if not np.isnan(previous):
+                self.headway_sum[detector[n], zone[n], interval[n]] += time[n]-previous
+                self.headway_count[detector[n], zone[n], interval[n]] += 1
+            self.last_crossing[detector[n], zone[n]] = time[n]
+        if self.keep_crossings:
+            self.crossings.append(np.column_stack([detector, zone, time, speed, agent]))
+
+    # all crossings with the interpolated time (s) and speed (m/s)
+    def crossingTable(self):
+        rows = np.concatenate(self.crossings) if self.crossings else np.zeros((0, 5))
+        return pd.DataFrame({'Detector_x': self.positions[rows[:, 0].astype(int)],
+                             'Zone': rows[:, 1].astype(int),
+                             'Time_(s)': rows[:, 2],
+                             'Speed': rows[:, 3],
+                             'AgentID': rows[:, 4].astype(np.int64)})
+
+    # counts, flow, time-mean and space-mean speed and mean headway per detector, zone and interval
+    def table(self):
+        d, z, i = np.meshgrid(np.arange(len(self.positions)), np.arange(len(self.zones)), np.arange(self.n_intervals), indexing='ij')
+        count = self.count.ravel()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return pd.DataFrame({'Detector_x': self.positions[d.ravel()],
+                                 'Zone': z.ravel(),
+                                 'Time_(s)': (i.ravel()+1)*self.agg_time,  # end of the interval
+                                 'Count': count,
+                                 'Flow_(/h)': count*3600/self.agg_time,
+                                 'Time_mean_speed': np.where(count > 0, self.speed_sum.ravel()/count, np.nan),
+                                 'Space_mean_speed': np.where(count > 0, count/self.inverse_speed_sum.ravel(), np.nan),
+                                 'Mean_headway_(s)': np.where(self.headway_count.ravel() > 0, self.headway_sum.ravel()/self.headway_count.ravel(), np.nan)})
@@ -9,629 +9,921 @@
 
 from mesa import Agent, Model
 from mesa.time import SimultaneousActivation
-from mesa.space import ContinuousSpace
-from mesa.datacollection import DataCollector
 from datetime import datetime
-import pandas as pd
+from types import SimpleNamespace
 import random
 import math
-import sys
+from bisect import bisect_left, bisect_right
+from recorder import TrajectoryRecorder
+from tracing import DecisionTrace
+from demand import generateArrivals, arrivalRates
+import os
 
 
-def micromodel(seed = 4,  # random seed
-               duration = 3600,  # simulation duration (s) 3600/12 = 300 s
-               dt = 0.2,  # simulation time step length (s)
-               demand = [50,100,150,200,250,300,350,400,300,200,100,50],  # list with demands []
-               path_width = 2,  # width of the simulated path (m, excl. 2x 0.5 m space on side of the path); put 3 m or less for the bottleneck to work
-               bottleneck_width = 0,  # (m); put numbers [1.0,1.5,2.0] for the bottleneck to be active; all other values mean that the bottleneck is not active
-               v0_mean = 4.5,  # mean of desired speed (m/s)
-               v0_sd = 1,  # standard deviation of desired speed (m/s)
-               p_mean = 1,  # mean of desired lateral position / distance from right edge +0.5 (m)
-               p_sd = 0.2,  # standard deviation for desired lateral position (m)
-               check_cyclist_id = -1,  # follow the choices of an individual cyclist with his unique_id; put 'False' for no output
-               b_length = 2,  # bicycle length (m)
-               b_width = 0.8,  # bicycle width (m)
-               d_standing = 0.1,  # minimum standing distance to other cyclists (m)
-               a_des = 1.5,  # relaxation time for acceleration (s)
-               b_max = 2,  # maximum braking (m/s^2, >0)
-               omega_max = 0.3,  # maximum lateral speed (m/s)
-               omega_des = 0.15,  # desired lateral speed (m/s)
-               d_omega_max = 0.2,  # maximum lateral acceleration (m/s^2)
-               phi = 4,  # scale length of the consideration range (-)
-               alpha = 0.8,  # scale length of the safety region (-)
-               beta = 0.05,  # scale width of the safety region (-)
-               gamma = 0.85,  # passing threshold (-)
-               lookback = 1,  # proportion of cyclists looking back before moving laterally [0,1]
-               side_obstacle = 0.2,  # width deducted from both sides of the extended path to simulate obstacles (m)
-               data_filename = "simulation_data",  # type 0 if file should not be saved
-               demand_input = 'stochastic'):
+# width of each bottleneck: one width for all positions or a list with a width per position
+def bottleneckWidths(bottleneck_width, bottleneck_positions):
+    if isinstance(bottleneck_width, (list, tuple)):
+        if len(bottleneck_width) != len(bottleneck_positions):
+            raise ValueError("Give one bottleneck_width or one width per bottleneck position.")
+        return list(bottleneck_width)
+    return [bottleneck_width]*len(bottleneck_positions)
+
 
+# positions of the virtual bicycles that form the optional bottlenecks (each built as the bottleneck at 250 m of the original 300 m path)
+def virtualPositions(bottleneck_width, path_width, bottleneck_positions = [250]):
+    virt_positions = []
+    for width, position in zip(bottleneckWidths(bottleneck_width, bottleneck_positions), bottleneck_positions):
+        shift = position - 250
+        if width == 1.0:
+            # 4 cyclists
+            virt_positions += [[254+shift,2.4-(4-path_width)], [253+shift,2.8-(4-path_width)], [252+shift,3.2-(4-path_width)], [251+shift,3.6-(4-path_width)]]
+        elif width == 1.5:
+            # 3 cyclists
+            virt_positions += [[253+shift,2.9-(4-path_width)], [252+shift,3.3-(4-path_width)], [251+shift,3.7-(4-path_width)]]
+        elif width == 2.0:
+            # 2 cyclists
+            virt_positions += [[252+shift,3.4-(4-path_width)], [251+shift,3.8-(4-path_width)]]
+    return virt_positions
+
+
+'''
+*******************
+*** AGENT CLASS ***
+*******************
+'''
+
+class Bicycle(Agent):
+    
+    # attributes of a cyclist in fixed slots instead of a dictionary per object (Mesa keeps unique_id, model and pos in a small dictionary)
+    __slots__ = ['record_id', 'params', 'v0', 'p', 'speed', 'acceleration', 'v_lat', 'v_lat_prev', 'next_speed', 'next_coords',
+                 'sr_length', 'sr_width', 'cr_length', 'omega_max', 'neighbors', 'ahead', 'cat1_cyclists', 'cat12_cyclists', 'cat3_behind',
+                 'blocked_space_indiv', 'des_lat_pos', 'leader', 'cut_off_flag', 'traced', 'do_look_back', 'obstr_ids', 'acc_details']
     
     ''' 
-    **********************
-    *** COMPUTE INFLOW ***
-    **********************
-    ''' 
+    ************************************
+    *** INITIALIZATION AND VARIABLES ***
+    ************************************
+    '''
     
-    # We assume that bicycles are generated with a same interval (uniformly distributed) according to the demand.
-    path_width += 1
-    random.seed(seed)  # set the seed
-    time_steps = int(duration/dt)
-    inflow_step = []  # time points that bicycles enter the bike lane
-    
-    # fixed interval
-    if demand_input=='fixed':
-        correct = True
-        if time_steps % len(demand) != 0:
-            correct = False
-        for i in demand:
-            if i == 0:
-                print("Input warning: Demand cannot be 0, set 1 instead.")
-                sys.exit()
-            if (time_steps/len(demand)) % i != 0:
-                correct = False
-        if correct:
-            splits = len(demand)
-            interval = [int((time_steps/splits) / demand[i]) for i in range(len(demand))] # Time interval in both of the two slots
-            print(interval)
-            for i in range(len(demand)):
-                inflow_step.extend(list(range(0 + int(time_steps/splits) * i, int(time_steps/splits) * (i+1), interval[i])))
-            print(inflow_step, len(inflow_step))
-        else:
-            print("Input warning: time steps cannot be divided up by demand. Choose values so that the number of time steps (duration/dt) is a multiple of both, the length of the demand list and each individual demand value in the list.")
-            sys.exit()
-    
-    # stochastic interval
-    elif demand_input=='stochastic':
-        splits = len(demand)
-        for i in range(len(demand)):
-            probability = demand[i]/(time_steps/splits)
-            print(probability)
-            for j in range(int(time_steps/splits)):
-                rng = random.random()
-                if rng < probability:
-                    inflow_step.append(0 + int(time_steps/splits) * i + j)
-        print(inflow_step, len(inflow_step))
+    def __init__(self, unique_id, model):
+        super().__init__(unique_id, model)
+        params = model.params  # parameters of the run
+        
+        # Fixed attributes
+        self.unique_id = unique_id
+        self.record_id = unique_id  # id in the recorded trajectories (virtual bicycles get negative ids)
+        self.setParameters(params)
         
+        # self.v0 = random.uniform(v0_mean-v0_sd, v0_mean+v0_sd)  # distribution of desired lateral position
+        # self.v0 = random.triangular(v0_mean-v0_sd, v0_mean+v0_sd, v0_mean)
+        # truncate gaussian distribution at +- 2 sd
+        self.v0 = 0
+        while (self.v0 < params.v0_mean-2*params.v0_sd) or (self.v0 > params.v0_mean+2*params.v0_sd):
+            self.v0 = random.gauss(params.v0_mean, params.v0_sd)
+        self.p = random.uniform(params.p_mean-params.p_sd, params.p_mean+params.p_sd)  # distribution of desired lateral position
+                   
+        
+        ''' Dynamic attributes (these following values initialize the simulation) '''
+        self.pos = (0, self.p)  # Current position, a "tuple" type position variable is required by Mesa and used in its other built-in function
+        self.speed = self.v0  # Current (actual) longitudinal speed
+        self.acceleration = 0  # actual longitudinal acceleration/braking for the current time step
+        self.v_lat = 0  # actual lateral speed for the current time step
+        self.v_lat_prev = 0  # previous lateral speed
+        self.next_speed = 0
+        self.next_coords = (0, self.p)  # Attribute which stores the determined next coordinates
+        self.sr_length = self.length/2 + 0.1 + self.v0*self.alpha  # length of the safety region
+        self.sr_width = self.width/2 + 0.1 + self.v0*self.beta  # width of the safety region
+        self.cr_length = 4 + self.v0*self.phi  # consideration range length
+        # auxiliary variables (lists are emptied and filled again in every step)
+        self.neighbors = []  # cyclists in the backward view and the consideration range
+        self.ahead = []  # list of cyclists in consideration range
+        self.cat1_cyclists = []  # list of significantly slower cyclists in consideration range
+        self.cat12_cyclists = []  # list of slightly slower cyclists in consideration range
+        self.cat3_behind = []  # list of faster cyclists in the backward view
+        self.blocked_space_indiv = []  # auxiliary list used across level 1 and 2
+        self.des_lat_pos = 0  # desired lateral position
+        self.leader = 0  # variable to save leading cyclist's object id
+        self.cut_off_flag = False  # True if cyclist would cut-off somebody else
+        self.traced = model.trace is not None and model.trace.traces(unique_id)  # True if the decisions of this cyclist are traced
+        if random.random() <= params.lookback:
+            self.do_look_back = True
+        else:
+            self.do_look_back = False
+    
+    
+    # behavioural parameters of the run, shared by all cyclists (set again when a run is warm-started with other parameters)
+    def setParameters(self, params):
+        self.params = params
+        self.omega_max = params.omega_max  # m/s maximum lateral speed, reduced at low speeds in every step
+    
+    length = property(lambda self: self.params.b_length)  # bicycle length
+    width = property(lambda self: self.params.b_width)  # bicycle width
+    a_des = property(lambda self: self.params.a_des)  # feasible relaxation time for acceleration
+    b_max = property(lambda self: self.params.b_max)  # m/s**2 maximum braking force (positive value)
+    omega_des = property(lambda self: self.params.omega_des)  # m/s fixed value for the desired lateral speed
+    d_omega_max = property(lambda self: self.params.d_omega_max)  # m/s^2 fixed value for the maximum lateral acceleration
+    alpha = property(lambda self: self.params.alpha)  # scale length of safety region
+    beta = property(lambda self: self.params.beta)  # scale width of safety region
+    gamma = property(lambda self: self.params.gamma)  # passing threshold
+    phi = property(lambda self: self.params.phi)  # coefficient for consideration range (caution with the var name)
+    
+    # state for checkpoints: the auxiliary lists and the leader are found again in every step and not stored (their references
+    # to the other cyclists would chain all agents into one deep object graph)
+    def __getstate__(self):
+        slots = {name: getattr(self, name) for name in self.__slots__ if hasattr(self, name)}
+        for name in ['neighbors', 'ahead', 'cat1_cyclists', 'cat12_cyclists', 'cat3_behind', 'blocked_space_indiv']:
+            slots[name] = []
+        slots['leader'] = 0
+        return self.__dict__, slots
+    
     
     ''' 
-    *******************
-    *** AGENT CLASS ***
-    *******************
+    *********************
+    *** GET FUNCTIONS ***
+    *********************
     '''
+    # get position of a bicycle object (the position tuple itself, no copy)
+    def getPos(self):
+        return self.pos
     
-    class Bicycle(Agent):
-        
-        ''' 
-        ************************************
-        *** INITIALIZATION AND VARIABLES ***
-        ************************************
-        '''
-        
-        def __init__(self, unique_id, model):
-            super().__init__(unique_id, model)
-            
-            # Fixed attributes
-            self.unique_id = unique_id
-            self.length = b_length  # bicycle length
-            self.width = b_width  # bicycle width
+    # get speed of a bicycle object
+    def getSpeed(self):
+        return self.speed
+    
+    
+    ''' 
+    ***************************
+    *** AUXILIARY FUNCTIONS ***
+    ***************************
+    '''
+    
+    
+    # get the neighbourhood (20 m backward view and the consideration range ahead) once per step from the sorted index of the model
+    def findNeighbors(self):
+        self.neighbors = self.model.getNeighbors(self, 20, self.cr_length)
+    
+    def findCat1(self):
+        x, end = self.pos[0], self.pos[0]+self.cr_length
+        self.ahead.clear()
+        for l in self.neighbors: # obtain cyclists in consideration range (also used by findCat12 in the same step)
+            if l.pos[0] > x and l.pos[0] < end:
+                self.ahead.append(l)
+        threshold = self.gamma*self.v0
+        self.cat1_cyclists.clear()
+        for l in self.ahead: # obtain cat1 cyclists
+            if l.speed <= threshold:
+                self.cat1_cyclists.append(l)
+    
+    def findCat12(self):
+        self.cat12_cyclists.clear()
+        for l in self.ahead: # obtain cat1 and cat2 cyclists
+            if l.speed <= self.v0:
+                self.cat12_cyclists.append(l)
+    
+    def findCat3Behind(self):  # not really cat 3 but the cyclists that are currently faster than you are
+        x = self.pos[0]
+        self.cat3_behind.clear()
+        for l in self.neighbors: # obtain cat3 cyclists in backward view
+            if l.pos[0] < x and l.pos[0] > (x-20) and 0 < self.model.distance2(self, l) <= 20**2 and l.speed > self.speed:
+                self.cat3_behind.append(l)
+    
+    ''' 
+    ************************
+    *** UPDATE FUNCTIONS ***
+    ************************
+    '''
+    
+    # Calculate and update the attributes in the next step
+    def calPos(self): 
+        dt = self.model.params.dt
+        if isinstance(self.unique_id, str):  # exclude cyclists from virtual bottleneck from calculations and updating
+            self.speed, self.acceleration, self.v_lat = 0, 0, 0
+        if self.speed*dt + self.acceleration*dt <= 0:
+            self.acceleration = -self.speed
+        self.next_coords = (self.pos[0] + self.speed*dt + self.acceleration*0.5*dt**2, self.pos[1] + self.v_lat*dt)  # new x and y position values
+    
+    # Determine and update the next speed
+    def calSpeed(self):
+        dt = self.model.params.dt
+        if isinstance(self.unique_id, str):  # exclude cyclists from virtual bottleneck from calculations and updating
+            self.speed, self.acceleration, self.v_lat = 0, 0, 0
+        self.next_speed = self.speed + self.acceleration * dt # apply acceleration from ndm
+    
+    def updateCR(self):
+        self.cr_length = 4 + self.phi*self.next_speed
+    
+    def updateSR(self):
+        self.sr_length = self.length/2 + 0.1 + self.alpha*self.next_speed
+        self.sr_width = self.width/2 + 0.1 + self.beta*self.next_speed
+    
+    ''' 
+    ***********************
+    *** LEVEL FUNCTIONS ***
+    ***********************
+    '''
+    
+    ''' LEVEL 1: Desired lateral position '''
+    def findLatPos(self): 
+        # find cat1 cyclists in consideration range
+        self.findCat1()
+        # if there is no cat. 1 cyclist in the consideration range
+        if len(self.cat1_cyclists)==0:  
+            self.des_lat_pos = self.p  # just go to the desired lateral position
+        else:
+            path_width, side_obstacle = self.model.params.path_width, self.model.params.side_obstacle
+            self.blocked_space_indiv.clear()  # empty list the touples with lateral positions of cat1 cyclists
+            unblocked_space = []  # will contain the borders and width of the lateral gap(s)
             
-            # self.v0 = random.uniform(v0_mean-v0_sd, v0_mean+v0_sd)  # distribution of desired lateral position
-            # self.v0 = random.triangular(v0_mean-v0_sd, v0_mean+v0_sd, v0_mean)
-            # truncate gaussian distribution at +- 2 sd
-            self.v0 = 0
-            while (self.v0 < v0_mean-2*v0_sd) or (self.v0 > v0_mean+2*v0_sd):
-                self.v0 = random.gauss(v0_mean, v0_sd)
-            self.p = random.uniform(p_mean-p_sd, p_mean+p_sd)  # distribution of desired lateral position
-            self.a_des = a_des  # feasible relaxation time for acceleration
-            self.b_max = b_max  # m/s**2 maximum braking force (positive value)
+            # obtain lateral positions blocked by cat. 1 cyclists in consideration range
+            for i in self.cat1_cyclists:
+                self.blocked_space_indiv.append((i, i.getPos()[1]-self.width/2, i.getPos()[1]+self.width/2))  # change 0.4 to the actual width including stabilization
+                
+            self.blocked_space_indiv.sort(key=lambda a: a[2], reverse=True)  # sort cyclists from left to right                
             
-            self.omega_max = omega_max  # m/s fixed value for the maximum lateral speed
-            self.omega_des = omega_des  # m/s fixed value for the desired lateral speed
-            self.d_omega_max = d_omega_max   # m/s^2 fixed value for the maximum lateral acceleration
-    
-            self.alpha = alpha  # scale length of safety region
-            self.beta = beta  # scale width of safety region
-            self.gamma = gamma  # passing threshold
-            self.phi = phi # coefficient for consideration range (caution with the var name)
-                       
+            # boolean to terminate the following loop (searching for a wide-enough lateral gap)
+            gap_found = False
             
-            ''' Dynamic attributes (these following values initialize the simulation) '''
-            self.pos = (0, self.p)  # Current position, a "tuple" type position variable is required by Mesa and used in its other built-in function
-            self.speed = self.v0  # Current (actual) longitudinal speed
-            self.acceleration = 0  # actual longitudinal acceleration/braking for the current time step
-            self.v_lat = 0  # actual lateral speed for the current time step
-            self.v_lat_prev = 0  # previous lateral speed
-            self.next_speed = 0
-            self.next_coords = (0, self.p)  # Attribute which stores the determined next coordinates
-            self.sr_length = self.length/2 + 0.1 + self.v0*self.alpha  # length of the safety region
-            self.sr_width = self.width/2 + 0.1 + self.v0*self.beta  # width of the safety region
-            self.cr_length = 4 + self.v0*self.phi  # consideration range length
-            # auxiliary variables
-            self.cat1_cyclists = []  # list of significantly slower cyclists in consideration range
-            self.cat12_cyclists = []  # list of slightly slower cyclists in consideration range
-            self.cat3_behind = []  # list of faster cyclists in the backward view
-            self.blocked_space_indiv = []  # auxiliary list used across level 1 and 2
-            self.des_lat_pos = 0  # desired lateral position
-            self.trajectory = []  # list including the coordinates for the desired path (therefore also implicitly the moving angle)
-            self.leader = 0  # variable to save leading cyclist's object id
-            self.leader_details = []
-            self.cut_off_flag = False  # True if cyclist would cut-off somebody else
-            if random.random() <= lookback:
-                self.do_look_back = True
-            else:
-                self.do_look_back = False
-        
-        
-        ''' 
-        *********************
-        *** GET FUNCTIONS ***
-        *********************
-        '''
-        # get position of a bicycle object
-        def getPos(self):
-            return [self.pos[0],self.pos[1]]
-        
-        # get speed of a bicycle object
-        def getSpeed(self):
-            return self.speed
-        
-        
-        ''' 
-        ***************************
-        *** AUXILIARY FUNCTIONS ***
-        ***************************
-        '''
-        
-        
-        def findCat1(self):
-            neighbors = self.model.space.get_neighbors(self.pos,self.cr_length+10,False) # add 10 metres so that the circular radius does not matter anymore
-            leaders = [l for l in neighbors if l.getPos()[0] > self.pos[0] and l.getPos()[0] < (self.pos[0]+self.cr_length)] # obtain cyclists in consideration range
-            self.cat1_cyclists = [l for l in leaders if l.getSpeed() <= (self.gamma*self.v0)] # obtain cat1 cyclists
-        
-        def findCat12(self):
-            neighbors = self.model.space.get_neighbors(self.pos,self.cr_length+10,False) # add 10 metres so that the circular radius does not matter anymore
-            leaders = [l for l in neighbors if l.getPos()[0] > self.pos[0] and l.getPos()[0] < (self.pos[0]+self.cr_length)] # obtain cyclists in consideration range
-            self.cat12_cyclists = [l for l in leaders if l.getSpeed() <= (self.v0)] # obtain cat1 and cat2 cyclists
-        
-        def findCat3Behind(self):  # not really cat 3 but the cyclists that are currently faster than you are
-            neighbors = self.model.space.get_neighbors(self.pos,20,False)
-            followers = [l for l in neighbors if l.getPos()[0] < self.pos[0] and l.getPos()[0] > (self.pos[0]-20)] # obtain cyclists in backward view
-            self.cat3_behind = [l for l in followers if l.getSpeed() > (self.getSpeed())] # obtain cat3 cyclists
-        
-        ''' 
-        ************************
-        *** UPDATE FUNCTIONS ***
-        ************************
-        '''
-        
-        # Calculate and update the attributes in the next step
-        def calPos(self): 
-            if isinstance(self.unique_id, str):  # exclude cyclists from virtual bottleneck from calculations and updating
-                self.speed, self.acceleration, self.v_lat = 0, 0, 0
-            if self.speed*dt + self.acceleration*dt <= 0:
-                self.acceleration = -self.speed
-            self.next_coords = (self.pos[0] + self.speed*dt + self.acceleration*0.5*dt**2, self.pos[1] + self.v_lat*dt)  # new x and y position values
-        
-        # Determine and update the next speed
-        def calSpeed(self):
-            if isinstance(self.unique_id, str):  # exclude cyclists from virtual bottleneck from calculations and updating
-                self.speed, self.acceleration, self.v_lat = 0, 0, 0
-            self.next_speed = self.speed + self.acceleration * dt # apply acceleration from ndm
-        
-        def updateCR(self):
-            self.cr_length = 4 + self.phi*self.next_speed
-        
-        def updateSR(self):
-            self.sr_length = self.length/2 + 0.1 + self.alpha*self.next_speed
-            self.sr_width = self.width/2 + 0.1 + self.beta*self.next_speed
-        
-        ''' 
-        ***********************
-        *** LEVEL FUNCTIONS ***
-        ***********************
-        '''
-        
-        ''' LEVEL 1: Desired lateral position '''
-        def findLatPos(self): 
-            if self.unique_id==check_cyclist_id: print("\n****** LEVEL 1: LATERAL POSITION ******")
-            # find cat1 cyclists in consideration range
-            self.findCat1()
-            # if there is no cat. 1 cyclist in the consideration range
-            if len(self.cat1_cyclists)==0:  
-                self.des_lat_pos = self.p  # just go to the desired lateral position
-                if self.unique_id==check_cyclist_id: print("No cat. 1 leader, des_lat_pos={}".format(round(self.des_lat_pos,2)))
-            else:
-                self.blocked_space_indiv = []  # empty list the touples with lateral positions of cat1 cyclists
-                unblocked_space = []  # will contain the borders and width of the lateral gap(s)
+            while gap_found==False:
                 
-                # obtain lateral positions blocked by cat. 1 cyclists in consideration range
-                for i in self.cat1_cyclists:
-                    self.blocked_space_indiv.append((i, i.getPos()[1]-self.width/2, i.getPos()[1]+self.width/2))  # change 0.4 to the actual width including stabilization
-                    
-                self.blocked_space_indiv.sort(key=lambda a: a[2], reverse=True)  # sort cyclists from left to right                
+                # if the path is narrow so that the only blocking cyclist is removed, there needs to be a criterion
+                if len(self.blocked_space_indiv)==0:
+                    unblocked_space.append([path_width-side_obstacle,side_obstacle,path_width-2*side_obstacle])
+                    self.des_lat_pos = self.p
+                    break
                 
-                # boolean to terminate the following loop (searching for a wide-enough lateral gap)
-                gap_found = False
+                # find gaps/unblocked spaces between cyclists
+                for i in range(len(self.blocked_space_indiv)):
+                    # if it is the first cyclist from the left
+                    if i==0: 
+                        unblocked_space.append([path_width-side_obstacle, self.blocked_space_indiv[i][2], round(path_width-self.blocked_space_indiv[i][2],2)])  # also add width of the gap 
+                    elif self.blocked_space_indiv[i-1][1] <= self.blocked_space_indiv[i][2]:  # if the projection overlaps, there is not an additional unblocked space
+                        continue
+                    else: # add an additional unblocked space
+                        unblocked_space.append([self.blocked_space_indiv[i-1][1], self.blocked_space_indiv[i][2], round(self.blocked_space_indiv[i-1][1]-self.blocked_space_indiv[i][2],2)])
+                unblocked_space.append([self.blocked_space_indiv[-1][1], side_obstacle, round(self.blocked_space_indiv[-1][1],2)])  # add a final gap towards the right of the path                    
                 
-                while gap_found==False:
-                    
-                    # if the path is narrow so that the only blocking cyclist is removed, there needs to be a criterion
-                    if len(self.blocked_space_indiv)==0:
-                        unblocked_space.append([path_width-side_obstacle,side_obstacle,path_width-2*side_obstacle])
-                        self.des_lat_pos = self.p
-                        break
-                    
-                    # find gaps/unblocked spaces between cyclists
-                    for i in range(len(self.blocked_space_indiv)):
-                        # if it is the first cyclist from the left
-                        if i==0: 
-                            unblocked_space.append([path_width-side_obstacle, self.blocked_space_indiv[i][2], round(path_width-self.blocked_space_indiv[i][2],2)])  # also add width of the gap 
-                        elif self.blocked_space_indiv[i-1][1] <= self.blocked_space_indiv[i][2]:  # if the projection overlaps, there is not an additional unblocked space
-                            continue
-                        else: # add an additional unblocked space
-                            unblocked_space.append([self.blocked_space_indiv[i-1][1], self.blocked_space_indiv[i][2], round(self.blocked_space_indiv[i-1][1]-self.blocked_space_indiv[i][2],2)])
-                    unblocked_space.append([self.blocked_space_indiv[-1][1], side_obstacle, round(self.blocked_space_indiv[-1][1],2)])  # add a final gap towards the right of the path                    
-                    
-                    # check if there is a gap big enough to fit, including safety region (left to right priority, list is already sorted alike)
-                    for i in unblocked_space:
-                        if i[2] >= 2*self.sr_width:
-                            self.des_lat_pos = i[1]+self.sr_width
-                            gap_found = True
-                            break
-                    if gap_found==True:
+                # check if there is a gap big enough to fit, including safety region (left to right priority, list is already sorted alike)
+                for i in unblocked_space:
+                    if i[2] >= 2*self.sr_width:
+                        self.des_lat_pos = i[1]+self.sr_width
+                        gap_found = True
                         break
-                    
-                    # remove cyclist the furthest downstream if no gap is found
-                    furthest_agent_pos = 0
-                    furthest_agent = ...
-                    for i in range(len(self.blocked_space_indiv)):
-                        if self.blocked_space_indiv[i][0].getPos()[0] > furthest_agent_pos:
-                            furthest_agent_pos = self.blocked_space_indiv[i][0].getPos()[0]
-                            furthest_agent = i
-                    
-                    # delete furthest downstream cyclist from the list of blocking cyclists
-                    del self.blocked_space_indiv[furthest_agent]
-                if self.unique_id==check_cyclist_id: print("Cat. 1 present, des_lat_pos={}".format(round(self.des_lat_pos,2)))
-    
-    
-        ''' LEVEL 2: Moving angle and leader '''
-        def findTraj(self):  
-            if self.unique_id==check_cyclist_id: print("\n****** LEVEL 2: TRAJECTORY ************")
-            # compute lateral movement distance to reach the desired position
-            req_lat_move = self.des_lat_pos - self.getPos()[1]  # desired position minus actual position -> gives direction left or right directly
-            obstr_cyclists = []  # cyclists potentially obstructing from reaching desired position
-            if self.unique_id==check_cyclist_id: print("Reg_lat_move={}".format(round(req_lat_move,2)))
-            # case with no slower cyclists
-            if len(self.cat1_cyclists)==0: 
-                # move the desired lateral speed to the position
-                if abs(req_lat_move) < self.omega_des:  # handle case where desired lateral speed would overshoot the position within one time step
+                if gap_found==True:
+                    break
+                
+                # remove cyclist the furthest downstream if no gap is found
+                furthest_agent_pos = 0
+                furthest_agent = ...
+                for i in range(len(self.blocked_space_indiv)):
+                    if self.blocked_space_indiv[i][0].getPos()[0] > furthest_agent_pos:
+                        furthest_agent_pos = self.blocked_space_indiv[i][0].getPos()[0]
+                        furthest_agent = i
+                
+                # delete furthest downstream cyclist from the list of blocking cyclists
+                del self.blocked_space_indiv[furthest_agent]
+
+
+    ''' LEVEL 2: Moving angle and leader '''
+    def findTraj(self):  
+        # compute lateral movement distance to reach the desired position
+        req_lat_move = self.des_lat_pos - self.getPos()[1]  # desired position minus actual position -> gives direction left or right directly
+        obstr_cyclists = []  # cyclists potentially obstructing from reaching desired position
+        # case with no slower cyclists
+        if len(self.cat1_cyclists)==0: 
+            # move the desired lateral speed to the position
+            if abs(req_lat_move) < self.omega_des:  # handle case where desired lateral speed would overshoot the position within one time step
+                self.v_lat = req_lat_move
+            else:  # when the required lateral distance is not covered in one time step, handle whether tho move right or left at desired lateral speed
+                if req_lat_move < 0:
+                    self.v_lat = -self.omega_des
+                else:
+                    self.v_lat = self.omega_des
+        else: # case with slower cyclists remaining                
+            # remove cat. 1 cyclists that are not influencing the potential trajectory
+            remove_indices = []
+            for i in range(len(self.blocked_space_indiv)):
+                obstr_cyclists.append(self.blocked_space_indiv[i][0])  # append cyclist object from the remaining cat. 1 cyclists
+            
+            # find non-obstructing cyclists depending on the direction of lateral movement
+            for i in range(len(obstr_cyclists)):  
+                if req_lat_move < 0:  # when moving to the right
+                    if obstr_cyclists[i].getPos()[1] > self.getPos()[1]+1 or obstr_cyclists[i].getPos()[1] < self.des_lat_pos-1:
+                        remove_indices.append(i)
+                else:  # when moving to the left
+                    if obstr_cyclists[i].getPos()[1] < self.getPos()[1]-1 or obstr_cyclists[i].getPos()[1] > self.des_lat_pos+1:
+                        remove_indices.append(i)
+            
+            # remove cycists not influencing the trajectory
+            for i in sorted(remove_indices, reverse=True):
+                del obstr_cyclists[i]
+            
+            # if there is no obstructing cyclist, do the same as above and go towards the desired position at the end of the CR
+            if len(obstr_cyclists)==0:
+                if abs(req_lat_move) < self.omega_des:
                     self.v_lat = req_lat_move
-                else:  # when the required lateral distance is not covered in one time step, handle whether tho move right or left at desired lateral speed
+                else:
                     if req_lat_move < 0:
                         self.v_lat = -self.omega_des
                     else:
                         self.v_lat = self.omega_des
-                if self.unique_id==check_cyclist_id: print("No cat. 1 leader, v_lat={}".format(round(self.v_lat,2)))
-            else: # case with slower cyclists remaining                
-                # remove cat. 1 cyclists that are not influencing the potential trajectory
-                remove_indices = []
-                for i in range(len(self.blocked_space_indiv)):
-                    obstr_cyclists.append(self.blocked_space_indiv[i][0])  # append cyclist object from the remaining cat. 1 cyclists
-                
-                # find non-obstructing cyclists depending on the direction of lateral movement
-                for i in range(len(obstr_cyclists)):  
-                    if req_lat_move < 0:  # when moving to the right
-                        if obstr_cyclists[i].getPos()[1] > self.getPos()[1]+1 or obstr_cyclists[i].getPos()[1] < self.des_lat_pos-1:
-                            remove_indices.append(i)
-                    else:  # when moving to the left
-                        if obstr_cyclists[i].getPos()[1] < self.getPos()[1]-1 or obstr_cyclists[i].getPos()[1] > self.des_lat_pos+1:
-                            remove_indices.append(i)
-                
-                # remove cycists not influencing the trajectory
-                for i in sorted(remove_indices, reverse=True):
-                    del obstr_cyclists[i]
-                
-                # if there is no obstructing cyclist, do the same as above and go towards the desired position at the end of the CR
-                if len(obstr_cyclists)==0:
-                    if abs(req_lat_move) < self.omega_des:
-                        self.v_lat = req_lat_move
-                    else:
-                        if req_lat_move < 0:
-                            self.v_lat = -self.omega_des
-                        else:
-                            self.v_lat = self.omega_des
-                            
-                else: # if there are obstructing cyclists, project these cyclists to when you would pass
-                    for i in range(len(obstr_cyclists)):
-                        # calc dist to passing point
-                        p1 = self.getPos()[0]
-                        v1 = self.v0
-                        p2 = obstr_cyclists[i].getPos()[0]
-                        v2 = obstr_cyclists[i].getSpeed()
-                        time_to_pass = 10000
-                        if isinstance(self.unique_id, str):
-                            time_to_pass = 10000
-                        else:
-                            time_to_pass = (p2-p1)/(v1-v2)
-                        dist_to_pass = v1*time_to_pass
                         
-                        # calculate lateral passing point
-                        lat_passing_point = 0
-                        if req_lat_move < 0:
-                            lat_passing_point = obstr_cyclists[i].getPos()[1]-(self.width+self.sr_width) # one meter to the right of the center
-                        else:
-                            lat_passing_point = obstr_cyclists[i].getPos()[1]+(self.width+self.sr_width) # one meter to the right of the center
-                        # calc moving angle (which angle is the absolute steepest)
-                        angle_temp = math.atan2((lat_passing_point-self.getPos()[1]), dist_to_pass)
-                        obstr_cyclists[i] = [obstr_cyclists[i], abs(angle_temp), dist_to_pass, lat_passing_point-self.getPos()[1]]
-                    
-                    # go for the steepest angle (which angle is the absolute steepest)
-                    steepest_angle_temp = 0
-                    for i in range(len(obstr_cyclists)):
-                        if obstr_cyclists[i][1] > steepest_angle_temp:
-                            steepest_angle_temp = obstr_cyclists[i][1]
+            else: # if there are obstructing cyclists, project these cyclists to when you would pass
+                for i in range(len(obstr_cyclists)):
+                    # calc dist to passing point
+                    p1 = self.getPos()[0]
+                    v1 = self.v0
+                    p2 = obstr_cyclists[i].getPos()[0]
+                    v2 = obstr_cyclists[i].getSpeed()
+                    time_to_pass = 10000
+                    if isinstance(self.unique_id, str):
+                        time_to_pass = 10000
+                    else:
+                        time_to_pass = (p2-p1)/(v1-v2)
+                    dist_to_pass = v1*time_to_pass
                     
-                    # actually required lateral speed
+                    # calculate lateral passing point
+                    lat_passing_point = 0
                     if req_lat_move < 0:
-                        self.v_lat = -(self.getSpeed()*math.tan(steepest_angle_temp))
+                        lat_passing_point = obstr_cyclists[i].getPos()[1]-(self.width+self.sr_width) # one meter to the right of the center
                     else:
-                        self.v_lat = (self.getSpeed()*math.tan(steepest_angle_temp))
-                    
-            
-            # "look-back" module: do not cut-off cyclists that are too close to avoid a collision
-            if (self.do_look_back) & (self.getSpeed() > 0.5):
-                self.findCat3Behind()
-                proj_Cat3Behind = []
-                if req_lat_move <= 0:
-                    proj_Cat3Behind = [l for l in self.cat3_behind if l.getPos()[1] <= self.pos[1] and l.getPos()[1] > (self.des_lat_pos-self.width)]
-                else:
-                    proj_Cat3Behind = [l for l in self.cat3_behind if l.getPos()[1] > self.pos[1] and l.getPos()[1] < (self.des_lat_pos+self.width)]
-                # for each of those cyclists, check if they are able avoid a collision with their braking power when cut off; this is a very aggressive variant, because it does not consider any politeness to let others overtake first
-                required_braking = 0
-                for i in proj_Cat3Behind:
-                    required_braking = ((i.getSpeed()-self.getSpeed())**2) / (2*((self.getPos()[0]-i.getPos()[0])-self.length))
-                    if 2*required_braking > self.b_max:
-                        self.v_lat = 0
-                        self.cut_off_flag = True
+                        lat_passing_point = obstr_cyclists[i].getPos()[1]+(self.width+self.sr_width) # one meter to the right of the center
+                    # calc moving angle (which angle is the absolute steepest)
+                    angle_temp = math.atan2((lat_passing_point-self.getPos()[1]), dist_to_pass)
+                    obstr_cyclists[i] = [obstr_cyclists[i], abs(angle_temp), dist_to_pass, lat_passing_point-self.getPos()[1]]
                 
-                lateral_neighbors = self.model.space.get_neighbors(self.pos,self.length,False)
-                if req_lat_move <= 0:
-                    lateral_neighbors = [l for l in lateral_neighbors if l.getPos()[1] < self.getPos()[1]]
+                # go for the steepest angle (which angle is the absolute steepest)
+                steepest_angle_temp = 0
+                for i in range(len(obstr_cyclists)):
+                    if obstr_cyclists[i][1] > steepest_angle_temp:
+                        steepest_angle_temp = obstr_cyclists[i][1]
+                
+                # actually required lateral speed
+                if req_lat_move < 0:
+                    self.v_lat = -(self.getSpeed()*math.tan(steepest_angle_temp))
                 else:
-                    lateral_neighbors = [l for l in lateral_neighbors if l.getPos()[1] > self.getPos()[1]]
+                    self.v_lat = (self.getSpeed()*math.tan(steepest_angle_temp))
                 
-                if len(lateral_neighbors) != 0:
-                    self.v_lat = 0 
+        
+        # "look-back" module: do not cut-off cyclists that are too close to avoid a collision
+        if (self.do_look_back) & (self.getSpeed() > 0.5):
+            self.findCat3Behind()
+            proj_Cat3Behind = []
+            if req_lat_move <= 0:
+                proj_Cat3Behind = [l for l in self.cat3_behind if l.getPos()[1] <= self.pos[1] and l.getPos()[1] > (self.des_lat_pos-self.width)]
+            else:
+                proj_Cat3Behind = [l for l in self.cat3_behind if l.getPos()[1] > self.pos[1] and l.getPos()[1] < (self.des_lat_pos+self.width)]
+            # for each of those cyclists, check if they are able avoid a collision with their braking power when cut off; this is a very aggressive variant, because it does not consider any politeness to let others overtake first
+            required_braking = 0
+            for i in proj_Cat3Behind:
+                required_braking = ((i.getSpeed()-self.getSpeed())**2) / (2*((self.getPos()[0]-i.getPos()[0])-self.length))
+                if 2*required_braking > self.b_max:
+                    self.v_lat = 0
                     self.cut_off_flag = True
             
-                if self.unique_id==check_cyclist_id: print("Cyclists behind={}, required braking={}, b_max={}, v_lat={}".format(proj_Cat3Behind, required_braking, self.b_max, self.v_lat))
-                if self.unique_id==check_cyclist_id: print("Lateral_neighbors: ", [i.unique_id for i in lateral_neighbors])
-
-            # feasible lateral speed (restricted by max lateral speed and acceleration)
-            max_speed_left = self.v_lat_prev + self.d_omega_max*dt
-            max_speed_right = self.v_lat_prev - self.d_omega_max*dt
-            if self.v_lat > max_speed_left:
-                self.v_lat = max_speed_left
-                self.cut_off_flag = True
-            if self.v_lat < max_speed_right:
-                self.v_lat = max_speed_right
-                self.cut_off_flag = True
+            lateral_neighbors = [l for l in self.neighbors if 0 < self.model.distance2(self, l) <= self.length**2]
+            if req_lat_move <= 0:
+                lateral_neighbors = [l for l in lateral_neighbors if l.getPos()[1] < self.getPos()[1]]
+            else:
+                lateral_neighbors = [l for l in lateral_neighbors if l.getPos()[1] > self.getPos()[1]]
             
-            # check for max lateral speed
-            self.omega_max = min(self.omega_max, (0.1+0.1*self.getSpeed()))
-            if self.v_lat > self.omega_max:
-                self.v_lat = self.omega_max
+            if len(lateral_neighbors) != 0:
+                self.v_lat = 0 
                 self.cut_off_flag = True
-            if self.v_lat < -self.omega_max:
-                self.v_lat = -self.omega_max
-                self.cut_off_flag = True            
-            
-            if self.unique_id==check_cyclist_id: print("Max_speed_left={}, max_speed_right={}".format(round(max_speed_left,2), round(max_speed_right,2)))
-            if self.unique_id==check_cyclist_id: print("Cat. 1 present, v_lat={}".format(round(self.v_lat,2)))
-            
-            
-            ''' Find the leader '''
-            # find the leader
-            self.findCat12() # get slower cyclists in front
-            potential_leaders = []
+        
+
+        self.limitLatSpeed()
+
+        if self.traced: self.obstr_ids = [i[0].unique_id for i in obstr_cyclists]
+
+        ''' Find the leader '''
+        # find the leader
+        self.findCat12() # get slower cyclists in front
+        potential_leaders = []
+        self.leader = 0
+        if len(self.cat12_cyclists)==0: # if there is no leader
             self.leader = 0
-            if len(self.cat12_cyclists)==0: # if there is no leader
-                self.leader = 0
-            else: # if there are leader(s)
-                # subtract obstructing cyclists from potential leaders
-                del_from_pot_lead = []
-                for i in obstr_cyclists:
-                    del_from_pot_lead.append(i[0])
-                if self.unique_id==check_cyclist_id: print("Obstr_cyclists: ", [i.unique_id for i in del_from_pot_lead])
-                if self.cut_off_flag == False:
-                    potential_leaders = list(set(self.cat12_cyclists) - set(del_from_pot_lead))
-                else:
-                    potential_leaders = self.cat12_cyclists
-                
-                if self.des_lat_pos-self.getPos()[1] >= 0:  # move to the left
-                    potential_leaders = [i for i in potential_leaders if i.getPos()[1] >= self.getPos()[1]-(self.width) and i.getPos()[1] <= self.des_lat_pos+(self.width)]
-                    if self.getSpeed() > 0.5:
-                        potential_leaders = [i for i in potential_leaders if i.getPos()[1] <= (self.getPos()[1]+self.width)+(self.omega_max/self.getSpeed())*(i.getPos()[0]-self.getPos()[0])]
-                if self.des_lat_pos-self.getPos()[1] < 0:  # move to the right
-                    potential_leaders = [i for i in potential_leaders if i.getPos()[1] <= self.getPos()[1]+(self.width) and i.getPos()[1] >= self.des_lat_pos-(self.width)]
-                    if self.getSpeed() > 0.5:
-                        potential_leaders = [i for i in potential_leaders if i.getPos()[1] >= (self.getPos()[1]-self.width)-(self.omega_max/self.getSpeed())*(i.getPos()[0]-self.getPos()[0])]
-                
-                if len(potential_leaders) != 0:
-                    # obtain closest of those inside the shape
-                    closest_pos = self.getPos()[0]+self.cr_length # start finding closest leader in consideration range
-                    for i in potential_leaders: # find the closest potential leader
-                        if i.getPos()[0] < closest_pos:
-                            self.leader = i
-                            closest_pos = i.getPos()[0]
-                else:
-                    self.leader = 0
-            
-            if self.unique_id==check_cyclist_id: print("Cut_off_flag={}".format(self.cut_off_flag))
-            if self.unique_id==check_cyclist_id and self.leader!=0: print("Direct leader {}".format(self.leader.unique_id))
-            if self.unique_id==check_cyclist_id and self.leader==0: print("No direct leader")
-            
-            
-        ''' LEVEL 3: Acceleration according to NDM '''
-        def findAcc(self):
-            if self.unique_id==check_cyclist_id: print("\n****** LEVEL 3: ACCELERATION **********")
-            # define the ndm parameters and functions
-            headway_s = 0
-            delta_v = 0
-            safety_dist_d = self.sr_length + self.length/2  # longitudinal safety distance for NDM
-            acc = 0  # realised acceleration
-            dec1 = 0  # realised deceleration 1
-            dec2 = 0  # realised deceleration 2
-            
-            # calculate potential (positive) acceleration
-            if self.leader == 0: # if there is no leader
-                acc = (self.v0-self.getSpeed())/self.a_des
+        else: # if there are leader(s)
+            # subtract obstructing cyclists from potential leaders
+            del_from_pot_lead = []
+            for i in obstr_cyclists:
+                del_from_pot_lead.append(i[0])
+            if self.cut_off_flag == False:
+                potential_leaders = list(set(self.cat12_cyclists) - set(del_from_pot_lead))
+            else:
+                potential_leaders = self.cat12_cyclists
             
-            elif self.leader != 0:  # if there is a leader
-                headway_s = self.leader.getPos()[0]-self.getPos()[0]  # headway to leader (between centers of cyclists)
-                delta_v = self.getSpeed()-self.leader.getSpeed()  # speed difference to leader
-                if headway_s <= safety_dist_d:
-                    acc = 0
-                else:
-                    acc = (self.v0-self.getSpeed())/self.a_des
-                
-                # calculate first deceleration part: matching the speed of the slower leader
-                if delta_v > 0:
-                    if headway_s > self.length:
-                        dec1 = min((delta_v**2)/(2*(headway_s-self.length)), self.b_max) # necessary deceleration to match speed
-                    # handle the case where cyclists are colliding at the beginning of the simulation
-                    else: 
-                        dec1 = self.b_max
-                        
-                # calculate second deceleration part: fall back to maintain the desired safety distance
-                if delta_v <= 1 and headway_s <= safety_dist_d: 
-                    dec2 = self.b_max / ((self.length-safety_dist_d)**2) * ((headway_s-safety_dist_d)**2)
-                if self.unique_id==check_cyclist_id: print("delta_v={}, hw_s={}, safety_d={}".format(round(delta_v,2),round(headway_s,2),round(safety_dist_d,2)))
+            if self.des_lat_pos-self.getPos()[1] >= 0:  # move to the left
+                potential_leaders = [i for i in potential_leaders if i.getPos()[1] >= self.getPos()[1]-(self.width) and i.getPos()[1] <= self.des_lat_pos+(self.width)]
+                if self.getSpeed() > 0.5:
+                    potential_leaders = [i for i in potential_leaders if i.getPos()[1] <= (self.getPos()[1]+self.width)+(self.omega_max/self.getSpeed())*(i.getPos()[0]-self.getPos()[0])]
+            if self.des_lat_pos-self.getPos()[1] < 0:  # move to the right
+                potential_leaders = [i for i in potential_leaders if i.getPos()[1] <= self.getPos()[1]+(self.width) and i.getPos()[1] >= self.des_lat_pos-(self.width)]
+                if self.getSpeed() > 0.5:
+                    potential_leaders = [i for i in potential_leaders if i.getPos()[1] >= (self.getPos()[1]-self.width)-(self.omega_max/self.getSpeed())*(i.getPos()[0]-self.getPos()[0])]
             
-            self.acceleration = acc - min(dec1+dec2, self.b_max) # limit total deceleration to b_max
-            if self.unique_id==check_cyclist_id: print("acc={}, dec1={}, dec2={}".format(round(acc,2),round(dec1,2),round(dec2,2)))
-            if self.unique_id==check_cyclist_id: print("Total acceleration={}".format(round(self.acceleration,2)))
+            if len(potential_leaders) != 0:
+                # obtain closest of those inside the shape
+                closest_pos = self.getPos()[0]+self.cr_length # start finding closest leader in consideration range
+                for i in potential_leaders: # find the closest potential leader
+                    if i.getPos()[0] < closest_pos:
+                        self.leader = i
+                        closest_pos = i.getPos()[0]
+            else:
+                self.leader = 0
+        
+        
+        
+    # feasible lateral speed (restricted by max lateral speed and acceleration)
+    def limitLatSpeed(self):
+        max_speed_left = self.v_lat_prev + self.d_omega_max*self.model.params.dt
+        max_speed_right = self.v_lat_prev - self.d_omega_max*self.model.params.dt
+        if self.v_lat > max_speed_left:
+            self.v_lat = max_speed_left
+            self.cut_off_flag = True
+        if self.v_lat < max_speed_right:
+            self.v_lat = max_speed_right
+            self.cut_off_flag = True
+        
+        # check for max lateral speed
+        self.omega_max = min(self.omega_max, (0.1+0.1*self.getSpeed()))
+        if self.v_lat > self.omega_max:
+            self.v_lat = self.omega_max
+            self.cut_off_flag = True
+        if self.v_lat < -self.omega_max:
+            self.v_lat = -self.omega_max
+            self.cut_off_flag = True
+    
+    
+    ''' FREE FLOW: Levels 1-3 without other cyclists in the neighbourhood '''
+    # closed-form result of the level functions when nobody is in the consideration range, the backward view or beside the cyclist:
+    # relaxation towards the desired lateral position p (at the desired lateral speed) and the desired speed v0 (no leader)
+    def freeFlow(self):
+        self.cat1_cyclists.clear()
+        self.cat12_cyclists.clear()
+        self.des_lat_pos = self.p
+        req_lat_move = self.des_lat_pos - self.pos[1]
+        if abs(req_lat_move) < self.omega_des:
+            self.v_lat = req_lat_move
+        elif req_lat_move < 0:
+            self.v_lat = -self.omega_des
+        else:
+            self.v_lat = self.omega_des
+        self.limitLatSpeed()
+        if self.traced: self.obstr_ids = []
+        self.leader = 0
+        self.findAcc()  # acceleration (v0-speed)/a_des without a leader
+    
+    
+    ''' LEVEL 3: Acceleration according to NDM '''
+    def findAcc(self):
+        # define the ndm parameters and functions
+        headway_s = 0
+        delta_v = 0
+        safety_dist_d = self.sr_length + self.length/2  # longitudinal safety distance for NDM
+        acc = 0  # realised acceleration
+        dec1 = 0  # realised deceleration 1
+        dec2 = 0  # realised deceleration 2
         
+        # calculate potential (positive) acceleration
+        if self.leader == 0: # if there is no leader
+            acc = (self.v0-self.getSpeed())/self.a_des
         
-        ''' 
-        **********************************
-        *** STEP AND ADVANCE FUNCTIONS ***
-        **********************************
-        '''
+        elif self.leader != 0:  # if there is a leader
+            headway_s = self.leader.getPos()[0]-self.getPos()[0]  # headway to leader (between centers of cyclists)
+            delta_v = self.getSpeed()-self.leader.getSpeed()  # speed difference to leader
+            if headway_s <= safety_dist_d:
+                acc = 0
+            else:
+                acc = (self.v0-self.getSpeed())/self.a_des
+            
+            # calculate first deceleration part: matching the speed of the slower leader
+            if delta_v > 0:
+                if headway_s > self.length:
+                    dec1 = min((delta_v**2)/(2*(headway_s-self.length)), self.b_max) # necessary deceleration to match speed
+                # handle the case where cyclists are colliding at the beginning of the simulation
+                else: 
+                    dec1 = self.b_max
+                    
+            # calculate second deceleration part: fall back to maintain the desired safety distance
+            if delta_v <= 1 and headway_s <= safety_dist_d: 
+                dec2 = self.b_max / ((self.length-safety_dist_d)**2) * ((headway_s-safety_dist_d)**2)
         
-        # Read surroundings and determine next coordinates after they all take actions (Note that the agent hasn't really moved when this function is called)
-        def step(self):
-            ''' CALL LEVEL FUNCTIONS '''                
-            if self.unique_id==check_cyclist_id: print("active\n(v0={}, p={})".format(round(self.v0,2),round(self.p,2)))
+        self.acceleration = acc - min(dec1+dec2, self.b_max) # limit total deceleration to b_max
+        if self.traced: self.acc_details = (acc, dec1, dec2)
+    
+    
+    ''' 
+    **********************************
+    *** STEP AND ADVANCE FUNCTIONS ***
+    **********************************
+    '''
+    
+    # Read surroundings and determine next coordinates after they all take actions (Note that the agent hasn't really moved when this function is called)
+    def step(self):
+        ''' CALL LEVEL FUNCTIONS '''                
+        self.findNeighbors() # neighbourhood shared by the level functions
+        if len(self.neighbors) == 0:
+            self.freeFlow() # free cyclist: same result as the level functions without neighbours
+        else:
             self.findLatPos() # level 1: lateral position
             self.findTraj() # level 2: moving angle and leader
             self.findAcc() # level 3: accelerations
-            
-            ''' CALL UPDATE FUNCTIONS '''
-            self.calPos()
-            self.calSpeed()
-            self.updateCR()
-            self.updateSR()
         
-            if self.unique_id==check_cyclist_id: print("\n****** UPDATED VALUES *****************")
-            if self.unique_id==check_cyclist_id: print("v={}, cr_length={}, sr_length={}".format(round(self.speed,2),round(self.cr_length,2),round(self.sr_length,2)))
-            
-        # Take (physical) actions, this function would be called automatically after the step() function
-        def advance(self):
-            self.model.space.move_agent(self,self.next_coords) # update on the canvas
-            self.pos = (self.next_coords[0],self.next_coords[1]) # update self attributes
-            self.speed = self.next_speed
-            self.v_lat_prev = self.v_lat
-            self.omega_max = omega_max
-            self.cut_off_flag = False
-            # clear bicycles which finish the trip
-            if self.pos[0] >= 300:
-                self.model.to_be_removed.append(self)
-    
-    #%% Model class
-    
-    class BikeLane(Model):
-        def __init__(self):
-            super().__init__()
-            self.schedule = SimultaneousActivation(self)
-            
-            self.space = ContinuousSpace(300.1, path_width, torus=True) # Changed the torus=False here: otherwise, there will be an error because agents are 'out of bounds'
-            
-            # Initialize model variables
-            self.time_step = 0
-            self.inflow_count = 0 # The number of bicycle in the vertical queue that will enter
-            self.n_agents = 0  # Current number of agents (bicycles) on the entire bike lane
-            self.initial_coords = (0,1)
-            self.to_be_removed = [] # A list storing bicycles which finish the trip at the time step and to be removed
-            
-            # Add virtual bicycles for the optional bottleneck
-            if bottleneck_width in [1.0,1.5,2.0]:
-                print("Bottleneck is active with {} m".format(bottleneck_width))
-                # add virtual bicycles at defined positions depending on bottleneck positions
-                virt_positions = []
-                if bottleneck_width == 1.0:
-                    # 4 cyclists
-                    virt_positions = [[254,2.4-(4-path_width)], [253,2.8-(4-path_width)], [252,3.2-(4-path_width)], [251,3.6-(4-path_width)]]
-                elif bottleneck_width == 1.5:
-                    # 3 cyclists
-                    virt_positions = [[253,2.9-(4-path_width)], [252,3.3-(4-path_width)], [251,3.7-(4-path_width)]]
-                else:
-                    # 2 cyclists
-                    virt_positions = [[252,3.4-(4-path_width)], [251,3.8-(4-path_width)]]
-                    
-                for i in range(len(virt_positions)):
-                    b = Bicycle('virtual_bn_{}'.format(i), self)
-                    b_pos = (virt_positions[i][0], virt_positions[i][1])
-                    self.schedule.add(b)
-                    self.space.place_agent(b, b_pos)    
-                    
-            # Data collection functions, collect positions of every bicycle at every step, namely trajectories
-            self.datacollector = DataCollector(agent_reporters={"Position": "pos", "Speed": "speed", "latSpeed": "v_lat", "ID": "unique_id", "desSpeed": "v0", "srLength": "sr_length", "srWidth": "sr_width", "crLength": "cr_length"})  # , "leaderDetails": "leader_details"
+        ''' CALL UPDATE FUNCTIONS '''
+        self.calPos()
+        self.calSpeed()
+        self.updateCR()
+        self.updateSR()
+
+        ''' TRACE DECISIONS '''
+        if self.traced:
+            self.model.trace.record(self.model.time_step+1, self.unique_id, self.pos[0], self.pos[1], self.speed, self.v0, self.des_lat_pos, self.v_lat, self.obstr_ids,
+                         self.leader.unique_id if self.leader != 0 else None, *self.acc_details, self.acceleration, self.cut_off_flag)
+
+    # Take (physical) actions, this function would be called automatically after the step() function
+    def advance(self):
+        self.pos = self.next_coords # update self attributes (the tuple of the next coordinates is not changed afterwards)
+        self.speed = self.next_speed
+        self.v_lat_prev = self.v_lat
+        self.omega_max = self.model.params.omega_max
+        self.cut_off_flag = False
+        # clear bicycles which finish the trip
+        if self.pos[0] >= self.model.params.path_length:
+            self.model.to_be_removed.append(self)
+
+#%% Model class
+
+class BikeLane(Model):
+    def __init__(self, params, inflow_step, virt_positions, recorder, trace = None):
+        super().__init__()
+        self.params = params  # parameters of the run (shared by all cyclists)
+        self.inflow_step = inflow_step  # time steps at which cyclists enter the path
+        self.trace = trace  # DecisionTrace or None
+        self.schedule = SimultaneousActivation(self)
+        
+        # Cyclists sorted by longitudinal position for the neighbour search, rebuilt once per step
+        self.space_length = params.path_length + 0.1  # neighbours are searched in a toroidal space of this length and the path width (as in the Mesa ContinuousSpace used before)
+        self.index_x = []
+        self.index_agents = []
         
-        def deduct(self):
-            self.n_agents = self.n_agents - 1
+        # Initialize model variables
+        self.time_step = 0
+        self.inflow_count = 0 # The number of bicycle in the vertical queue that will enter
+        self.n_agents = 0  # Current number of agents (bicycles) on the entire bike lane
+        self.initial_coords = (0,1)
+        self.to_be_removed = [] # A list storing bicycles which finish the trip at the time step and to be removed
         
-        def step(self):
-            # Execute agents' functions, including both step and advance
-            self.schedule.step()
-            # Remove out of bound agents
-            for b in self.to_be_removed:
-                #print("Remove Bicycle ",b.unique_id)
+        # Add virtual bicycles for the optional bottleneck
+        for i in range(len(virt_positions)):
+            b = Bicycle('virtual_bn_{}'.format(i), self)
+            b.record_id = -1-i
+            b.pos = (virt_positions[i][0], virt_positions[i][1])
+            self.schedule.add(b)
+                
+        # Trajectory recorder, collect positions of every bicycle at every step, namely trajectories
+        self.recorder = recorder
+    
+    # continue from a snapshot with other parameters, inflow, recorder and trace (warm start); the bottleneck is built again
+    def restart(self, params, inflow_step, virt_positions, recorder, trace = None):
+        self.params = params
+        self.inflow_step = inflow_step
+        self.recorder = recorder
+        self.trace = trace
+        for b in list(self.schedule.agents):
+            if isinstance(b.unique_id, str):
                 self.schedule.remove(b)
-                self.space.remove_agent(b)
-            self.deduct() # reduce n_agents by 1
-            self.to_be_removed = []
-            
-            # Add bicycle agents at certain time steps
-            if self.inflow_count < len(inflow_step):
-                if self.time_step == inflow_step[self.inflow_count]:
-                    b = Bicycle(self.inflow_count, self)
-                    self.schedule.add(b)
-                    self.space.place_agent(b, (0,0.5+(random.random()*(path_width-1)))) # self.initial_coords
-                    self.inflow_count += 1
-                    self.n_agents += 1
-            # Update the time
-            self.time_step += 1
-            print("\n\n\nStep {}, cyclist {}".format(self.time_step,check_cyclist_id))  # review steps in console
-            # Execute data collector
-            self.datacollector.collect(self)
+            else:
+                b.setParameters(params)
+                b.next_speed = b.speed
+                b.updateCR()
+                b.updateSR()
+                b.traced = trace is not None and trace.traces(b.unique_id)
+        for i in range(len(virt_positions)):
+            b = Bicycle('virtual_bn_{}'.format(i), self)
+            b.record_id = -1-i
+            b.pos = (virt_positions[i][0], virt_positions[i][1])
+            b.speed = 0  # virtual bicycles stand still (cyclists are already on the path)
+            self.schedule.add(b)
+    
+    # sort the cyclists by longitudinal position
+    def buildIndex(self):
+        self.index_agents = sorted(self.schedule.agents, key=lambda a: a.pos[0])
+        self.index_x = [a.pos[0] for a in self.index_agents]
+    
+    # cyclists within [x-backward, x+forward] of an agent, including the lateral neighbours across the ends of the toroidal space
+    def getNeighbors(self, agent, backward, forward):
+        x = agent.pos[0]
+        neighbors = self.index_agents[bisect_left(self.index_x, x-backward):bisect_right(self.index_x, x+forward)]
+        neighbors.remove(agent)  # the agent itself is always in its window (and only there)
+        length = agent.length
+        if x-length < 0:
+            neighbors += self.index_agents[bisect_left(self.index_x, x-length+self.space_length):bisect_right(self.index_x, x+length+self.space_length)]
+        if x+length > self.space_length:
+            neighbors += self.index_agents[bisect_left(self.index_x, x-length-self.space_length):bisect_right(self.index_x, x+length-self.space_length)]
+        return neighbors
+    
+    # squared distance between two agents in the toroidal space
+    def distance2(self, a, b):
+        dx = abs(a.pos[0]-b.pos[0])
+        dx = min(dx, self.space_length-dx)
+        dy = abs(a.pos[1]-b.pos[1])
+        dy = min(dy, self.params.path_width-dy)
+        return dx**2 + dy**2
+    
+    # record the state of all agents in the current step
+    def collect(self):
+        agents = list(self.schedule.agents)
+        self.recorder.record(self.time_step, [b.record_id for b in agents], [b.pos[0] for b in agents], [b.pos[1] for b in agents],
+                             [b.speed for b in agents], [b.v_lat for b in agents], [b.v0 for b in agents],
+                             [b.sr_length for b in agents], [b.sr_width for b in agents], [b.cr_length for b in agents])
     
+    # jump over the time steps in which no cyclist is on the path (up to the next arrival or the given time step), only the virtual bicycles are recorded
+    def fastForward(self, stop):
+        if self.time_step == 0 or any(not isinstance(b.unique_id, str) for b in self.schedule.agents):
+            return False  # the virtual bicycles only stand still after the first step
+        if self.inflow_count < len(self.inflow_step):
+            stop = min(stop, self.inflow_step[self.inflow_count])
+        if stop <= self.time_step:
+            return False
+        skipped = stop - self.time_step
+        agents = list(self.schedule.agents)
+        self.recorder.recordSteps(range(self.time_step+1, stop+1), [b.record_id for b in agents], [b.pos[0] for b in agents], [b.pos[1] for b in agents],
+                                  [b.speed for b in agents], [b.v_lat for b in agents], [b.v0 for b in agents],
+                                  [b.sr_length for b in agents], [b.sr_width for b in agents], [b.cr_length for b in agents])
+        self.schedule.steps += skipped
+        self.schedule.time += skipped
+        self.n_agents -= skipped  # deducted in every step
+        self.time_step = stop
+        return True
     
+    def deduct(self):
+        self.n_agents = self.n_agents - 1
+    
+    # add a new cyclist at a random lateral entry position
+    def addBicycle(self, unique_id):
+        b = Bicycle(unique_id, self)
+        b.pos = (0,0.5+(random.random()*(self.params.path_width-1))) # self.initial_coords
+        self.schedule.add(b)
+    
+    # remove the bicycles which finished the trip
+    def removeBicycles(self, agents):
+        for b in agents:
+            #print("Remove Bicycle ",b.unique_id)
+            self.schedule.remove(b)
+    
+    def step(self):
+        # Sort the cyclists for the neighbour search
+        self.buildIndex()
+        # Execute agents' functions, including both step and advance
+        self.schedule.step()
+        # Remove out of bound agents
+        self.removeBicycles(self.to_be_removed)
+        self.deduct() # reduce n_agents by 1
+        self.to_be_removed = []
+        
+        # Add bicycle agents at certain time steps (one per time step, later arrivals wait at the entry)
+        if self.inflow_count < len(self.inflow_step):
+            if self.time_step >= self.inflow_step[self.inflow_count]:
+                self.addBicycle(self.inflow_count)
+                self.inflow_count += 1
+                self.n_agents += 1
+        # Update the time
+        self.time_step += 1
+        # Record the trajectories
+        self.collect()
+
+
+def micromodel(seed = 4,  # random seed
+               duration = 3600,  # simulation duration (s) 3600/12 = 300 s
+               dt = 0.2,  # simulation time step length (s)
+               demand = [50,100,150,200,250,300,350,400,300,200,100,50],  # list with the number of cyclists per time slot; or a function of time (s) returning the flow (bic/h); or a csv file with observed counts (columns Time, Count)
+               path_width = 2,  # width of the simulated path (m, excl. 2x 0.5 m space on side of the path); put 3 m or less for the bottleneck to work
+               bottleneck_width = 0,  # (m); put numbers [1.0,1.5,2.0] for the bottleneck to be active; all other values mean that the bottleneck is not active; or a list with one width per bottleneck position
+               path_length = 300,  # length of the simulated path (m); cyclists leave the path at its end
+               bottleneck_positions = [250],  # positions of the bottlenecks along the path (m); each one starts 1 m behind and narrows the path over the next 5 m
+               v0_mean = 4.5,  # mean of desired speed (m/s)
+               v0_sd = 1,  # standard deviation of desired speed (m/s)
+               p_mean = 1,  # mean of desired lateral position / distance from right edge +0.5 (m)
+               p_sd = 0.2,  # standard deviation for desired lateral position (m)
+               check_cyclist_id = -1,  # follow the choices of an individual cyclist with his unique_id (printed and traced); put -1 for no output
+               b_length = 2,  # bicycle length (m)
+               b_width = 0.8,  # bicycle width (m)
+               d_standing = 0.1,  # minimum standing distance to other cyclists (m)
+               a_des = 1.5,  # relaxation time for acceleration (s)
+               b_max = 2,  # maximum braking (m/s^2, >0)
+               omega_max = 0.3,  # maximum lateral speed (m/s)
+               omega_des = 0.15,  # desired lateral speed (m/s)
+               d_omega_max = 0.2,  # maximum lateral acceleration (m/s^2)
+               phi = 4,  # scale length of the consideration range (-)
+               alpha = 0.8,  # scale length of the safety region (-)
+               beta = 0.05,  # scale width of the safety region (-)
+               gamma = 0.85,  # passing threshold (-)
+               lookback = 1,  # proportion of cyclists looking back before moving laterally [0,1]
+               side_obstacle = 0.2,  # width deducted from both sides of the extended path to simulate obstacles (m)
+               data_filename = "simulation_data",  # type 0 if file should not be saved
+               demand_input = 'stochastic',  # 'fixed' for fixed interval inflow; 'bernoulli' or 'poisson' for vectorized draws (poisson: several arrivals per time step)
+               engine = 'mesa',  # 'mesa' for one Bicycle object per cyclist; 'numpy' for the vectorized engine in vectorized.py; 'numba' for the vectorized engine with compiled kernels (kernels.py)
+               segments = 1,  # number of worker processes that each decide for one longitudinal segment of the path (domain.py, engines 'numpy' and 'numba'); 1 for a single process
+               stream_output = False,  # True to write the trajectories in chunks to data/<data_filename>_<date>.parquet during the run and return a lazily loaded dataset (requires pyarrow)
+               chunk_rows = 2**18,  # number of trajectory rows per chunk when streaming the output
+               trace = None,  # DecisionTrace (tracing.py) to record the decisions of cyclists; None for no tracing
+               trace_filename = 0,  # type a name to export the trace to data/<trace_filename>_<date>.csv; 0 for no export
+               use_cache = True,  # look up the result in the local result store (cache.py) before simulating; False to always simulate; or a ResultCache
+               refresh_cache = False,  # True to simulate again and replace the stored result
+               checkpoint_interval = 0,  # simulated time between checkpoints of the full model state (s), saved to data/<checkpoint_filename>.pkl; 0 for no checkpoints
+               checkpoint_filename = "checkpoint",  # name of the checkpoint file (overwritten by every checkpoint)
+               resume_from = None,  # checkpoint file to continue a run from; the run keeps the parameters stored in the checkpoint
+               snapshot_time = None,  # simulated time (s) at which the state of the path is saved to data/<snapshot_filename>.pkl for warm starts; None for no snapshot
+               snapshot_filename = "snapshot",  # name of the snapshot file
+               warm_start = None,  # snapshot file to start from instead of an empty path; the run uses the parameters of this call (same dt, path_width, path_length and engine) and its trajectories start at the snapshot time
+               fast_forward = True,  # jump over time steps without cyclists on the path (same results); False to simulate every time step
+               measure = None,  # measurement or list of measurements (measurement.py, e.g. EdieAggregator) fed with every time step during the run
+               store_trajectories = True,  # False to only keep the measurements and return their tables instead of the trajectories
+               telemetry = None):  # RunTelemetry (telemetry.py) to count and time the hot paths of the engine; None for no instrumentation
+
+    arguments = dict(locals())  # all parameters of this run
+    
+    # continue an interrupted run with its stored parameters (only the output parameters of this call are applied)
+    if type(resume_from) is str:
+        from checkpoint import loadCheckpoint
+        checkpoint = loadCheckpoint(resume_from)
+        resumed_arguments = dict(checkpoint['arguments'])
+        for name in ['data_filename', 'trace_filename', 'use_cache', 'checkpoint_interval', 'checkpoint_filename']:
+            resumed_arguments[name] = arguments[name]
+        resumed_arguments['resume_from'] = checkpoint
+        return micromodel(**resumed_arguments)
+    
+    if not store_trajectories and (measure is None or measure == []):
+        raise ValueError("A run without stored trajectories needs at least one measurement (measure=...).")
+    if engine not in ['mesa', 'numpy', 'numba']:
+        raise ValueError("engine must be 'mesa', 'numpy' or 'numba'.")
+    if not isinstance(segments, int) or isinstance(segments, bool) or segments < 1:
+        raise ValueError("segments must be a whole number of at least 1.")
+    if stream_output and checkpoint_interval > 0:
+        raise ValueError("Checkpoints are not supported when the output is streamed.")
+    if segments > 1:
+        if engine not in ['numpy', 'numba']:
+            raise ValueError("Segments need the vectorized engine (engine='numpy' or 'numba').")
+        if trace is not None or check_cyclist_id != -1 or checkpoint_interval > 0 or resume_from is not None or snapshot_time is not None or warm_start is not None:
+            raise ValueError("Segments do not support tracing, checkpoints, snapshots and warm starts.")
+    
+    
+    ''' 
+    ********************
+    *** RESULT CACHE ***
+    ********************
+    ''' 
+    
+    # results of identical parameter sets are loaded from the store (not for traced, streamed or measured runs, which need the simulation itself)
+    cache = None
+    if (use_cache and trace is None and check_cyclist_id == -1 and not stream_output and warm_start is None and snapshot_time is None and measure is None
+            and store_trajectories and telemetry is None):
+        from cache import ResultCache
+        cache = use_cache if isinstance(use_cache, ResultCache) else ResultCache()
+        cache_key = cache.key(arguments)
+        if not refresh_cache:
+            agent_pos = cache.load(cache_key)
+            if agent_pos is not None:
+                if type(data_filename) is str:
+                    agent_pos.to_csv("data/" + data_filename + datetime.now().strftime("_%Y-%m-%d_%H%M") + ".csv", sep=';')
+                return agent_pos
+
+    
+    ''' 
+    **********************
+    *** COMPUTE INFLOW ***
+    **********************
+    ''' 
+    
+    # Arrival time steps of the cyclists (demand.py); cyclists arriving in the same time step are queued at the entry
+    path_width += 1
+    virt_positions = virtualPositions(bottleneck_width, path_width, bottleneck_positions)
+    if any(x < 0 or x >= path_length for x, y in virt_positions):
+        raise ValueError("The active bottlenecks must lie on the path (positions between 0 and path_length-5 m).")
+    random.seed(seed)  # set the seed
+    time_steps = int(duration/dt)
+    inflow_step = generateArrivals(demand, time_steps, dt, demand_input, seed).tolist()  # time points that bicycles arrive at the bike lane
+    
+    # trace the decisions of the cyclist to check (replaces the console output of earlier versions)
+    if trace is None and check_cyclist_id != -1:
+        trace = DecisionTrace([check_cyclist_id], echo=True)
+
+
     '''
     ***********************
     *** RUN MODEL STEPS ***
     ***********************
     '''
     
-    model = BikeLane()
-    for i in range(time_steps):  # simulation time steps
-        model.step()
-        
-    agent_pos = model.datacollector.get_agent_vars_dataframe()
-    agent_pos = agent_pos.reset_index(level=[0,1]) # reset index to make column callable
-    agent_pos['Position'] = agent_pos['Position'].apply(lambda pos: list(pos))
-    agent_pos[['Position_x', 'Position_y']] = pd.DataFrame(agent_pos['Position'].tolist(), index=agent_pos.index)
+    # expected number of recorded rows (cyclists crossing the path at desired speed plus the virtual bicycles)
+    recorder_capacity = int(len(inflow_step)*path_length/(v0_mean*dt)) + max(len(virt_positions), 4)*time_steps
+    stream_to = None
+    if stream_output:
+        stream_to = "data/" + (data_filename if type(data_filename) is str else "simulation_data") + datetime.now().strftime("_%Y-%m-%d_%H%M") + ".parquet"
+        os.makedirs("data", exist_ok=True)
+    
+    params = SimpleNamespace(dt=dt, path_width=path_width, v0_mean=v0_mean, v0_sd=v0_sd, p_mean=p_mean, p_sd=p_sd,
+                             b_length=b_length, b_width=b_width, a_des=a_des, b_max=b_max, omega_max=omega_max, omega_des=omega_des,
+                             d_omega_max=d_omega_max, phi=phi, alpha=alpha, beta=beta, gamma=gamma, lookback=lookback, side_obstacle=side_obstacle,
+                             path_length=path_length)
+    if resume_from is not None:  # loaded checkpoint: continue with its model and random state
+        model = resume_from['model']
+        trace = model.trace
+        random.setstate(resume_from['random_state'])
+    else:
+        for width, position in zip(bottleneckWidths(bottleneck_width, bottleneck_positions), bottleneck_positions):
+            if width in [1.0,1.5,2.0]:
+                print("Bottleneck is active with {} m at {} m".format(width, position))
+        measures = [] if measure is None else (measure if isinstance(measure, list) else [measure])
+        for m in measures:  # the measurements aggregate with the time step, duration and path width of this run
+            if hasattr(m, 'setRun'):
+                m.setRun(dt, duration, arguments['path_width'])
+        recorder = TrajectoryRecorder(recorder_capacity, stream_to if store_trajectories else None, chunk_rows, measures, store_trajectories)
+        if warm_start is not None:  # populated path of a snapshot with the parameters, demand and random stream of this run
+            from checkpoint import loadCheckpoint
+            model = loadCheckpoint(warm_start)['model']
+            if model.params.dt != dt or model.params.path_width != path_width or model.params.path_length != path_length:
+                raise ValueError("A warm start needs the same dt, path_width and path_length as the snapshot.")
+            if isinstance(model, BikeLane) != (engine == 'mesa'):
+                raise ValueError("A warm start needs the engine of the snapshot ('mesa' for a Mesa snapshot, 'numpy' or 'numba' for a vectorized one).")
+            if engine != 'mesa':  # numpy and numba share the state of the vectorized engine
+                import kernels
+                model.compiled = engine == 'numba' and kernels.available
+            first_step = model.time_step
+            # cyclists on the path and those waiting at the entry keep their unique_id, the arrivals of this run follow
+            queue = [t for t in model.inflow_step[model.inflow_count:] if t < first_step]
+            inflow_step = model.inflow_step[:model.inflow_count] + queue + [t for t in inflow_step if t >= first_step]
+            model.restart(params, inflow_step, virt_positions, recorder, trace)
+        elif engine in ['numpy', 'numba']:
+            from vectorized import VectorBikeLane
+            import kernels
+            if engine == 'numba' and not kernels.available:
+                print("Input warning: Numba is not installed, the vectorized engine runs without compiled kernels.")
+            if segments > 1:
+                from domain import DomainBikeLane
+                model = DomainBikeLane(params, inflow_step, virt_positions, recorder, segments, compiled=(engine == 'numba'))
+            else:
+                model = VectorBikeLane(params, inflow_step, virt_positions, recorder, trace, compiled=(engine == 'numba'))
+        else:
+            model = BikeLane(params, inflow_step, virt_positions, recorder, trace)
+    
+    checkpoint_steps = int(checkpoint_interval/dt)
+    if checkpoint_steps > 0:
+        from checkpoint import saveCheckpoint
+        os.makedirs("data", exist_ok=True)
+        arguments['resume_from'] = None
+    
+    snapshot_step = int(round(snapshot_time/dt)) if snapshot_time is not None else -1
+    if snapshot_step >= 0:
+        from checkpoint import saveCheckpoint
+        os.makedirs("data", exist_ok=True)
+    
+    # a demand function cannot be stored in a checkpoint: store the arrival rates it gives in every time step (same arrivals when the run continues)
+    if (checkpoint_steps > 0 or snapshot_step >= 0) and callable(demand):
+        arguments['demand'] = arrivalRates(demand, time_steps, dt)[0].tolist()
+    
+    if telemetry is not None:
+        telemetry.start(model)
+    try:
+        while model.time_step < time_steps:  # simulation time steps
+            # time steps with an empty path are skipped up to the next arrival (but not past a checkpoint or the snapshot)
+            stop = time_steps
+            if checkpoint_steps > 0:
+                stop = min(stop, (model.time_step//checkpoint_steps + 1)*checkpoint_steps)
+            if snapshot_step > model.time_step:
+                stop = min(stop, snapshot_step)
+            if not (fast_forward and model.fastForward(stop)):
+                model.step()
+            if model.time_step == snapshot_step:
+                saveCheckpoint("data/" + snapshot_filename + ".pkl", model, model.time_step, arguments)
+            if checkpoint_steps > 0 and model.time_step % checkpoint_steps == 0:
+                saveCheckpoint("data/" + checkpoint_filename + ".pkl", model, model.time_step, arguments)
+    finally:
+        if telemetry is not None:  # the engine runs its original methods again
+            telemetry.stop(model)
+        if segments > 1:  # stop the segment workers
+            model.close()
+
+    if trace is not None and type(trace_filename) is str:
+        trace.export("data/" + trace_filename + datetime.now().strftime("_%Y-%m-%d_%H%M") + ".csv")
+
+    # measurements only: their tables instead of the trajectories (measurements of a resumed run are those stored in the checkpoint)
+    if not store_trajectories:
+        tables = [m.table() for m in model.recorder.measures]
+        if telemetry is not None:
+            for table in tables:
+                table.attrs['telemetry'] = telemetry.summary
+        return tables if isinstance(measure, list) else tables[0]
+    
+    # streamed output: the trajectories are already on disk
+    if stream_output:
+        return model.recorder.close()
+    
+    if cache is not None:
+        cache.put(cache_key, model.recorder.getColumns())
+    agent_pos = model.recorder.toDataFrame()
+    if telemetry is not None:
+        agent_pos.attrs['telemetry'] = telemetry.summary
     if type(data_filename) is str:
         agent_pos.to_csv("data/" + data_filename + datetime.now().strftime("_%Y-%m-%d_%H%M") + ".csv", sep=';')
         
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+*************************************************************
+*** TRAJECTORY RECORDER (replaces the Mesa DataCollector) ***
+*************************************************************
+
+The state of all agents is written every step into growable, typed NumPy
+column buffers. At the end of the run the filled part of the buffers is
+handed over to a pandas DataFrame without copying the numeric columns.
+
+Alternatively, the recorder streams the trajectories to a compressed Parquet
+file in chunks of a fixed number of rows while the simulation runs, so that
+memory use stays bounded for any duration (requires pyarrow).
+
+Measurements (measurement.py) are fed with every recorded step as well; with
+store=False only they are kept and the trajectories are not stored at all.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+class TrajectoryRecorder:
+
+    # recorded columns and their types (names as in the data frame returned by micromodel)
+    columns = {'Step': np.int64,
+               'AgentID': np.int64,  # virtual bicycles of the bottleneck have negative ids
+               'Position_x': np.float64,
+               'Position_y': np.float64,
+               'Speed': np.float64,
+               'latSpeed': np.float64,
+               'desSpeed': np.float64,
+               'srLength': np.float64,
+               'srWidth': np.float64,
+               'crLength': np.float64}
+
+    def __init__(self, 
+                 capacity = 2**16,  # initial number of rows in the buffers
+                 stream_to = None,  # Parquet file to stream the trajectories to; None to keep them in memory
+                 chunk_rows = 2**18,  # number of rows written to the Parquet file at once
+                 measures = [],  # measurements (measurement.py) fed with every recorded step
+                 store = True):  # False to only feed the measurements and not store the trajectories
+        self.n_rows = 0
+        self.stream_to = stream_to
+        self.chunk_rows = chunk_rows
+        self.writer = None
+        self.measures = list(measures)
+        self.store = store
+        if stream_to is not None:
+            capacity = chunk_rows
+        if not store:
+            capacity = 0
+        self.buffers = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.columns.items()}
+
+    # grow all buffers (at least doubling) so that n_new more rows fit
+    def reserve(self, n_new):
+        capacity = len(self.buffers['Step'])
+        if self.n_rows + n_new > capacity:
+            capacity = max(2*capacity, self.n_rows + n_new)
+            for name in self.buffers:
+                buffer = np.empty(capacity, dtype=self.columns[name])
+                buffer[:self.n_rows] = self.buffers[name][:self.n_rows]
+                self.buffers[name] = buffer
+
+    # only the filled part of the buffers is stored in a checkpoint (an open Parquet writer cannot be stored)
+    def __getstate__(self):
+        if self.writer is not None:
+            raise TypeError("A recorder that streams to a Parquet file cannot be stored.")
+        state = self.__dict__.copy()
+        state['buffers'] = self.getColumns()
+        return state
+
+    # append the state of all agents in one step (one array-like entry per agent for each variable)
+    def record(self, step, ids, x, y, speed, lat_speed, des_speed, sr_length, sr_width, cr_length):
+        for measure in self.measures:
+            measure.record(step, ids, x, y, speed)
+        if not self.store:
+            return
+        n_new = len(ids)
+        self.reserve(n_new)
+        start, end = self.n_rows, self.n_rows + n_new
+        self.buffers['Step'][start:end] = step
+        for name, values in zip(list(self.columns)[1:], [ids, x, y, speed, lat_speed, des_speed, sr_length, sr_width, cr_length]):
+            self.buffers[name][start:end] = values
+        self.n_rows = end
+        if self.stream_to is not None and self.n_rows >= self.chunk_rows:
+            self.flush()
+
+    # append the same state of the agents for several steps (values of the agents as in record)
+    def recordSteps(self, steps, ids, x, y, speed, lat_speed, des_speed, sr_length, sr_width, cr_length):
+        for measure in self.measures:
+            measure.recordSteps(steps, ids, x, y, speed)
+        if not self.store:
+            return
+        n_steps, n_agents = len(steps), len(ids)
+        n_new = n_steps*n_agents
+        self.reserve(n_new)
+        start, end = self.n_rows, self.n_rows + n_new
+        self.buffers['Step'][start:end] = np.repeat(steps, n_agents)
+        for name, values in zip(list(self.columns)[1:], [ids, x, y, speed, lat_speed, des_speed, sr_length, sr_width, cr_length]):
+            self.buffers[name][start:end] = np.tile(np.asarray(values, dtype=self.columns[name]), n_steps)
+        self.n_rows = end
+        if self.stream_to is not None and self.n_rows >= self.chunk_rows:
+            self.flush()
+
+    # write the rows in the buffers to the Parquet file and empty the buffers
+    def flush(self):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Streaming the trajectories requires pyarrow (pip install pyarrow).")
+        if self.n_rows == 0 and self.writer is not None:
+            return
+        table = pa.table(self.getColumns())
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.stream_to, table.schema, compression='zstd')
+        self.writer.write_table(table)
+        self.n_rows = 0
+
+    # write the remaining rows, close the Parquet file and return a lazily loaded dataset of it
+    def close(self):
+        import pyarrow.dataset as ds
+        self.flush()
+        self.writer.close()
+        return ds.dataset(self.stream_to, format='parquet')
+
+    # recorded columns (views on the filled part of the buffers)
+    def getColumns(self):
+        return {name: buffer[:self.n_rows] for name, buffer in self.buffers.items()}
+
+    # hand the recorded trajectories over to a data frame (numeric columns are not copied)
+    def toDataFrame(self):
+        return columnsToDataFrame(self.getColumns())
+
+
+# data frame as returned by micromodel from the recorded columns
+def columnsToDataFrame(columns):
+    ids = columns['AgentID']
+    if ids.min(initial=0) < 0:  # label the virtual bicycles like the Mesa agents
+        labels = ids.astype(object)
+        for i in np.unique(ids[ids < 0]):
+            labels[ids == i] = 'virtual_bn_{}'.format(-1-i)
+        ids = labels
+    return pd.DataFrame({'Step': columns['Step'],
+                         'AgentID': ids,
+                         'Speed': columns['Speed'],
+                         'latSpeed': columns['latSpeed'],
+                         'ID': ids,
+                         'desSpeed': columns['desSpeed'],
+                         'srLength': columns['srLength'],
+                         'srWidth': columns['srWidth'],
+                         'crLength': columns['crLength'],
+                         'Position_x': columns['Position_x'],
+                         'Position_y': columns['Position_y']}, copy=False)
+
+
+# load (a part of) a streamed trajectory dataset into the data frame format of micromodel, e.g. filter=pyarrow.dataset.field('Step') < 3000
+def loadTrajectories(dataset, filter = None):
+    table = dataset.to_table(filter=filter)
+    return columnsToDataFrame({name: table.column(name).to_numpy() for name in TrajectoryRecorder.columns})
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+*****************************************
+*** REPLICATIONS WITH MULTIPLE SEEDS ***
+*****************************************
+
+Runs one scenario (keyword arguments of micromodel) for several seeds in a
+process pool. The trajectories are merged with a Replication column and the
+results of all replications are aggregated with confidence intervals.
+Each replication is analysed in its worker process, so that only the results
+(and optionally the trajectories) are sent back to the main process.
+'''
+
+import multiprocessing
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from model import micromodel
+from analysis import compute_fd
+
+
+# run and analyse one replication (module level so that it can be sent to the worker processes)
+def _runReplication(args):
+    replication, seed, scenario, fd_settings, cross_section, keep_trajectories = args
+    agent_pos = micromodel(seed=seed, **scenario)
+    cyclists = agent_pos[agent_pos['AgentID'].map(type) != str]  # without the virtual bicycles of the bottleneck
+
+    # cyclists passing the cross section during the simulation
+    span = cyclists.groupby('AgentID')['Position_x'].agg(['min', 'max'])
+    n_passing = ((span['min'] < cross_section) & (span['max'] >= cross_section)).sum()
+
+    duration = scenario.get('duration', 3600)
+    summary = {'Replication': replication,
+               'Seed': seed,
+               'mean_speed': cyclists['Speed'].mean(),  # (m/s)
+               'throughput': n_passing*3600/duration,  # (bic/h)
+               'n_cyclists': cyclists['AgentID'].nunique()}
+
+    fd = compute_fd(agent_pos, dt=scenario.get('dt', 0.2), duration=duration,
+                    path_width=scenario.get('path_width', 2), **fd_settings)
+    fd.insert(0, 'Replication', replication)
+    summary['flow'] = fd['Flow_(/h/m)'].mean()  # (bic/h/m)
+    summary['density'] = fd['Density_(/m2)'].mean()  # (bic/m2)
+
+    if keep_trajectories:
+        agent_pos.insert(0, 'Replication', replication)
+    else:
+        agent_pos = None
+    return agent_pos, fd, summary
+
+
+# mean and confidence interval (Student t) of each column over the replications
+def confidence_intervals(values,  # data frame with one row per replication
+                         level = 0.95):
+    n = values.count()
+    mean = values.mean()
+    sd = values.std(ddof=1)
+    half_width = stats.t.ppf(0.5 + level/2, n - 1) * sd / np.sqrt(n)
+    return pd.DataFrame({'mean': mean,
+                         'sd': sd,
+                         'ci_low': mean - half_width,
+                         'ci_high': mean + half_width,
+                         'n': n})
+
+
+def replicate(n_replications = 30,  # number of replications; seeds 0 ... n_replications-1 unless seeds are given
+              seeds = None,  # list with the seed of each replication
+              processes = None,  # number of worker processes; None for all cores
+              level = 0.95,  # confidence level of the intervals
+              agg_time = 15,  # aggregation interval for fundamental diagram (s)
+              agg_dist = [100, 250],  # aggregation distance / space for fundamental diagram (min and max value in m)
+              cross_section = 250,  # position of the cross section for the throughput (m)
+              keep_trajectories = True,  # False to only return the aggregated results (less memory and inter-process traffic)
+              **scenario):  # parameters of micromodel (e.g. demand, bottleneck_width, engine)
+
+    if seeds is None:
+        seeds = list(range(n_replications))
+    if scenario.get('stream_output', False):
+        raise ValueError("replicate needs the trajectories in memory; stream_output is not supported.")
+    scenario['data_filename'] = 0  # the merged trajectories are returned instead of saved per replication
+    fd_settings = {'agg_time': agg_time, 'agg_dist': agg_dist}
+
+    jobs = [(replication, seed, scenario, fd_settings, cross_section, keep_trajectories) for replication, seed in enumerate(seeds)]
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(_runReplication, jobs, chunksize=1)
+
+    agent_pos = pd.concat([r[0] for r in results], ignore_index=True) if keep_trajectories else None
+    fd = pd.concat([r[1] for r in results], ignore_index=True)
+    summary = pd.DataFrame([r[2] for r in results])
+
+    # aggregated results with confidence intervals
+    statistics = confidence_intervals(summary[['mean_speed', 'throughput', 'n_cyclists', 'flow', 'density']], level)
+    fd_statistics = pd.concat({column: confidence_intervals(fd.pivot(index='Replication', columns='Time_(s)', values=column).astype(float), level)
+                               for column in ['Flow_(/h/m)', 'Density_(/m2)', 'Speed']}, axis=1)
+
+    return {'trajectories': agent_pos,  # merged trajectories with a Replication column (None if keep_trajectories is False)
+            'summary': summary,  # results of each replication
+            'statistics': statistics,  # mean and confidence interval of the results over the replications
+            'fd': fd,  # flow/density/speed points of each replication and aggregation interval
+            'fd_statistics': fd_statistics}  # mean and confidence interval of the fundamental diagram points per aggregation interval
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+****************************
+*** TELEMETRY OF A RUN ***
+****************************
+
+Profiling counters of the hot paths of the engines: cumulative time and number
+of calls of the level functions, the neighbour queries, the recording of the
+trajectories and the insertion and removal of agents, a histogram of the
+number of neighbours per query, the active agents per step and a summary with
+the steps per second and the memory use.
+
+Pass a RunTelemetry to micromodel(telemetry=...). The timed methods of the
+engine are only replaced by timed versions for the duration of that run and
+restored afterwards, so a run without telemetry executes the original code.
+The methods are replaced on the classes, so only one run at a time can be
+measured (a second telemetry is refused while the first is active).
+The summary is attached to the returned data frame (agent_pos.attrs['telemetry']).
+'''
+
+import functools
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from recorder import TrajectoryRecorder
+
+
+# timed methods of the engines (a method that calls another timed method includes its time)
+mesa_model_methods = ['step', 'buildIndex', 'getNeighbors', 'collect', 'fastForward', 'addBicycle', 'removeBicycles']
+mesa_agent_methods = ['step', 'findNeighbors', 'findLatPos', 'findTraj', 'findAcc', 'freeFlow', 'advance']
+vector_methods = ['step', 'decide', 'findNeighbors', 'findLatPos', 'findTraj', 'findAcc', 'advance', 'collect', 'fastForward',
+                  'addBicycle', 'removeBicycles']
+recorder_methods = ['record', 'recordSteps']
+
+
+# peak resident memory of the current process since it was started (MB), including earlier runs in the same session
+def peakMemory():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak/1024 if sys.platform != 'darwin' else peak/1024**2  # kB on Linux, bytes on macOS
+    except ImportError:  # Windows
+        return None
+
+
+class RunTelemetry:
+
+    active = None  # telemetry of the run that is measured at the moment
+
+    def __init__(self,
+                 trace_memory = False):  # True to trace the Python and NumPy allocations of the run for its own peak memory (slows the run down)
+        self.trace_memory = trace_memory
+        self.counters = {}  # name of the timed function: [calls, cumulative time (s)]
+        self.neighbor_counts = []  # number of queries (by the number of neighbours found)
+        self.active_steps = []  # recorded steps and the cyclists on the path in them (virtual bicycles not counted)
+        self.active_agents = []
+        self.summary = {}
+        self.patched = []  # (class, method name, original attribute or None) of the replaced methods
+
+    # timed version of a method; sizes gives the number of neighbours of each query from the arguments and the result
+    def timed(self, name, method, sizes = None):
+        counter = self.counters.setdefault(name, [0, 0.0])
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            counter[1] += time.perf_counter() - start
+            counter[0] += 1
+            if sizes is not None:
+                self.addNeighborCounts(sizes(args, result))
+            return result
+        return wrapper
+
+    def addNeighborCounts(self, sizes):
+        counts = np.bincount(np.asarray(sizes, dtype=np.int64))
+        if len(counts) > len(self.neighbor_counts):
+            self.neighbor_counts.extend([0]*(len(counts)-len(self.neighbor_counts)))
+        for n in np.flatnonzero(counts):
+            self.neighbor_counts[n] += int(counts[n])
+
+    # replace a method of a class by its timed version (restored by stop)
+    def patch(self, cls, name, label, sizes = None):
+        self.patched.append((cls, name, cls.__dict__.get(name)))
+        setattr(cls, name, self.timed(label, getattr(cls, name), sizes))
+
+    # active agents in the steps recorded by the recorder of this run
+    def recorderWrappers(self, recorder):
+        record, record_steps = TrajectoryRecorder.record, TrajectoryRecorder.recordSteps
+
+        def countRecord(rec, step, ids, *columns):
+            if rec is recorder:
+                self.active_steps.append(step)
+                self.active_agents.append(int((np.asarray(ids) >= 0).sum()))
+            return record(rec, step, ids, *columns)
+
+        def countRecordSteps(rec, steps, ids, *columns):
+            if rec is recorder:
+                self.active_steps.extend(int(s) for s in steps)
+                self.active_agents.extend([int((np.asarray(ids) >= 0).sum())]*len(steps))
+            return record_steps(rec, steps, ids, *columns)
+        return countRecord, countRecordSteps
+
+    # instrument the engine of a model before the run
+    def start(self, model):
+        if RunTelemetry.active is not None:
+            raise RuntimeError("Another run is measured by a telemetry at the moment; only one run at a time can be measured.")
+        RunTelemetry.active = self
+        from model import BikeLane, Bicycle
+        if isinstance(model, BikeLane):
+            for name in mesa_model_methods:
+                self.patch(type(model), name, 'model.' + name, (lambda args, result: [len(result)]) if name == 'getNeighbors' else None)
+            for name in mesa_agent_methods:
+                self.patch(Bicycle, name, 'agent.' + name)
+        else:
+            for name in vector_methods:
+                self.patch(type(model), name, name, (lambda args, result: np.bincount(result[0], minlength=len(args[1]))) if name == 'findNeighbors' else None)
+        for name, wrapper in zip(recorder_methods, self.recorderWrappers(model.recorder)):
+            self.patched.append((TrajectoryRecorder, name, TrajectoryRecorder.__dict__[name]))
+            setattr(TrajectoryRecorder, name, self.timed('recorder.' + name, wrapper))
+        self.first_step = model.time_step
+        if self.trace_memory:  # allocations of this run only (memory traced before the run is subtracted)
+            self.started_tracing = not tracemalloc.is_tracing()
+            if self.started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.traced_before = tracemalloc.get_traced_memory()[0]
+        self.start_time = time.perf_counter()
+
+    # restore the original methods and summarize the run
+    def stop(self, model):
+        wall_time = time.perf_counter() - self.start_time
+        run_peak = None
+        if self.trace_memory:
+            run_peak = (tracemalloc.get_traced_memory()[1] - self.traced_before)/1024**2
+            if self.started_tracing:
+                tracemalloc.stop()
+        for cls, name, original in reversed(self.patched):
+            if original is None:
+                delattr(cls, name)
+            else:
+                setattr(cls, name, original)
+        self.patched = []
+        RunTelemetry.active = None
+        steps = model.time_step - self.first_step
+        agent_steps = int(np.sum(self.active_agents))
+        neighbors = np.arange(len(self.neighbor_counts))
+        queries = int(np.sum(self.neighbor_counts))
+        self.summary = {'steps': steps,
+                        'wall_time_s': wall_time,
+                        'steps_per_s': steps/wall_time if wall_time > 0 else np.nan,
+                        'agent_steps': agent_steps,
+                        'agent_steps_per_s': agent_steps/wall_time if wall_time > 0 else np.nan,
+                        'max_active_agents': max(self.active_agents, default=0),
+                        'neighbor_queries': queries,
+                        'mean_neighbors': float(np.dot(neighbors, self.neighbor_counts)/queries) if queries else np.nan,
+                        'run_peak_traced_mb': run_peak,  # with trace_memory only
+                        'process_peak_rss_mb': peakMemory()}
+        return self.summary
+
+    # calls and cumulative time of the timed functions, slowest first
+    def timings(self):
+        names = list(self.counters)
+        calls = np.array([self.counters[n][0] for n in names], dtype=np.int64)
+        seconds = np.array([self.counters[n][1] for n in names])
+        table = pd.DataFrame({'Function': names,
+                              'Calls': calls,
+                              'Time_(s)': seconds,
+                              'Time_per_call_(us)': np.divide(seconds*1e6, calls, out=np.zeros(len(names)), where=calls > 0),
+                              'Share_of_run': seconds/self.summary.get('wall_time_s', np.nan)})
+        return table[table['Calls'] > 0].sort_values('Time_(s)', ascending=False, ignore_index=True)
+
+    # number of neighbour queries by the number of neighbours found
+    def neighborHistogram(self):
+        return pd.DataFrame({'Neighbors': np.arange(len(self.neighbor_counts)), 'Queries': np.array(self.neighbor_counts, dtype=np.int64)})
+
+    # cyclists on the path in every recorded step
+    def activeAgents(self):
+        return pd.DataFrame({'Step': np.array(self.active_steps, dtype=np.int64), 'Active_agents': np.array(self.active_agents, dtype=np.int64)})
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+************************************
+*** CHECKPOINTS AND RESUMED RUNS ***
+************************************
+
+A run that continues from a checkpoint must give the trajectories of the
+uninterrupted run, also when the demand is a function of time.
+'''
+
+import contextlib
+import io
+import os
+import pickle
+import pytest
+
+from model import micromodel
+from checkpoint import saveCheckpoint
+
+
+scenario = dict(seed=1, duration=20, engine='numpy', data_filename=0, use_cache=False)
+
+
+def run(**kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return micromodel(**scenario, **kwargs)
+
+
+def test_resume_run_with_demand_function(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    demand = lambda t: 1200 + 60*t  # flow (bic/h) over time
+    full = run(demand=demand)
+    run(demand=demand, checkpoint_interval=15)  # last checkpoint at 15 s
+    with contextlib.redirect_stdout(io.StringIO()):
+        resumed = micromodel(resume_from="data/checkpoint.pkl", data_filename=0, use_cache=False)
+    assert len(full) > 0
+    assert full.reset_index(drop=True).equals(resumed.reset_index(drop=True))
+
+
+def test_failed_checkpoint_leaves_no_file(tmp_path):
+    filename = str(tmp_path / "checkpoint.pkl")
+    with pytest.raises((pickle.PicklingError, AttributeError, TypeError)):
+        saveCheckpoint(filename, lambda: None, 0, {})
+    assert os.listdir(tmp_path) == []
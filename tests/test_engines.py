@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+***********************************************
+*** AGREEMENT OF THE MESA AND NUMPY ENGINES ***
+***********************************************
+
+The vectorized engine (vectorized.py) must give the trajectories and the
+decision trace of the Mesa engine (model.py) on a run with a bottleneck.
+'''
+
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+import pytest
+
+from model import micromodel
+from tracing import DecisionTrace
+
+
+scenario = dict(seed=4, duration=90, demand=[120], bottleneck_width=1.0, data_filename=0, use_cache=False)
+
+
+@pytest.fixture(scope='module')
+def runs():
+    results = {}
+    for engine in ['mesa', 'numpy']:
+        trace = DecisionTrace('all')
+        with contextlib.redirect_stdout(io.StringIO()):
+            agent_pos = micromodel(engine=engine, trace=trace, **scenario)
+        results[engine] = agent_pos, trace.toDataFrame()
+    return results
+
+
+def test_trajectories(runs):
+    reference, vectorized = runs['mesa'][0], runs['numpy'][0]
+    assert len(vectorized) == len(reference)
+    pd.testing.assert_series_equal(vectorized['AgentID'].astype(str), reference['AgentID'].astype(str))
+    for column in ['Position_x', 'Position_y', 'Speed', 'latSpeed']:
+        np.testing.assert_allclose(vectorized[column].to_numpy(dtype=float), reference[column].to_numpy(dtype=float), rtol=0, atol=1e-9)
+
+
+def test_decision_trace(runs):
+    reference, vectorized = runs['mesa'][1], runs['numpy'][1]
+    assert len(vectorized) == len(reference) > 0
+    for column in ['Step', 'AgentID', 'obstructing', 'leader', 'cutOff']:
+        assert vectorized[column].tolist() == reference[column].tolist(), column
+    assert any(len(o) > 1 for o in reference['obstructing'])  # the order of several obstructing cyclists is compared
+    for column in ['Position_x', 'Position_y', 'Speed', 'desSpeed', 'desLatPos', 'latSpeed', 'acc', 'dec1', 'dec2', 'acceleration']:
+        np.testing.assert_allclose(vectorized[column].to_numpy(dtype=float), reference[column].to_numpy(dtype=float), rtol=0, atol=1e-9)
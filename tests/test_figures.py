@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+*************************
+*** GIF FRAME WRITER ***
+*************************
+
+writeGif appends the frames of export_animation to the gif one by one. The
+decoded frames must be the rendered ones, with the frame writer of Pillow
+and with the fallback to Image.save.
+'''
+
+import io
+import numpy as np
+import PIL
+import PIL.GifImagePlugin
+import PIL.Image
+import PIL.ImageSequence
+
+from figures import writeGif
+
+
+# png frames with their own palette, as rendered by the workers of export_animation
+def frames(n = 6):
+    rng = np.random.default_rng(0)
+    images = []
+    for k in range(n):
+        pixels = np.full((30, 80, 3), 255, dtype=np.uint8)
+        pixels[5:25, 10*k:10*k+15] = rng.integers(0, 255, 3)  # a moving block in a new colour
+        image = PIL.Image.fromarray(pixels).quantize(colors=64, method=PIL.Image.Quantize.FASTOCTREE)
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        images.append(buffer.getvalue())
+    return images
+
+
+def check(filename, images):
+    gif = PIL.Image.open(filename)
+    assert gif.n_frames == len(images)
+    assert gif.info.get('loop') == 0 and gif.info.get('duration') == 200
+    for decoded, data in zip(PIL.ImageSequence.Iterator(gif), images):
+        np.testing.assert_array_equal(np.asarray(decoded.convert('RGB')), np.asarray(PIL.Image.open(io.BytesIO(data)).convert('RGB')))
+
+
+def test_pillow_frame_writer(tmp_path):
+    assert int(PIL.__version__.split('.')[0]) >= 12  # version the frame writer is tested with
+    images = frames()
+    writeGif(str(tmp_path / "frames.gif"), iter(images), 5)
+    check(str(tmp_path / "frames.gif"), images)
+
+
+def test_fallback_to_image_save(tmp_path, monkeypatch):
+    monkeypatch.delattr(PIL.GifImagePlugin, 'getheader')
+    images = frames()
+    writeGif(str(tmp_path / "frames.gif"), iter(images), 5)
+    check(str(tmp_path / "frames.gif"), images)
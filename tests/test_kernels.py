@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+*****************************************************
+*** AGREEMENT OF THE NUMBA KERNELS WITH THE ENGINE ***
+*****************************************************
+
+The compiled kernels (kernels.py) must give the same decisions as the NumPy
+code of the vectorized engine (vectorized.py) on a run with a bottleneck.
+'''
+
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('numba')
+
+import kernels
+from model import micromodel
+from vectorized import VectorBikeLane
+
+
+scenario = dict(seed=4, duration=90, demand=[120], bottleneck_width=1.0, data_filename=0, use_cache=False)
+
+
+def run(**kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return micromodel(**scenario, **kwargs)
+
+
+# largest difference between the outputs of a level function (tuples of arrays)
+def difference(reference, compiled):
+    return max(float(np.abs(np.asarray(c, dtype=float)-np.asarray(r, dtype=float)).max(initial=0)) for r, c in zip(reference, compiled))
+
+
+def test_numba_engine_gives_numpy_trajectories():
+    reference = run(engine='numpy')
+    compiled = run(engine='numba')
+    assert len(compiled) == len(reference)
+    pd.testing.assert_series_equal(compiled['AgentID'], reference['AgentID'])
+    for column in ['Position_x', 'Position_y', 'Speed', 'latSpeed']:
+        np.testing.assert_allclose(compiled[column].to_numpy(dtype=float), reference[column].to_numpy(dtype=float), rtol=0, atol=1e-9)
+
+
+def test_level_functions_with_and_without_kernels(monkeypatch):
+    differences = {'findTraj': [], 'findAcc': []}
+    calls = {'passingLatSpeed': 0}
+
+    # every call of a level function is evaluated with the NumPy code and with the kernels on the same state
+    def checked(name):
+        original = getattr(VectorBikeLane, name)
+
+        def wrapper(self, *args):
+            self.compiled = False
+            reference = original(self, *args)
+            self.compiled = True
+            result = original(self, *args)
+            differences[name].append(difference(reference, result))
+            return result
+        return wrapper
+
+    passing = kernels.passingLatSpeed
+
+    def countPassing(*args):
+        calls['passingLatSpeed'] += 1
+        return passing(*args)
+
+    for name in differences:
+        monkeypatch.setattr(VectorBikeLane, name, checked(name))
+    monkeypatch.setattr(kernels, 'passingLatSpeed', countPassing)
+    run(engine='numba')
+
+    assert len(differences['findTraj']) > 0 and len(differences['findAcc']) > 0
+    assert calls['passingLatSpeed'] > 0  # the scenario has obstructing cyclists
+    assert max(differences['findTraj']) <= 1e-12
+    assert max(differences['findAcc']) <= 1e-12
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+***************************************
+*** DECISION TRACING OF CYCLISTS ***
+***************************************
+
+Replaces the console output for check_cyclist_id. Tracing is disabled unless a
+DecisionTrace is passed to micromodel (or check_cyclist_id is set). Agents only
+check one boolean flag per step, so an untraced run does not pay for it.
+The decisions of the traced cyclists are kept in a ring buffer and can be
+exported to a file at the end of the run.
+'''
+
+from collections import deque
+import pandas as pd
+
+
+class DecisionTrace:
+
+    # one record per traced cyclist and step (Step is the step in which the resulting state is recorded in the trajectories)
+    fields = ['Step', 'AgentID', 'Position_x', 'Position_y', 'Speed', 'desSpeed', 'desLatPos', 'latSpeed',
+              'obstructing', 'leader', 'acc', 'dec1', 'dec2', 'acceleration', 'cutOff']
+
+    def __init__(self,
+                 agent_ids = 'all',  # list of unique_ids of the cyclists to trace or 'all'
+                 capacity = 100000,  # number of records kept in the ring buffer (the oldest records are dropped first)
+                 echo = False):  # True to also print every record to the console
+        self.agent_ids = agent_ids if agent_ids == 'all' else set(agent_ids)
+        self.records = deque(maxlen=capacity)
+        self.echo = echo
+
+    # True if the cyclist with this unique_id is traced (virtual bicycles are never traced)
+    def traces(self, unique_id):
+        if isinstance(unique_id, str) or unique_id < 0:
+            return False
+        return self.agent_ids == 'all' or unique_id in self.agent_ids
+
+    # store the decision of one cyclist in one step (obstructing: list of unique_ids; leader: unique_id or None)
+    def record(self, step, unique_id, x, y, speed, v0, des_lat_pos, v_lat, obstructing, leader, acc, dec1, dec2, acceleration, cut_off_flag):
+        obstructing = sorted(obstructing, key=lambda i: (isinstance(i, str), i))  # cyclists by unique_id, then virtual bicycles (the engines find them in different orders)
+        values = (step, unique_id, x, y, speed, v0, des_lat_pos, v_lat, obstructing, leader, acc, dec1, dec2, acceleration, cut_off_flag)
+        self.records.append(values)
+        if self.echo:
+            print("Step {}, cyclist {}: ".format(step, unique_id) + ", ".join("{}={}".format(f, round(v, 2) if isinstance(v, float) else v) for f, v in zip(self.fields[2:], values[2:])))
+
+    def toDataFrame(self):
+        return pd.DataFrame(list(self.records), columns=self.fields)
+
+    # write the records to a csv file (same format as the trajectory data)
+    def export(self, filename):
+        self.toDataFrame().to_csv(filename, sep=';', index=False)
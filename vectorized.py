@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+
+
+'''
+****************************************************************************
+*** VECTORIZED ENGINE (struct-of-arrays version of the model in model.py) ***
+****************************************************************************
+
+All cyclists are held in NumPy arrays (one entry per agent, in the same order
+as the Mesa schedule) and the three decision levels and the NDM acceleration
+are computed for all agents at once. The decision rules are the same as in the
+Bicycle class of model.py, so both engines produce the same trajectories for
+the same seed.
+'''
+
+import numpy as np
+import random
+import kernels
+
+
+# find all pairs (row, agent) for which the agent lies in the longitudinal window [lo, hi] of the row
+def windowPairs(x_sorted, order, lo, hi):
+    start = np.searchsorted(x_sorted, lo, side='left')
+    end = np.searchsorted(x_sorted, hi, side='right')
+    counts = end - start
+    rows = np.repeat(np.arange(len(lo)), counts)
+    offsets = np.cumsum(counts) - counts
+    agents = order[start[rows] + np.arange(counts.sum()) - offsets[rows]]
+    return rows, agents
+
+
+# draw the individual attributes of a new cyclist (same order of random draws as in the Bicycle class)
+def drawAttributes(rng, params):
+    v0 = 0
+    while (v0 < params.v0_mean-2*params.v0_sd) or (v0 > params.v0_mean+2*params.v0_sd):
+        v0 = rng.gauss(params.v0_mean, params.v0_sd)
+    p = rng.uniform(params.p_mean-params.p_sd, params.p_mean+params.p_sd)
+    look_back = rng.random() <= params.lookback
+    return v0, p, look_back
+
+
+class VectorBikeLane:
+
+    # state arrays with one entry per agent
+    state_names = ['ids', 'x', 'y', 'speed', 'v_lat', 'v_lat_prev', 'v0', 'p', 'sr_length', 'sr_width', 'cr_length', 'leader', 'look_back', 'virtual']
+
+    '''
+    ************************************
+    *** INITIALIZATION AND VARIABLES ***
+    ************************************
+    '''
+
+    def __init__(self, params, inflow_step, virt_positions, recorder, trace=None, rng=random, compiled=False):
+        self.params = params
+        self.inflow_step = inflow_step
+        self.recorder = recorder
+        self.trace = trace  # DecisionTrace (tracing.py) or None
+        self.rng = rng
+        self.compiled = compiled and kernels.available  # Numba kernels (kernels.py) for the arithmetic of levels 2 and 3
+        self.space_length = params.path_length + 0.1  # length of the (toroidal) space in which neighbours are searched, as in the Mesa ContinuousSpace
+
+        # Mesa draws the seed of its model RNG from the global generator, draw it as well to stay on the same random stream
+        self.rng.random()
+
+        # Initialize model variables
+        self.time_step = 0
+        self.inflow_count = 0
+        self.initState()
+
+        # Add virtual bicycles for the optional bottleneck
+        for i in range(len(virt_positions)):
+            self.addBicycle(-1-i, virt_positions[i], virtual=True)
+
+    # agent state (one entry per agent, virtual bicycles first and then in order of entry)
+    def initState(self):
+        self.ids = np.zeros(0, dtype=np.int64)  # unique_id, virtual bicycles get negative ids
+        self.x = np.zeros(0)  # longitudinal position
+        self.y = np.zeros(0)  # lateral position
+        self.speed = np.zeros(0)  # longitudinal speed
+        self.v_lat = np.zeros(0)  # lateral speed in the current time step
+        self.v_lat_prev = np.zeros(0)  # lateral speed in the previous time step
+        self.v0 = np.zeros(0)  # desired speed
+        self.p = np.zeros(0)  # desired lateral position
+        self.sr_length = np.zeros(0)  # length of the safety region
+        self.sr_width = np.zeros(0)  # width of the safety region
+        self.cr_length = np.zeros(0)  # consideration range length
+        self.leader = np.zeros(0, dtype=np.int64)  # row of the leading cyclist (-1 if there is no leader)
+        self.look_back = np.zeros(0, dtype=bool)
+        self.virtual = np.zeros(0, dtype=bool)
+
+    # continue from a snapshot with other parameters, inflow, recorder and trace (warm start); the bottleneck is built again
+    def restart(self, params, inflow_step, virt_positions, recorder, trace=None):
+        self.params = params
+        self.inflow_step = inflow_step
+        self.recorder = recorder
+        self.trace = trace
+        self.removeBicycles(self.virtual)
+        self.sr_length = params.b_length/2 + 0.1 + params.alpha*self.speed
+        self.sr_width = params.b_width/2 + 0.1 + params.beta*self.speed
+        self.cr_length = 4 + params.phi*self.speed
+        for i in range(len(virt_positions)):
+            self.addBicycle(-1-i, virt_positions[i], virtual=True)
+
+    # the random module cannot be pickled: checkpoints store the state of the global generator instead (checkpoint.py)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if state['rng'] is random:
+            state['rng'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.rng is None:
+            self.rng = random
+
+    # add a new cyclist with the individual attributes drawn from the distributions (at a random lateral entry position if no position is given)
+    def addBicycle(self, unique_id, pos=None, virtual=False, params=None, rng=None):
+        P = self.params if params is None else params
+        rng = self.rng if rng is None else rng
+        v0, p, look_back = drawAttributes(rng, P)
+        if pos is None:
+            pos = (0, 0.5+(rng.random()*(P.path_width-1)))
+        speed = 0 if virtual else v0  # virtual bicycles stand still
+        self.ids = np.append(self.ids, unique_id)
+        self.x = np.append(self.x, pos[0])
+        self.y = np.append(self.y, pos[1])
+        self.speed = np.append(self.speed, speed)
+        self.v_lat = np.append(self.v_lat, 0)
+        self.v_lat_prev = np.append(self.v_lat_prev, 0)
+        self.v0 = np.append(self.v0, v0)
+        self.p = np.append(self.p, p)
+        self.sr_length = np.append(self.sr_length, P.b_length/2 + 0.1 + speed*P.alpha)
+        self.sr_width = np.append(self.sr_width, P.b_width/2 + 0.1 + speed*P.beta)
+        self.cr_length = np.append(self.cr_length, 4 + speed*P.phi)
+        self.leader = np.append(self.leader, -1)
+        self.look_back = np.append(self.look_back, look_back)
+        self.virtual = np.append(self.virtual, virtual)
+
+    # unique_id of the agent in a row as used in the Mesa engine
+    def label(self, row):
+        return int(self.ids[row]) if self.ids[row] >= 0 else 'virtual_bn_{}'.format(-1-self.ids[row])
+
+    # remove the cyclists in the boolean mask from all state arrays
+    def removeBicycles(self, mask):
+        keep = ~mask
+        for name in self.state_names:
+            setattr(self, name, getattr(self, name)[keep])
+
+
+    '''
+    ***************************
+    *** AUXILIARY FUNCTIONS ***
+    ***************************
+    '''
+
+    # parameters of the agents in the given rows (the same for all agents; a batch (batch.py) returns arrays with the parameters of their corridors)
+    def rowParams(self, rows):
+        return self.params
+
+    # key of a longitudinal position of the agents in the given rows for the neighbour search (the position itself; a batch adds the corridor)
+    def searchKey(self, x, rows):
+        return x
+
+    # rows of the cyclists that decide in this step (all cyclists; a segment worker (domain.py) only decides for the cyclists in its segment)
+    def decidingRows(self):
+        return np.flatnonzero(~self.virtual)
+
+    # find the neighbourhood of all deciding cyclists as a list of (row, agent) pairs
+    def findNeighbors(self, rows):
+        P = self.rowParams(rows)
+        keys = self.searchKey(self.x, slice(None))
+        order = np.argsort(keys, kind='stable')
+        keys_sorted = keys[order]
+        xi = self.x[rows]
+        # 20 m backward view and the consideration range ahead
+        pair_rows, pair_agents = windowPairs(keys_sorted, order, self.searchKey(xi-20, rows), self.searchKey(xi+self.cr_length[rows], rows))
+        # lateral neighbours across the ends of the toroidal space
+        for shift in [self.space_length, -self.space_length]:
+            wrap = np.flatnonzero((xi-P.b_length < 0) if shift > 0 else (xi+P.b_length > self.space_length))
+            if len(wrap):
+                b_length = self.rowParams(rows[wrap]).b_length
+                wrap_rows, wrap_agents = windowPairs(keys_sorted, order, self.searchKey(xi[wrap]-b_length+shift, rows[wrap]),
+                                                     self.searchKey(xi[wrap]+b_length+shift, rows[wrap]))
+                pair_rows = np.concatenate([pair_rows, wrap[wrap_rows]])
+                pair_agents = np.concatenate([pair_agents, wrap_agents])
+        not_self = pair_agents != rows[pair_rows]
+        return pair_rows[not_self], pair_agents[not_self]
+
+    # squared distance between the pairs in the toroidal space, as used by Mesa's get_neighbors
+    def torusDist2(self, q, j):
+        dx = np.abs(self.x[j]-self.x[q])
+        dx = np.minimum(dx, self.space_length-dx)
+        dy = np.abs(self.y[j]-self.y[q])
+        dy = np.minimum(dy, self.params.path_width-dy)
+        return dx**2 + dy**2
+
+
+    '''
+    ***********************
+    *** LEVEL FUNCTIONS ***
+    ***********************
+    '''
+
+    ''' LEVEL 1: Desired lateral position '''
+    def findLatPos(self, rows, Q, J, cat1):
+        P = self.params
+        des_lat_pos = self.p[rows].copy()
+        blocked = np.zeros(len(Q), dtype=bool)  # pairs that remain blocking after the gap search
+
+        c = np.flatnonzero(cat1)
+        if len(c)==0:
+            return des_lat_pos, blocked
+
+        # blocked lateral space of the cat. 1 cyclists, sorted from left to right for every row
+        up = self.y[J[c]] + self.rowParams(rows[Q[c]]).b_width/2
+        c = c[np.lexsort((-up, Q[c]))]
+        b_width = self.rowParams(rows[Q[c]]).b_width
+        gap_rows, first, counts = np.unique(Q[c], return_index=True, return_counts=True)
+        n, K = len(gap_rows), counts.max()
+        g = np.repeat(np.arange(n), counts)
+        k = np.arange(len(c)) - np.repeat(first, counts)
+        UP = np.full((n, K), -np.inf)
+        LO = np.full((n, K), -np.inf)
+        XB = np.full((n, K), -np.inf)
+        PAIR = np.zeros((n, K), dtype=np.int64)
+        UP[g, k] = self.y[J[c]] + b_width/2
+        LO[g, k] = self.y[J[c]] - b_width/2
+        XB[g, k] = self.x[J[c]]
+        PAIR[g, k] = c
+        # if no gap is found, the cyclist the furthest downstream is removed first; removal_round is the round in which it is removed
+        removal_round = np.empty((n, K), dtype=np.int64)
+        np.put_along_axis(removal_round, np.argsort(-XB, axis=1, kind='stable'), np.arange(K)[None, :], axis=1)
+        removal_round[np.arange(K)[None, :] >= counts[:, None]] = -1  # padding
+
+        sr_width = self.sr_width[rows[gap_rows]]
+        des = self.p[rows[gap_rows]]  # if all blocking cyclists are removed, just go to the desired lateral position
+        final_round = np.full(n, K)
+        pending = np.arange(n)
+        positions = np.arange(K)
+        for round_start in range(0, K, 8):  # evaluate up to 8 removal rounds at once
+            r = pending
+            rounds = round_start + np.arange(min(8, K-round_start))
+            active = removal_round[r][:, None, :] >= rounds[None, :, None]  # (rows, rounds, blocking cyclists)
+            up_r = UP[r][:, None, :]
+
+            # index of the previous remaining cyclist (to the left) for each blocking cyclist
+            last_index = np.maximum.accumulate(np.where(active, positions, -1), axis=2)
+            prev_index = np.concatenate([np.full(last_index.shape[:2]+(1,), -1), last_index[:, :, :-1]], axis=2)
+            first_index = np.argmax(active, axis=2)
+            nonempty = active.any(axis=2)
+            lo_prev = LO[r[:, None, None], np.maximum(prev_index, 0)]
+            up_first = UP[r[:, None], first_index]
+            lo_last = LO[r[:, None], np.maximum(last_index[:, :, -1], 0)]
+
+            # gaps/unblocked spaces (left edge, between cyclists, right edge) with their right border and width
+            mid = active & (prev_index >= 0) & (lo_prev > up_r)
+            widths = np.concatenate([np.where(nonempty, np.round(P.path_width-up_first, 2), -np.inf)[:, :, None],
+                                     np.where(mid, np.round(lo_prev-up_r, 2), -np.inf),
+                                     np.where(nonempty, np.round(lo_last, 2), -np.inf)[:, :, None]], axis=2)
+            lowers = np.concatenate([up_first[:, :, None], np.broadcast_to(up_r, mid.shape), np.full(nonempty.shape+(1,), P.side_obstacle)], axis=2)
+
+            # check if there is a gap big enough to fit, including safety region (left to right priority)
+            fits = widths >= 2*sr_width[r, None, None]
+            done = fits.any(axis=2) | ~nonempty
+            resolved = done.any(axis=1)
+            t = np.argmax(done, axis=1)[resolved]
+            rr = r[resolved]
+            choice = np.argmax(fits[resolved, t], axis=1)
+            found = nonempty[resolved, t]
+            des[rr[found]] = lowers[resolved, t, choice][found] + sr_width[rr[found]]
+            final_round[rr] = rounds[t]
+            pending = r[~resolved]
+            if len(pending)==0:
+                break
+
+        des_lat_pos[gap_rows] = des
+        blocked[PAIR[removal_round >= final_round[:, None]]] = True
+        return des_lat_pos, blocked
+
+
+    ''' LEVEL 2: Moving angle and leader '''
+    def findTraj(self, rows, Q, J, des_lat_pos, cat12, blocked):
+        P = self.rowParams(rows)
+        PQ = self.rowParams(rows[Q])  # parameters of the deciding cyclist of each pair
+        n = len(rows)
+        xi, yi, vi = self.x[rows], self.y[rows], self.speed[rows]
+        xj, yj, vj = self.x[J], self.y[J], self.speed[J]
+        req_lat_move = des_lat_pos - yi
+        rq = req_lat_move[Q]
+
+        # move the desired lateral speed to the position (case without obstructing cyclists)
+        v_lat = np.where(np.abs(req_lat_move) < P.omega_des, req_lat_move, np.where(req_lat_move < 0, -P.omega_des, P.omega_des))
+
+        # find obstructing cyclists depending on the direction of lateral movement
+        right = rq < 0
+        obstr = blocked & np.where(right, ~((yj > yi[Q]+1) | (yj < des_lat_pos[Q]-1)), ~((yj < yi[Q]-1) | (yj > des_lat_pos[Q]+1)))
+        o = np.flatnonzero(obstr)
+        if len(o) and self.compiled:
+            oq = Q[o]
+            ro = rows[oq]
+            v_lat = kernels.passingLatSpeed(v_lat, req_lat_move, vi, oq, xi[oq], yi[oq], self.v0[ro], self.sr_width[ro], xj[o], yj[o], vj[o], P.b_width)
+        elif len(o):
+            # project the obstructing cyclists to when you would pass and go for the steepest angle
+            oq = Q[o]
+            time_to_pass = (xj[o]-xi[oq])/(self.v0[rows[oq]]-vj[o])
+            dist_to_pass = self.v0[rows[oq]]*time_to_pass
+            b_width = self.rowParams(rows[oq]).b_width
+            lat_passing_point = np.where(right[o], yj[o]-(b_width+self.sr_width[rows[oq]]), yj[o]+(b_width+self.sr_width[rows[oq]]))
+            angle = np.abs(np.arctan2(lat_passing_point-yi[oq], dist_to_pass))
+            steepest_angle = np.zeros(n)
+            np.maximum.at(steepest_angle, oq, angle)
+            has_obstr = np.bincount(oq, minlength=n) > 0
+            v_obstr = np.where(req_lat_move < 0, -(vi*np.tan(steepest_angle)), vi*np.tan(steepest_angle))
+            v_lat = np.where(has_obstr, v_obstr, v_lat)
+
+        # "look-back" module: do not cut-off cyclists that are too close to avoid a collision
+        cut_off_flag = np.zeros(n, dtype=bool)
+        do_look_back = self.look_back[rows] & (vi > 0.5)
+        lb = do_look_back[Q]
+        if lb.any():
+            dist2 = self.torusDist2(rows[Q], J)
+            behind = lb & (dist2 <= 20**2) & (dist2 > 0) & (xj < xi[Q]) & (xj > xi[Q]-20) & (vj > vi[Q])
+            behind &= np.where(rq <= 0, (yj <= yi[Q]) & (yj > des_lat_pos[Q]-PQ.b_width), (yj > yi[Q]) & (yj < des_lat_pos[Q]+PQ.b_width))
+            b = np.flatnonzero(behind)
+            PB = self.rowParams(rows[Q[b]])
+            required_braking = ((vj[b]-vi[Q[b]])**2) / (2*((xi[Q[b]]-xj[b])-PB.b_length))
+            cut = np.zeros(n, dtype=bool)
+            cut[Q[b[2*required_braking > PB.b_max]]] = True
+            lateral = lb & (dist2 <= PQ.b_length**2) & (dist2 > 0) & np.where(rq <= 0, yj < yi[Q], yj > yi[Q])
+            cut[Q[lateral]] = True
+            v_lat[cut] = 0
+            cut_off_flag |= cut
+
+        if self.compiled:
+            v_lat, cut_off_flag, omega_max = kernels.limitLatSpeed(v_lat, cut_off_flag, self.v_lat_prev[rows], vi, P.d_omega_max, P.omega_max, P.dt)
+        else:
+            # feasible lateral speed (restricted by max lateral speed and acceleration)
+            max_speed_left = self.v_lat_prev[rows] + P.d_omega_max*P.dt
+            max_speed_right = self.v_lat_prev[rows] - P.d_omega_max*P.dt
+            cut_off_flag |= (v_lat > max_speed_left) | (v_lat < max_speed_right)
+            v_lat = np.minimum(np.maximum(v_lat, max_speed_right), max_speed_left)
+
+            # check for max lateral speed
+            omega_max = np.minimum(P.omega_max, (0.1+0.1*vi))
+            cut_off_flag |= (v_lat > omega_max) | (v_lat < -omega_max)
+            v_lat = np.minimum(np.maximum(v_lat, -omega_max), omega_max)
+
+        ''' Find the leader '''
+        # subtract obstructing cyclists from potential leaders (unless the cyclist cuts off somebody)
+        potential = cat12 & (cut_off_flag[Q] | ~obstr)
+        left = rq >= 0
+        potential &= np.where(left, (yj >= yi[Q]-PQ.b_width) & (yj <= des_lat_pos[Q]+PQ.b_width), (yj <= yi[Q]+PQ.b_width) & (yj >= des_lat_pos[Q]-PQ.b_width))
+        fast = vi[Q] > 0.5
+        slope = np.divide(omega_max[Q], vi[Q], out=np.zeros(len(Q)), where=fast)*(xj-xi[Q])
+        potential &= ~fast | np.where(left, yj <= (yi[Q]+PQ.b_width)+slope, yj >= (yi[Q]-PQ.b_width)-slope)
+
+        # obtain closest of the potential leaders
+        leader = np.full(n, -1)
+        pl = np.flatnonzero(potential)
+        if len(pl):
+            pl = pl[np.lexsort((xj[pl], Q[pl]))]
+            lead_rows, first = np.unique(Q[pl], return_index=True)
+            leader[lead_rows] = J[pl[first]]
+
+        return v_lat, leader, obstr, cut_off_flag
+
+
+    ''' LEVEL 3: Acceleration according to NDM '''
+    def findAcc(self, rows, leader):
+        P = self.rowParams(rows)
+        vi = self.speed[rows]
+        has_leader = leader >= 0
+        lead = np.where(has_leader, leader, 0)
+        headway_s = np.where(has_leader, self.x[lead]-self.x[rows], 0)  # headway to leader (between centers of cyclists)
+        delta_v = np.where(has_leader, vi-self.speed[lead], 0)  # speed difference to leader
+        safety_dist_d = self.sr_length[rows] + P.b_length/2  # longitudinal safety distance for NDM
+        if self.compiled:
+            return kernels.ndmAcceleration(vi, self.v0[rows], has_leader, headway_s, delta_v, safety_dist_d, P.a_des, P.b_max, P.b_length)
+
+        # calculate potential (positive) acceleration
+        acc = np.where(has_leader & (headway_s <= safety_dist_d), 0, (self.v0[rows]-vi)/P.a_des)
+
+        # calculate first deceleration part: matching the speed of the slower leader
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dec1 = np.where(headway_s > P.b_length, np.minimum((delta_v**2)/(2*(headway_s-P.b_length)), P.b_max), P.b_max)
+        dec1 = np.where(has_leader & (delta_v > 0), dec1, 0)
+
+        # calculate second deceleration part: fall back to maintain the desired safety distance
+        dec2 = P.b_max / ((P.b_length-safety_dist_d)**2) * ((headway_s-safety_dist_d)**2)
+        dec2 = np.where(has_leader & (delta_v <= 1) & (headway_s <= safety_dist_d), dec2, 0)
+
+        return acc, dec1, dec2
+
+
+    '''
+    **********************************
+    *** STEP AND ADVANCE FUNCTIONS ***
+    **********************************
+    '''
+
+    # determine the next state of all cyclists (virtual bicycles stand still)
+    def decide(self):
+        P = self.params
+        n = len(self.x)
+        v_lat = np.zeros(n)
+        acceleration = np.zeros(n)
+        self.leader = np.full(n, -1)
+
+        rows = self.decidingRows()
+        if len(rows):
+            Q, J = self.findNeighbors(rows)
+            xi, xj = self.x[rows][Q], self.x[J]
+            ahead = (xj > xi) & (xj < xi+self.cr_length[rows][Q])  # cyclists in consideration range
+            cat1 = ahead & (self.speed[J] <= self.rowParams(rows[Q]).gamma*self.v0[rows][Q])
+            cat12 = ahead & (self.speed[J] <= self.v0[rows][Q])
+
+            des_lat_pos, blocked = self.findLatPos(rows, Q, J, cat1)  # level 1: lateral position
+            v_lat[rows], self.leader[rows], obstr, cut_off_flag = self.findTraj(rows, Q, J, des_lat_pos, cat12, blocked)  # level 2: moving angle and leader
+            acc, dec1, dec2 = self.findAcc(rows, self.leader[rows])  # level 3: accelerations
+            acceleration[rows] = acc - np.minimum(dec1+dec2, self.rowParams(rows).b_max)  # limit total deceleration to b_max
+
+        # calculate the next position and speed
+        stop = self.speed*P.dt + acceleration*P.dt <= 0
+        acceleration[stop] = -self.speed[stop]
+        self.next_x = self.x + self.speed*P.dt + acceleration*0.5*P.dt**2
+        self.next_y = self.y + v_lat*P.dt
+        self.next_speed = self.speed + acceleration*P.dt
+        self.v_lat = v_lat
+
+        # trace decisions
+        if self.trace is not None and len(rows):
+            for r in [r for r in range(len(rows)) if self.trace.traces(self.ids[rows[r]])]:
+                i = rows[r]
+                self.trace.record(self.time_step+1, self.label(i), self.x[i], self.y[i], self.speed[i], self.v0[i], des_lat_pos[r], v_lat[i],
+                                  [self.label(j) for j in J[obstr & (Q == r)]], self.label(self.leader[i]) if self.leader[i] >= 0 else None,
+                                  acc[r], dec1[r], dec2[r], acceleration[i], cut_off_flag[r])
+
+        P = self.rowParams(np.arange(n))
+        self.cr_length = 4 + P.phi*self.next_speed
+        self.sr_length = P.b_length/2 + 0.1 + P.alpha*self.next_speed
+        self.sr_width = P.b_width/2 + 0.1 + P.beta*self.next_speed
+
+    # take the (physical) actions of all cyclists
+    def advance(self):
+        self.x = self.next_x
+        self.y = self.next_y
+        self.speed = self.next_speed
+        self.v_lat_prev = self.v_lat
+        # clear bicycles which finish the trip
+        self.removeBicycles(self.x >= self.params.path_length)
+
+    # jump over the time steps in which no cyclist is on the path (up to the next arrival or the given time step), only the virtual bicycles are recorded
+    def fastForward(self, stop):
+        if (~self.virtual).any():
+            return False
+        if self.inflow_count < len(self.inflow_step):
+            stop = min(stop, self.inflow_step[self.inflow_count])
+        if stop <= self.time_step:
+            return False
+        self.recorder.recordSteps(np.arange(self.time_step+1, stop+1), self.ids, self.x, self.y, self.speed, self.v_lat, self.v0, self.sr_length, self.sr_width, self.cr_length)
+        self.time_step = stop
+        return True
+
+    def step(self):
+        self.decide()
+        self.advance()
+
+        # Add bicycle agents at certain time steps (one per time step, later arrivals wait at the entry)
+        if self.inflow_count < len(self.inflow_step):
+            if self.time_step >= self.inflow_step[self.inflow_count]:
+                self.addBicycle(self.inflow_count)
+                self.inflow_count += 1
+        # Update the time
+        self.time_step += 1
+        self.collect()
+
+    # record the state of all agents in the current step
+    def collect(self):
+        self.recorder.record(self.time_step, self.ids, self.x, self.y, self.speed, self.v_lat, self.v0, self.sr_length, self.sr_width, self.cr_length)